@@ -0,0 +1,384 @@
+'''
+Local stand-in for the subset of the GitHub REST API the package updater uses, backed by the bare repos from generate_packages.py:
+- GET  /orgs/{owner}/repos                        (package registry listing, paginated, with ETag / If-None-Match support)
+- GET  /repos/{owner}/{repo}                      (get_repo, with ETag / If-None-Match support)
+- GET  /repos/{owner}/{repo}/contents/{path}      (get_contents, with ETag / If-None-Match support)
+- PUT  /repos/{owner}/{repo}/contents/{path}      (update_file, committed into the bare repo)
+- GET/POST /repos/{owner}/{repo}/pulls            (create_pull, 422 if the branch already has an open PR)
+- GET/POST /repos/{owner}/{repo}/labels, PATCH/DELETE /repos/{owner}/{repo}/labels/{name}
+- POST /graphql                                   (the batched open-PR lookup and PR mutations of pull_request_batch_lib, the release tags of
+                                                   release_index_lib and the PR checks of pr_watch_lib, one aliased field at a time)
+- GET  /rate_limit
+
+Every request is counted by endpoint so the benchmark can report API usage.
+'''
+# used to decode file contents sent to update_file and encode the ones served by get_contents
+import base64
+
+# used to count requests per endpoint
+import collections
+
+# used to compute ETags and git blob hashes
+import hashlib
+
+# the HTTP server itself
+import http.server
+
+# request and response bodies
+import json
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# used to parse request paths
+import re
+import urllib.parse
+
+# used to read from and commit into the bare repos
+import subprocess
+
+# the server runs in a background thread and handles requests concurrently
+import threading
+
+# used for the rate limit reset time
+import time
+
+class FakeGithub:
+    '''
+    State of the fake GitHub: the bare repos it serves, the PRs and labels created so far, and the request counters.
+    '''
+
+    def __init__(self, repositories_directory: str, owner: str = 'fivetran'):
+        self.repositories_directory = repositories_directory
+        self.owner = owner
+        self.lock = threading.Lock()
+        self.api_calls = collections.Counter()
+        self.pulls = collections.defaultdict(list)
+        self.labels = collections.defaultdict(dict)
+        self.base_url = None
+        # simulated CI: the checks of a PR are pending for ci_seconds after they are first asked about, then pass (or fail for failing_repos)
+        self.ci_seconds = 0
+        self.failing_repos = set()
+        self.check_start_times = {} # (repo name, PR number) -> time its checks were first asked about
+
+    def git(self, repo_name: str, *args, input: bytes = None, env: dict = None) -> bytes:
+        path_to_repository = os.path.join(self.repositories_directory, repo_name + '.git')
+        return subprocess.run(['git', '--git-dir', path_to_repository] + list(args), input=input, env=env,
+                              check=True, capture_output=True).stdout
+
+    def exists(self, repo_name: str) -> bool:
+        return os.path.isdir(os.path.join(self.repositories_directory, repo_name + '.git'))
+
+    def default_branch(self, repo_name: str) -> str:
+        return self.git(repo_name, 'symbolic-ref', '--short', 'HEAD').decode().strip()
+
+    def repo_data(self, repo_name: str) -> dict:
+        url = '%s/repos/%s/%s' %(self.base_url, self.owner, repo_name)
+        head = self.git(repo_name, 'rev-parse', self.default_branch(repo_name)).decode().strip()
+        return {
+            'id': int(hashlib.sha1(repo_name.encode()).hexdigest()[:8], 16),
+            'node_id': 'R_' + repo_name,
+            'name': repo_name,
+            'full_name': '%s/%s' %(self.owner, repo_name),
+            'owner': {'login': self.owner, 'type': 'Organization'},
+            'private': False,
+            'archived': False,
+            'url': url,
+            'html_url': 'https://github.com/%s/%s' %(self.owner, repo_name),
+            'default_branch': self.default_branch(repo_name),
+            'pushed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(self.git(repo_name, 'log', '-1', '--format=%ct', head)))),
+            'labels_url': url + '/labels{/name}',
+        }
+
+    def list_repos(self, page: int, per_page: int) -> list:
+        repo_names = sorted(name[:-len('.git')] for name in os.listdir(self.repositories_directory) if name.endswith('.git'))
+        return [self.repo_data(repo_name) for repo_name in repo_names[(page - 1) * per_page:page * per_page]]
+
+    def content_data(self, repo_name: str, path: str, ref: str) -> dict:
+        ref = ref or self.default_branch(repo_name)
+        content = self.git(repo_name, 'show', '%s:%s' %(ref, path))
+        blob_sha = self.git(repo_name, 'rev-parse', '%s:%s' %(ref, path)).decode().strip()
+        url = '%s/repos/%s/%s/contents/%s' %(self.base_url, self.owner, repo_name, path)
+        return {
+            'type': 'file',
+            'encoding': 'base64',
+            'size': len(content),
+            'name': path.rsplit('/', 1)[-1],
+            'path': path,
+            'content': base64.b64encode(content).decode(),
+            'sha': blob_sha,
+            'url': url,
+            'html_url': 'https://github.com/%s/%s/blob/%s/%s' %(self.owner, repo_name, ref, path),
+        }
+
+    def update_file(self, repo_name: str, path: str, body: dict) -> dict:
+        '''
+        Commits the new file content to the branch with a temporary index, like the contents API does.
+        '''
+        branch = body.get('branch') or self.default_branch(repo_name)
+        parent = self.git(repo_name, 'rev-parse', 'refs/heads/' + branch).decode().strip()
+        blob_sha = self.git(repo_name, 'hash-object', '-w', '--stdin', input=base64.b64decode(body['content'])).decode().strip()
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(self.repositories_directory, repo_name + '.git', 'fake_github_index'),
+                   GIT_AUTHOR_NAME='Fake GitHub', GIT_AUTHOR_EMAIL='fake@example.com', GIT_COMMITTER_NAME='Fake GitHub', GIT_COMMITTER_EMAIL='fake@example.com')
+        self.git(repo_name, 'read-tree', parent, env=env)
+        self.git(repo_name, 'update-index', '--add', '--cacheinfo', '100644,%s,%s' %(blob_sha, path), env=env)
+        tree = self.git(repo_name, 'write-tree', env=env).decode().strip()
+        commit = self.git(repo_name, 'commit-tree', tree, '-p', parent, '-m', body.get('message', 'update'), env=env).decode().strip()
+        self.git(repo_name, 'update-ref', 'refs/heads/' + branch, commit, parent)
+        return {'content': self.content_data(repo_name, path, branch), 'commit': {'sha': commit}}
+
+    def create_pull(self, repo_name: str, body: dict) -> tuple:
+        with self.lock:
+            for pull in self.pulls[repo_name]:
+                if pull['head']['ref'] == body['head'] and pull['state'] == 'open':
+                    return 422, {'message': 'Validation Failed', 'errors': [{'message': 'A pull request already exists for %s:%s.' %(self.owner, body['head'])}]}
+            number = len(self.pulls[repo_name]) + 1
+            pull = {
+                'id': number,
+                'node_id': 'PR_%s_%s' %(repo_name, number),
+                'number': number,
+                'state': 'open',
+                'draft': body.get('draft', False),
+                'title': body['title'],
+                'body': body.get('body'),
+                'head': {'ref': body['head']},
+                'base': {'ref': body['base']},
+                'url': '%s/repos/%s/%s/pulls/%s' %(self.base_url, self.owner, repo_name, number),
+                'html_url': 'https://github.com/%s/%s/pull/%s' %(self.owner, repo_name, number),
+            }
+            self.pulls[repo_name].append(pull)
+        return 201, pull
+
+    def find_pull(self, pull_id: str) -> tuple:
+        for repo_name, pulls in self.pulls.items():
+            for pull in pulls:
+                if pull['node_id'] == pull_id:
+                    return repo_name, pull
+        return None, None
+
+    def get_pull_checks(self, repo_name: str, number: int) -> dict:
+        '''
+        Returns a PR with the statusCheckRollup of its head commit, the way pr_watch_lib asks for it, or None if there is no such PR.
+        '''
+        pulls = [pull for pull in self.pulls[repo_name] if pull['number'] == number]
+        if not pulls:
+            return None
+        pull = pulls[0]
+        with self.lock:
+            started = self.check_start_times.setdefault((repo_name, number), time.time())
+        if time.time() - started < self.ci_seconds:
+            state = 'PENDING'
+        else:
+            state = 'FAILURE' if repo_name in self.failing_repos else 'SUCCESS'
+        commit = self.git(repo_name, 'rev-parse', 'refs/heads/' + pull['head']['ref']).decode().strip()
+        context = {'__typename': 'StatusContext', 'context': 'buildkite/' + repo_name, 'state': state,
+                   'targetUrl': 'https://buildkite.com/%s/%s/builds/%s' %(self.owner, repo_name, number)}
+        return {'state': 'OPEN' if pull['state'] == 'open' else 'CLOSED',
+                'commits': {'nodes': [{'commit': {'oid': commit, 'statusCheckRollup': {'state': state, 'contexts': {'nodes': [context]}}}}]}}
+
+    def resolve_field(self, name: str, arguments: dict, selection: str):
+        '''
+        Answers one top-level field of a GraphQL document, with its arguments already resolved from the variables.
+        '''
+        if name == 'user':
+            return {'id': 'U_' + arguments['login']}
+        if name == 'repository':
+            repo_name = arguments['name']
+            if arguments['owner'] != self.owner or not self.exists(repo_name):
+                return None
+            branch = re.search(r'headRefName: \$(\w+)', selection)
+            result = {'id': 'R_' + repo_name, 'pullRequests': {'nodes': []}}
+            for alias, label_name in re.findall(r'(\w+): label\(name: \$(\w+)\)', selection):
+                label_name = arguments['variables'][label_name]
+                result[alias] = {'id': 'LA_%s_%s' %(repo_name, label_name)} if label_name in self.labels[repo_name] else None
+            for alias, number in re.findall(r'(\w+): pullRequest\(number: (\d+)\)', selection):
+                result[alias] = self.get_pull_checks(repo_name, int(number))
+            if 'refs(' in selection:
+                tags = self.git(repo_name, 'for-each-ref', '--sort=-creatordate', '--format=%(refname:short)', 'refs/tags/').decode().split()
+                result['refs'] = {'nodes': [{'name': tag} for tag in tags]}
+            if branch:
+                head = arguments['variables'][branch.group(1)]
+                result['pullRequests']['nodes'] = [{'id': pull['node_id'], 'number': pull['number'], 'url': pull['html_url'], 'title': pull['title'], 'body': pull['body']}
+                                                   for pull in self.pulls[repo_name] if pull['head']['ref'] == head and pull['state'] == 'open']
+            return result
+        mutation_input = arguments['input']
+        if name == 'createPullRequest':
+            repo_name = mutation_input['repositoryId'][len('R_'):]
+            status, pull = self.create_pull(repo_name, {'title': mutation_input['title'], 'body': mutation_input.get('body'), 'draft': mutation_input.get('draft', False),
+                                                        'head': mutation_input['headRefName'], 'base': mutation_input['baseRefName']})
+            if status != 201:
+                raise ValueError(pull['errors'][0]['message'])
+            return {'pullRequest': {'id': pull['node_id'], 'number': pull['number'], 'url': pull['html_url']}}
+        if name == 'updatePullRequest':
+            with self.lock:
+                repo_name, pull = self.find_pull(mutation_input['pullRequestId'])
+                if pull is None:
+                    raise ValueError("Could not resolve to a node with the global id of '%s'" %(mutation_input['pullRequestId']))
+                pull.update({key: mutation_input[key] for key in ('title', 'body') if key in mutation_input})
+            return {'pullRequest': {'id': pull['node_id'], 'url': pull['html_url']}}
+        if name in ('addLabelsToLabelable', 'addAssigneesToAssignable', 'requestReviews'):
+            return {'clientMutationId': None}
+        raise ValueError("Field '%s' doesn't exist" %(name))
+
+    def graphql(self, body: dict) -> dict:
+        '''
+        Runs a GraphQL document made of aliased top-level fields, the way pull_request_batch_lib writes them.
+        '''
+        document, variables = body['query'], body.get('variables') or {}
+        fields = list(re.finditer(r'(\w+): (\w+)\(([^)]*)\)', document))
+        top_level = [field for field in fields if field.group(2) in ('repository', 'user') or field.group(2) in MUTATION_FIELDS]
+        data, errors = {}, []
+        for number, field in enumerate(top_level):
+            end = top_level[number + 1].start() if number + 1 < len(top_level) else len(document)
+            arguments = {key: variables[value] for key, value in re.findall(r'(\w+): \$(\w+)', field.group(3))}
+            arguments['variables'] = variables
+            try:
+                data[field.group(1)] = self.resolve_field(field.group(2), arguments, document[field.end():end])
+                if data[field.group(1)] is None:
+                    errors.append({'type': 'NOT_FOUND', 'path': [field.group(1)], 'message': 'Could not resolve to a Repository.'})
+            except ValueError as error:
+                data[field.group(1)] = None
+                errors.append({'path': [field.group(1)], 'message': str(error)})
+        return {'data': data, 'errors': errors} if errors else {'data': data}
+
+## The mutations the fake GraphQL API knows
+MUTATION_FIELDS = ['createPullRequest', 'updatePullRequest', 'addLabelsToLabelable', 'addAssigneesToAssignable', 'requestReviews']
+
+def make_handler(fake: FakeGithub):
+    '''
+    Builds the request handler class bound to a FakeGithub.
+    '''
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass # keep the benchmark output readable
+
+        def send_json(self, status: int, data, etag: str = None) -> None:
+            body = json.dumps(data).encode() if data is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-RateLimit-Limit', '5000')
+            self.send_header('X-RateLimit-Remaining', str(max(0, 5000 - sum(fake.api_calls.values()))))
+            self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+            if etag:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_cacheable(self, data) -> None:
+            etag = '"%s"' %(hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                self.send_json(304, None, etag)
+            else:
+                self.send_json(200, data, etag)
+
+        def read_body(self) -> dict:
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length)) if length else {}
+
+        def route(self, method: str) -> None:
+            parsed = urllib.parse.urlparse(self.path)
+            query = dict(urllib.parse.parse_qsl(parsed.query))
+            path = re.sub('^/api/v3', '', parsed.path)
+            if path == '/rate_limit':
+                with fake.lock:
+                    fake.api_calls['rate_limit'] += 1
+                return self.send_json(200, {'resources': {'core': {'limit': 5000, 'remaining': 5000, 'reset': int(time.time()) + 3600, 'used': 0}},
+                                            'rate': {'limit': 5000, 'remaining': 5000, 'reset': int(time.time()) + 3600, 'used': 0}})
+
+            if parsed.path in ('/graphql', '/api/graphql') and method == 'POST':
+                with fake.lock:
+                    fake.api_calls['POST graphql'] += 1
+                return self.send_json(200, fake.graphql(self.read_body()))
+
+            if path == '/orgs/%s/repos' %(fake.owner) and method == 'GET':
+                with fake.lock:
+                    fake.api_calls['GET org repos'] += 1
+                return self.send_cacheable(fake.list_repos(int(query.get('page', 1)), int(query.get('per_page', 30))))
+
+            match = re.match(r'^/repos/([^/]+)/([^/]+)(?:/(contents|pulls|labels)(?:/(.*))?)?$', path)
+            if not match or not fake.exists(match.group(2)):
+                return self.send_json(404, {'message': 'Not Found'})
+            repo_name, resource, rest = match.group(2), match.group(3), urllib.parse.unquote(match.group(4) or '')
+            with fake.lock:
+                fake.api_calls['%s %s' %(method, resource or 'repo')] += 1
+
+            try:
+                if resource is None and method == 'GET':
+                    return self.send_cacheable(fake.repo_data(repo_name))
+                if resource == 'contents' and method == 'GET':
+                    return self.send_cacheable(fake.content_data(repo_name, rest, query.get('ref')))
+                if resource == 'contents' and method == 'PUT':
+                    return self.send_json(200, fake.update_file(repo_name, rest, self.read_body()))
+                if resource == 'pulls' and method == 'GET':
+                    with fake.lock:
+                        pulls = [pull for pull in fake.pulls[repo_name] if query.get('state', 'open') in ('all', pull['state'])]
+                    return self.send_json(200, pulls)
+                if resource == 'pulls' and method == 'POST':
+                    return self.send_json(*fake.create_pull(repo_name, self.read_body()))
+                if resource == 'labels':
+                    return self.route_labels(method, repo_name, rest)
+            except subprocess.CalledProcessError:
+                return self.send_json(404, {'message': 'Not Found'})
+            return self.send_json(404, {'message': 'Not Found'})
+
+        def route_labels(self, method: str, repo_name: str, label_name: str) -> None:
+            labels = fake.labels[repo_name]
+            url = '%s/repos/%s/%s/labels/' %(fake.base_url, fake.owner, repo_name)
+            with fake.lock:
+                if method == 'GET' and not label_name:
+                    return self.send_json(200, list(labels.values()))
+                if method == 'POST':
+                    body = self.read_body()
+                    label = {'name': body['name'], 'color': body.get('color', 'ededed'), 'description': body.get('description'), 'url': url + urllib.parse.quote(body['name'])}
+                    labels[body['name']] = label
+                    return self.send_json(201, label)
+                if label_name not in labels:
+                    return self.send_json(404, {'message': 'Not Found'})
+                if method == 'PATCH':
+                    body = self.read_body()
+                    label = dict(labels.pop(label_name), **{key: value for key, value in body.items() if key != 'new_name'})
+                    label['name'] = body.get('new_name', label_name)
+                    label['url'] = url + urllib.parse.quote(label['name'])
+                    labels[label['name']] = label
+                    return self.send_json(200, label)
+                if method == 'DELETE':
+                    del labels[label_name]
+                    return self.send_json(204, None)
+                return self.send_json(200, labels[label_name])
+
+        def do_GET(self):
+            self.route('GET')
+
+        def do_POST(self):
+            self.route('POST')
+
+        def do_PUT(self):
+            self.route('PUT')
+
+        def do_PATCH(self):
+            self.route('PATCH')
+
+        def do_DELETE(self):
+            self.route('DELETE')
+
+    return Handler
+
+def start_server(repositories_directory: str, owner: str = 'fivetran') -> tuple:
+    '''
+    Starts the fake GitHub API on a free local port in a background thread.
+
+    Args:
+    - repositories_directory: folder with the bare repos (from generate_packages.py)
+    - owner: organization the repos are served under
+
+    Returns:
+    - the FakeGithub state (with its base_url set) and the running server (call server.shutdown() to stop it)
+    '''
+    fake = FakeGithub(repositories_directory, owner)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), make_handler(fake))
+    fake.base_url = 'http://127.0.0.1:%s' %(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return fake, server
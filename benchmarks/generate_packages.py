@@ -0,0 +1,156 @@
+'''
+Generates synthetic dbt packages as local bare git repos, for benchmarking the package updater offline.
+
+    python benchmarks/generate_packages.py --output /tmp/bench --packages 5 --files 500 --directories 20 --history 50
+'''
+# used to parse the command line options
+import argparse
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# used to run `git fast-import`, which builds a repo's whole history from a single stream much faster than committing file by file
+import subprocess
+
+# used to pick which files each commit of the generated history touches (seeded, so every run generates the same packages)
+import random
+
+MODEL_TEMPLATE = '''with base as (
+
+    select *
+    from {{{{ ref('stg_{package}__{name}_tmp') }}}}
+
+), fields as (
+
+    select
+        {{{{
+            fivetran_utils.fill_staging_columns(
+                source_columns=adapter.get_columns_in_relation(ref('stg_{package}__{name}_tmp')),
+                staging_columns=get_{name}_columns()
+            )
+        }}}}
+        {{{{ fivetran_utils.source_relation(
+            union_schema_variable='{package}_union_schemas',
+            union_database_variable='{package}_union_databases')
+        }}}}
+    from base
+
+), final as (
+
+    select
+        source_relation,
+        id as {name}_id,
+        _fivetran_synced,
+        connector_id,
+        updated_at -- revision {revision}
+    from fields
+)
+
+select *
+from final
+'''
+
+SCHEMA_TEMPLATE = '''version: 2
+
+models:
+  - name: stg_{package}__{name}
+    description: Each record represents a {name} in the starter connector.
+    columns:
+      - name: {name}_id
+        description: Unique identifier of the {name}.
+        tests:
+          - unique
+          - not_null
+'''
+
+def get_package_files(package: str, num_files: int, num_directories: int, upstream_package: str = None) -> dict:
+    '''
+    Returns the files of a synthetic dbt package as {path: content}: project files, packages.yml (depending on `upstream_package` if given),
+    CI config, and `num_files` models/schema files spread over `num_directories` folders.
+    '''
+    files = {
+        'dbt_project.yml': "name: 'dbt_%s'\nversion: '0.6.0'\nconfig-version: 2\nrequire-dbt-version: [\">=1.3.0\", \"<2.0.0\"]\n" %(package),
+        'integration_tests/dbt_project.yml': "name: '%s_integration_tests'\nversion: '0.6.0'\nconfig-version: 2\nprofile: 'integration_tests'\n" %(package),
+        'packages.yml': "packages:\n  - package: fivetran/fivetran_utils\n    version: [\">=0.4.0\", \"<0.5.0\"]\n"
+                        + ("  - package: fivetran/%s\n    version: [\">=0.6.0\", \"<0.7.0\"]\n" %(upstream_package) if upstream_package else ""),
+        'integration_tests/packages.yml': "packages:\n  - local: ../\n",
+        '.circleci/config.yml': "version: 2\njobs:\n  build:\n    docker:\n      - image: circleci/python:3.7\n",
+        '.buildkite/scripts/run_models.sh': "#!/bin/bash\nset -euo pipefail\ndbt deps\ndbt seed --target \"$db\" --full-refresh\ndbt run --target \"$db\" --full-refresh\n",
+        'README.md': "# dbt_%s\n\nSynthetic package generated for benchmarking the package updater.\n" %(package),
+    }
+    for file_number in range(num_files):
+        directory = 'models/%s_%s' %('staging' if file_number % 2 else 'intermediate', file_number % max(1, num_directories))
+        name = 'table_%s' %(file_number)
+        if file_number % 5 == 4:
+            files['%s/stg_%s__%s.yml' %(directory, package, name)] = SCHEMA_TEMPLATE.format(package=package, name=name)
+        else:
+            files['%s/stg_%s__%s.sql' %(directory, package, name)] = MODEL_TEMPLATE.format(package=package, name=name, revision=0)
+    return files
+
+def write_fast_import_blob(stream: list, path: str, content: str) -> None:
+    '''
+    Adds a file modification with inline content to a `git fast-import` stream.
+    '''
+    data = content.encode()
+    stream.append(b'M 100644 inline ' + path.encode() + b'\n')
+    stream.append(b'data %d\n' %(len(data)))
+    stream.append(data + b'\n')
+
+def generate_package(output_directory: str, package: str, num_files: int, num_directories: int, history_depth: int, upstream_package: str = None) -> str:
+    '''
+    Creates `output_directory/dbt_<package>.git`, a bare repo whose `main` branch has `history_depth` commits.
+    The first commit adds every file, each later commit edits about 1% of the models.
+
+    Returns:
+    - path to the bare repo
+    '''
+    path_to_repository = os.path.join(output_directory, 'dbt_%s.git' %(package))
+    subprocess.run(['git', 'init', '--quiet', '--bare', '--initial-branch=main', path_to_repository], check=True)
+
+    files = get_package_files(package, num_files, num_directories, upstream_package)
+    models = sorted(path for path in files if path.endswith('.sql') and path.startswith('models/'))
+    randomizer = random.Random(package)
+    stream = []
+    for commit_number in range(max(1, history_depth)):
+        message = b'initial commit' if commit_number == 0 else b'update models (%d)' %(commit_number)
+        stream.append(b'commit refs/heads/main\n')
+        stream.append(b'committer Benchmark <benchmark@example.com> %d +0000\n' %(1700000000 + commit_number * 60))
+        stream.append(b'data %d\n%s\n' %(len(message), message))
+        if commit_number == 0:
+            for path, content in sorted(files.items()):
+                write_fast_import_blob(stream, path, content)
+        else:
+            for path in randomizer.sample(models, max(1, len(models) // 100)) if models else []:
+                name = path.rsplit('__', 1)[-1][:-len('.sql')]
+                write_fast_import_blob(stream, path, MODEL_TEMPLATE.format(package=package, name=name, revision=commit_number))
+        stream.append(b'\n')
+    subprocess.run(['git', '--git-dir', path_to_repository, 'fast-import', '--quiet'], input=b''.join(stream), check=True)
+    return path_to_repository
+
+def generate_packages(output_directory: str, num_packages: int, num_files: int, num_directories: int, history_depth: int) -> list:
+    '''
+    Generates `num_packages` synthetic packages named dbt_bench_<n> in `output_directory`.
+    Every odd-numbered package depends on the package before it, so rollouts of them run in two dependency waves.
+
+    Returns:
+    - list of repo names
+    '''
+    os.makedirs(output_directory, exist_ok=True)
+    repo_names = []
+    for package_number in range(num_packages):
+        package = 'bench_%s' %(package_number)
+        upstream_package = 'bench_%s' %(package_number - 1) if package_number % 2 else None
+        generate_package(output_directory, package, num_files, num_directories, history_depth, upstream_package)
+        repo_names.append('dbt_' + package)
+    return repo_names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic dbt packages as local bare git repos.")
+    parser.add_argument('--output', required=True, help="folder the bare repos are written to")
+    parser.add_argument('--packages', type=int, default=5, help="number of packages")
+    parser.add_argument('--files', type=int, default=500, help="number of model/schema files per package")
+    parser.add_argument('--directories', type=int, default=20, help="number of model folders per package")
+    parser.add_argument('--history', type=int, default=50, help="number of commits per package")
+    args = parser.parse_args()
+    for repo_name in generate_packages(args.output, args.packages, args.files, args.directories, args.history):
+        print (u'\u2713', "Generated %s" %(repo_name))
@@ -0,0 +1,200 @@
+'''
+Offline end-to-end benchmark of the package updater: generates synthetic packages as local bare repos, starts the fake GitHub API,
+runs main.main() against them and reports wall time, per-stage timings, API call counts and peak memory.
+
+    python benchmarks/run_benchmark.py --packages 10 --files 1000 --history 100 --clone-mode mirror --runs 2
+
+The first run is cold (nothing cached), later runs show the cost of re-running the same rollout.
+'''
+# used to parse the command line options
+import argparse
+
+# used to count stage timings
+import collections
+
+# used to send the rollout's own output to a log file instead of the console
+import contextlib
+
+# used to time each stage of the pipeline by wrapping the functions main.py calls
+import functools
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# used to read peak memory usage of this process and its git subprocesses
+import resource
+
+# high-level interface to the operating system's file manipulation functions. It provides a number of functions for copying, moving, deleting, and renaming files and directories.
+import shutil
+
+# gives us access to the import path
+import sys
+
+# the benchmark workspace is a temporary folder unless --workspace is given
+import tempfile
+
+# used to time runs and stages
+import threading
+import time
+
+# allows you to read, write, and parse YAML files
+import yaml
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+# local stuff
+import main
+import repo_lib
+import file_index_lib
+import pull_request_lib as pr_lib
+import commit_builder_lib
+import change_set_lib
+import pull_request_batch_lib
+import generate_packages
+import fake_github_server
+
+## The pipeline functions timed as stages: (module or class, function name, stage name). The in-memory commit-mode has its own stage/commit functions
+STAGES = [
+    (repo_lib, 'clone_repo', 'clone'),
+    (file_index_lib, 'get_file_paths', 'get_file_paths'),
+    (main, 'get_candidate_paths', 'search_index'),
+    (change_set_lib, 'apply_package_updates', 'transform'),
+    (pr_lib, 'stage_changes', 'stage'),
+    (commit_builder_lib.TreeEditor, 'write_tree', 'stage'),
+    (pr_lib, 'commit_changes', 'commit'),
+    (commit_builder_lib, 'commit_tree', 'commit'),
+    (pr_lib, 'push_branches', 'push'),
+    (pull_request_batch_lib.PullRequestBatch, 'submit', 'pull_request'),
+]
+
+class StageTimer:
+    '''
+    Wraps the pipeline functions in STAGES so that every call adds its duration to the stage's total.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.originals = []
+
+    def wrap(self, module, function_name: str, stage: str) -> None:
+        original = getattr(module, function_name)
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.seconds[stage] += time.perf_counter() - start
+                    self.calls[stage] += 1
+        setattr(module, function_name, timed)
+        self.originals.append((module, function_name, original))
+
+    def __enter__(self):
+        for module, function_name, stage in STAGES:
+            self.wrap(module, function_name, stage)
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, function_name, original in reversed(self.originals):
+            setattr(module, function_name, original)
+
+def write_workspace(workspace: str, repo_names: list, base_url: str, clone_mode: str, max_parallel_repos: int, commit_mode: str, transform_workers: int) -> None:
+    '''
+    Writes the package_manager.yml, credentials.yml, files_to_add/ and pull_request_body.md the benchmark runs main.main() with.
+    The rollout config is this repo's own package_manager.yml pointed at the synthetic packages.
+    '''
+    with open(os.path.join(ROOT_DIRECTORY, 'package_manager.yml')) as file:
+        config = yaml.safe_load(file)
+    config.update({'repositories': repo_names, 'clone-mode': clone_mode, 'max-parallel-repos': max_parallel_repos, 'commit-mode': commit_mode,
+                   'transform-workers': transform_workers, 'watch-interval-seconds': 1, 'watch-max-interval-seconds': 4,
+                   'branch-name': 'MagicBot/benchmark', 'find-and-replace': config.get('find-and-replace') or []})
+    with open(os.path.join(workspace, 'package_manager.yml'), 'w') as file:
+        yaml.safe_dump(config, file, sort_keys=False)
+    with open(os.path.join(workspace, 'credentials.yml'), 'w') as file:
+        yaml.safe_dump({'access_token': 'benchmark', 'ssh_key': '/dev/null', 'github_base_url': base_url,
+                        'repository_author_name': 'Benchmark', 'repository_author_email': 'benchmark@example.com'}, file)
+    shutil.copytree(os.path.join(ROOT_DIRECTORY, 'files_to_add'), os.path.join(workspace, 'files_to_add'), dirs_exist_ok=True)
+    shutil.copy(os.path.join(ROOT_DIRECTORY, 'pull_request_body.md'), workspace)
+
+def print_report(run_number: int, wall_seconds: float, timer: StageTimer, api_calls: collections.Counter, num_repos: int) -> None:
+    '''
+    Prints the results of one benchmark run.
+    '''
+    print ("\nRun %s: %.2fs wall time for %s repositories (%.2fs per repo)" %(run_number, wall_seconds, num_repos, wall_seconds / max(1, num_repos)))
+    print ("  %-16s %10s %8s %10s" %('stage', 'total (s)', 'calls', 'avg (s)'))
+    for stage in dict.fromkeys(stage for module, function_name, stage in STAGES):
+        if timer.calls[stage]:
+            print ("  %-16s %10.3f %8s %10.3f" %(stage, timer.seconds[stage], timer.calls[stage], timer.seconds[stage] / timer.calls[stage]))
+    print ("  API calls served by the fake GitHub: %s" %(sum(api_calls.values())))
+    for endpoint, count in sorted(api_calls.items()):
+        print ("    %s: %s" %(endpoint, count))
+    print ("  Peak memory: %.1f MB (python), %.1f MB (largest git subprocess)" %(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024))
+
+def run_benchmark(workspace: str, num_packages: int, num_files: int, num_directories: int, history_depth: int,
+                  clone_mode: str, max_parallel_repos: int, runs: int, commit_mode: str = 'worktree', transform_workers: int = 1,
+                  watch: bool = False, ci_seconds: int = 3, failing_checks: int = 0) -> None:
+    '''
+    Generates the packages, starts the fake GitHub API and runs the rollout `runs` times, printing a report after each run.
+    With `watch`, the checks of the PRs are then followed with main.watch_pull_requests() against the fake CI, whose checks take
+    `ci_seconds` and fail for the first `failing_checks` packages.
+    '''
+    remotes_directory = os.path.join(workspace, 'remotes')
+    print ("Generating %s packages with %s files and %s commits each in %s..." %(num_packages, num_files, history_depth, remotes_directory))
+    repo_names = generate_packages.generate_packages(remotes_directory, num_packages, num_files, num_directories, history_depth)
+    fake, server = fake_github_server.start_server(remotes_directory)
+    write_workspace(workspace, repo_names, fake.base_url, clone_mode, max_parallel_repos, commit_mode, transform_workers)
+
+    # send the ssh links main.py builds to the local bare repos instead of github.com
+    os.environ.update({'GIT_CONFIG_COUNT': '1', 'GIT_CONFIG_KEY_0': 'url.%s/.insteadOf' %(remotes_directory),
+                       'GIT_CONFIG_VALUE_0': 'git@github.com:fivetran/'})
+    current_directory = os.getcwd()
+    os.chdir(workspace)
+    try:
+        for run_number in range(1, runs + 1):
+            fake.api_calls.clear()
+            with StageTimer() as timer, open(os.path.join(workspace, 'run_%s.log' %(run_number)), 'w') as log_file, \
+                    contextlib.redirect_stdout(log_file):
+                start = time.perf_counter()
+                main.main(restart=True)
+                wall_seconds = time.perf_counter() - start
+            print_report(run_number, wall_seconds, timer, fake.api_calls, len(repo_names))
+        if watch:
+            fake.api_calls.clear()
+            fake.ci_seconds, fake.failing_repos = ci_seconds, set(repo_names[:failing_checks])
+            with open(os.path.join(workspace, 'watch.log'), 'w') as log_file, contextlib.redirect_stdout(log_file):
+                start = time.perf_counter()
+                counts = main.watch_pull_requests()
+                wall_seconds = time.perf_counter() - start
+            print ("\nWatch: %.2fs until the checks of every PR finished: %s" %(wall_seconds, ", ".join("%s %s" %(count, result) for result, count in sorted(counts.items()))))
+            print ("  API calls served by the fake GitHub: %s" %(sum(fake.api_calls.values())))
+            for endpoint, count in sorted(fake.api_calls.items()):
+                print ("    %s: %s" %(endpoint, count))
+    finally:
+        os.chdir(current_directory)
+        server.shutdown()
+    print ("\nRollout logs and the generated packages are in %s" %(workspace))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the package updater.")
+    parser.add_argument('--workspace', help="folder to run in (default: a new temporary folder)")
+    parser.add_argument('--packages', type=int, default=5, help="number of synthetic packages")
+    parser.add_argument('--files', type=int, default=500, help="number of model/schema files per package")
+    parser.add_argument('--directories', type=int, default=20, help="number of model folders per package")
+    parser.add_argument('--history', type=int, default=50, help="number of commits per package")
+    parser.add_argument('--clone-mode', default='mirror', choices=['full', 'shallow', 'partial', 'mirror'])
+    parser.add_argument('--commit-mode', default='worktree', choices=['worktree', 'in-memory'])
+    parser.add_argument('--max-parallel-repos', type=int, default=8)
+    parser.add_argument('--transform-workers', type=int, default=1, help="processes find-and-replace spreads each repo's files over")
+    parser.add_argument('--runs', type=int, default=2, help="number of times the rollout is run (the first one is cold)")
+    parser.add_argument('--watch', action='store_true', help="then follow the checks of the PRs (main.py --watch) against a simulated CI")
+    parser.add_argument('--ci-seconds', type=int, default=3, help="how long the simulated CI checks of each PR take")
+    parser.add_argument('--failing-checks', type=int, default=0, help="number of packages whose simulated CI checks fail")
+    args = parser.parse_args()
+    run_benchmark(args.workspace or tempfile.mkdtemp(prefix='package_updater_benchmark_'), args.packages, args.files, args.directories,
+                  args.history, args.clone_mode, args.max_parallel_repos, args.runs, args.commit_mode, args.transform_workers,
+                  args.watch, args.ci_seconds, args.failing_checks)
@@ -0,0 +1,393 @@
+# used to bind the arguments of each planned edit
+import functools
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# high-level interface to the operating system's file manipulation functions. It provides a number of functions for copying, moving, deleting, and renaming files and directories.
+import shutil
+
+# ruamel.yaml is a YAML 1.2 loader/dumper package for Python. It is a fork of the PyYAML library
+import ruamel.yaml
+
+#  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
+import git
+
+# local stuff
+import package_updates
+import process_pool_lib
+import commit_builder_lib
+
+## The edits of a file are applied in this order, whatever order they were planned in
+PHASES = ['add-to-file', 'find-and-replace', 'project-version', 'package-versions']
+
+class ChangeConflict(Exception):
+    '''
+    Raised when the configured package updates disagree about a file, ie a file that is both added and removed.
+    '''
+
+class WorktreeFiles:
+    '''
+    The files of a checked-out repo, with the same interface as commit_builder_lib.TreeEditor so a ChangeSet can be applied to either.
+
+    Paths are relative to the repo root, ie 'models/stg_jira__issue.sql'.
+    '''
+
+    def __init__(self, path_to_repository: str, cloned_repository: git.Repo = None, streaming_threshold: int = package_updates.STREAMING_MIN_BYTES):
+        self.path_to_repository = path_to_repository
+        self.streaming_threshold = streaming_threshold # files bigger than this many bytes are streamed instead of being read whole
+        self.base_tree = cloned_repository.head.commit.tree if cloned_repository is not None else None # the checked out commit
+
+    def get_path(self, path: str) -> str:
+        return os.path.join(self.path_to_repository, path.strip('/'))
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(self.get_path(path))
+
+    def get_blob(self, path: str) -> tuple:
+        '''
+        Returns (blob sha, mode) of a file in the checked out commit, without reading it, or None if it isn't there.
+        '''
+        if self.base_tree is None:
+            return None
+        try:
+            blob = self.base_tree / path.strip('/')
+        except KeyError:
+            return None
+        return (blob.hexsha, blob.mode) if blob.type == 'blob' else None
+
+    def read_bytes(self, path: str) -> bytes:
+        '''
+        Returns the current content of a file, or None if it doesn't exist.
+        '''
+        if not os.path.isfile(self.get_path(path)):
+            return None
+        with open(self.get_path(path), 'rb') as file:
+            return file.read()
+
+    def read(self, path: str) -> str:
+        content = self.read_bytes(path)
+        return content.decode() if content is not None else None
+
+    def write(self, path: str, content, mode: int = None) -> None:
+        '''
+        Sets the content (str or bytes) of a file, creating its folders if needed. Existing files keep their mode unless `mode` is given.
+        '''
+        path_to_repository_file = self.get_path(path)
+        os.makedirs(os.path.dirname(path_to_repository_file), exist_ok=True)
+        with open(path_to_repository_file, 'wb') as file:
+            file.write(content.encode() if isinstance(content, str) else content)
+        if mode is not None:
+            os.chmod(path_to_repository_file, 0o755 if mode == commit_builder_lib.EXECUTABLE_MODE else 0o644)
+
+    def is_large(self, path: str) -> bool:
+        return os.path.isfile(self.get_path(path)) and os.path.getsize(self.get_path(path)) > self.streaming_threshold
+
+    def stream_edits(self, path: str, top_lines: list, bottom_lines: list, replacement_items: tuple) -> dict:
+        '''
+        Adds lines to and find-and-replaces a large file in chunks, see package_updates.stream_file().
+        '''
+        return package_updates.stream_file(self.get_path(path), replacement_items, top_lines, bottom_lines)
+
+    def remove(self, path: str) -> None:
+        '''
+        Removes a file, or a folder with everything in it.
+        '''
+        if os.path.isdir(self.get_path(path)):
+            shutil.rmtree(self.get_path(path))
+        else:
+            os.remove(self.get_path(path))
+
+    def replace_in_files(self, file_paths: list, replacement_items: tuple, workers: int = 1) -> list:
+        '''
+        Applies find-and-replace rules to files that no other update touches, on the process pool for large repos (see package_updates.find_and_replace_shard()).
+
+        Returns:
+        - list of (file path, {find string: number of replacements}) for every file that changed, (file path, None) for files that don't exist
+          and (file path, error message) for files that aren't UTF-8 text
+        '''
+        if workers > 1 and len(file_paths) >= package_updates.PARALLEL_MIN_FILES:
+            return process_pool_lib.map_shards(package_updates.find_and_replace_shard, list(file_paths), workers, os.path.abspath(self.path_to_repository),
+                                               replacement_items, self.streaming_threshold)
+        return package_updates.find_and_replace_shard(file_paths, self.path_to_repository, replacement_items, self.streaming_threshold)
+
+def is_under(path: str, folder: str) -> bool:
+    '''
+    Checks whether `path` is `folder` itself or anything inside it.
+    '''
+    folder = folder.strip('/')
+    return path == folder or path.startswith(folder + '/')
+
+def add_line(content: str, path: str, new_line: str, insert_at_top: bool) -> tuple:
+    new_content = package_updates.add_line_to_content(content, new_line, insert_at_top)
+    print (u'\u2713', "%s successfully added to the %s of file %s..."%(new_line, 'top' if insert_at_top else 'bottom', path))
+    return new_content, new_line
+
+def replace_texts(content: str, path: str, replacement_items: tuple) -> tuple:
+    new_content, hits = package_updates.apply_find_and_replace(content, package_updates.compile_replacements(replacement_items), dict(replacement_items))
+    return new_content, hits or None
+
+def bump_project(content: str, path: str, config: dict, bump_version: bool = True) -> tuple:
+    new_content, old_version, new_version, dbt_version_set = package_updates.bump_project_file(content, config, is_root_project=(path == "dbt_project.yml"),
+                                                                                               bump_version=bump_version)
+    if bump_version:
+        print (u'\u2713', "%s version bumped from %s to %s..." %(path, old_version, new_version))
+    if dbt_version_set:
+        print (u'\u2713', "%s require-dbt-version set to %s..." %(path, package_updates.format_dbt_version_range(config["require-dbt-version"])))
+    return new_content, new_version
+
+def set_dependency_versions(content: str, path: str, dependency_versions: dict, latest_versions: dict) -> tuple:
+    if path == package_updates.README_FILE:
+        new_content, updated_packages = package_updates.set_readme_package_versions(content, dependency_versions, latest_versions)
+    else:
+        new_content, updated_packages = package_updates.set_package_versions(content, dependency_versions, latest_versions)
+    for package, version_range in updated_packages:
+        print (u'\u2713', "%s: %s set to %s..." %(path, package, package_updates.format_dbt_version_range(version_range)))
+    return new_content, updated_packages or None
+
+class ChangeSet:
+    '''
+    All the updates a repo gets, planned up front and keyed by path, then applied with one read and at most one write per file.
+
+    Files are added (files-to-add), removed (files-to-remove) or edited. The edits of a file are applied in PHASES order
+    (add-to-file, find-and-replace, project-version, package-versions), so the result doesn't depend on the order the updates were planned in.
+    Updates that disagree about a file (ie a file that is both added and removed, or added twice with different content)
+    are reported together by check() before anything is written.
+    '''
+
+    def __init__(self, files):
+        self.files = files # WorktreeFiles or commit_builder_lib.TreeEditor
+        self.added = {} # path -> (content bytes, mode, blob sha)
+        self.removed = [] # files and folders
+        self.edits = {} # path -> list of (phase, function(content, path) -> (new content, result))
+        self.replace_paths = [] # files the find-and-replace rules apply to
+        self.candidate_paths = None # files the search index says the find strings may be in, None if every file may match
+        self.replacement_items = ()
+        self.conflicts = []
+
+    def add_file(self, path: str, content: bytes, mode: int, blob_sha: str = None) -> None:
+        path = path.strip('/')
+        blob_sha = blob_sha or package_updates.hash_blob(content)
+        if path in self.added and self.added[path][2] != blob_sha:
+            self.conflicts.append("%s is added twice with different content" %(path))
+        self.added[path] = (content, mode, blob_sha)
+
+    def add_files(self, manifest: dict) -> None:
+        '''
+        Plans files-to-add, from the manifest of files_to_add/ (see package_updates.get_files_to_add_manifest()).
+        '''
+        for path, (content, executable, blob_sha) in manifest.items():
+            self.add_file(path, content, commit_builder_lib.EXECUTABLE_MODE if executable else commit_builder_lib.FILE_MODE, blob_sha)
+
+    def remove(self, file_paths: list) -> None:
+        '''
+        Plans files-to-remove (files or folders).
+        '''
+        self.removed += [file.strip('/') for file in file_paths or []]
+
+    def edit(self, path: str, phase: str, function) -> None:
+        '''
+        Plans an edit of a file. `function(content, path)` returns the new content and what the edit reports (ie find-and-replace hits).
+        '''
+        self.edits.setdefault(path.strip('/'), []).append((phase, function))
+
+    def add_to_files(self, files_to_add_to: list) -> None:
+        '''
+        Plans files-to-add-to (see package_updates.add_line_to_content()).
+        '''
+        for rule in files_to_add_to or []:
+            for file in rule['file_paths']:
+                self.edit(file, 'add-to-file', functools.partial(add_line, new_line=rule['new_line'], insert_at_top=rule['insert_at_top']))
+
+    def find_and_replace(self, file_paths: list, find_and_replace_texts: list, candidate_paths: set = None) -> None:
+        '''
+        Plans the find-and-replace rules for the indexed files (see package_updates.compile_find_and_replace()).
+        Files no other update touches are only opened if they are in `candidate_paths` (from search_index_lib.SearchIndex.get_candidate_paths()), if given.
+        '''
+        pattern, replacements = package_updates.compile_find_and_replace(find_and_replace_texts)
+        if pattern is not None:
+            self.replace_paths = list(file_paths)
+            self.replacement_items = tuple(replacements.items())
+            self.candidate_paths = candidate_paths
+
+    def update_project(self, config: dict, bump_version: bool = True) -> None:
+        '''
+        Plans the version bump of the dbt_project.yml files (see package_updates.bump_project_file()).
+        With `bump_version` False only require-dbt-version is set.
+        '''
+        for f in package_updates.PROJECT_FILES:
+            self.edit(f, 'project-version', functools.partial(bump_project, config=config, bump_version=bump_version))
+
+    def update_package_dependencies(self, dependency_versions: dict, latest_versions: dict = None) -> None:
+        '''
+        Plans pointing packages.yml, and the dependency matrix of the README, at new versions of their dependencies
+        (see package_updates.get_new_version_range()).
+        '''
+        if dependency_versions or latest_versions:
+            for path in (package_updates.PACKAGES_FILE, package_updates.README_FILE):
+                self.edit(path, 'package-versions', functools.partial(set_dependency_versions, dependency_versions=dependency_versions or {},
+                                                                      latest_versions=latest_versions))
+
+    def is_removed(self, path: str) -> bool:
+        return any(is_under(path, removed) for removed in self.removed)
+
+    def check(self) -> None:
+        '''
+        Raises ChangeConflict listing every file the planned updates disagree about.
+        '''
+        conflicts = list(self.conflicts)
+        for path in sorted(self.added):
+            if self.is_removed(path):
+                conflicts.append("%s is added by files-to-add and removed by files-to-remove" %(path))
+        for path, edits in sorted(self.edits.items()):
+            if self.is_removed(path):
+                conflicts.append("%s is removed by files-to-remove but edited by %s" %(path, ", ".join(sorted(set(phase for phase, function in edits)))))
+        if conflicts:
+            raise ChangeConflict("Conflicting package updates:\n- " + "\n- ".join(conflicts))
+
+    def apply(self, workers: int = 1) -> dict:
+        '''
+        Checks the plan for conflicts and applies it to the repo's files.
+
+        Args:
+        - workers: number of processes find-and-replace may spread the files no other update touches over (`transform-workers` in package_manager.yml)
+
+        Large worktree files that only get lines added and find-and-replace are streamed in chunks (see stream_edits()).
+
+        Returns:
+        - dictionary of {phase: {file path: what the edit reported}}, ie the find-and-replace hits of each file and the new project version
+        '''
+        self.check()
+        results = {phase: {} for phase in PHASES}
+
+        # every removal is checked against the repo as it was, so removing a folder and a file inside it both succeed
+        missing = [file for file in self.removed if not self.files.exists(file)]
+        for file in dict.fromkeys(self.removed):
+            if file in missing:
+                print (u'\u2717', "Removing file %s FAILED. Error: not found..." %(file))
+            else:
+                if self.files.exists(file):
+                    self.files.remove(file)
+                print (u'\u2713', "%s successfully removed..."%(file))
+
+        # files only touched by find-and-replace are handed to the files in bulk (and possibly the process pool)
+        replace_paths = [path for path in self.replace_paths if not self.is_removed(path)]
+        bulk_paths = [path for path in replace_paths if path not in self.edits and path not in self.added
+                      and (self.candidate_paths is None or path in self.candidate_paths)]
+        for path, hits in self.files.replace_in_files(bulk_paths, self.replacement_items, workers) if self.replacement_items else []:
+            if hits is None:
+                print("Ignoring "+path+". Not found")
+            elif isinstance(hits, str):
+                print (u'\u2717', "Updating %s (find-and-replace) FAILED. Error: %s..." %(path, hits))
+            else:
+                results['find-and-replace'][path] = hits
+
+        # every other file is read once, goes through all of its edits, and is written once
+        replace_set = set(replace_paths) if self.replacement_items else set()
+        for path in sorted(set(self.added) | set(self.edits)):
+            edits = list(self.edits.get(path, []))
+            if path in replace_set:
+                edits.append(('find-and-replace', functools.partial(replace_texts, replacement_items=self.replacement_items)))
+            edits.sort(key=lambda edit: PHASES.index(edit[0]))
+            if path in self.added and not edits and self.files.get_blob(path) == (self.added[path][2], self.added[path][1]):
+                print (u'\u2713', "%s already up to date..."%(path))
+                continue # same content and mode as the file to add: nothing is read or written
+            if path not in self.added and self.stream_edits(path, edits, results):
+                continue
+            content, mode = self.added[path][:2] if path in self.added else (self.files.read_bytes(path), None)
+            if content is None:
+                print("Ignoring "+path+". Not found")
+                continue
+            changed = path in self.added
+            if edits:
+                try:
+                    original_text = text = content.decode()
+                except UnicodeDecodeError as error:
+                    print (u'\u2717', "Updating %s (%s) FAILED. Error: %s..." %(path, ", ".join(phase for phase, function in edits), error))
+                    edits = []
+            for phase, function in edits:
+                try:
+                    new_text, result = function(text, path)
+                except (KeyError, ValueError, IndexError, ruamel.yaml.YAMLError) as error:
+                    print (u'\u2717', "Updating %s (%s) FAILED. Error: %s..." %(path, phase, error))
+                    continue
+                text = new_text
+                if result is not None:
+                    results[phase][path] = result
+            if edits and text != original_text:
+                content, changed = text, True
+            if changed:
+                self.files.write(path, content, mode)
+            if path in self.added:
+                print (u'\u2713', "%s file successfully added..."%(path))
+
+        for path in sorted(results['find-and-replace']):
+            hits = results['find-and-replace'][path]
+            print (u'\u2713', "%s: %s" %(path, ", ".join("'%s' x%s" %(find, count) for find, count in hits.items())))
+        if self.replacement_items:
+            print ("Files find-and-replaced: ", len(results['find-and-replace']), "/", len(self.replace_paths))
+        return results
+
+    def stream_edits(self, path: str, edits: list, results: dict) -> bool:
+        '''
+        Applies the edits of a large worktree file in chunks instead of reading it whole, if they can be: added lines and find-and-replace
+        only need a few bytes of context, version bumps need the whole YAML document.
+
+        Returns:
+        - whether the file was handled
+        '''
+        if not isinstance(self.files, WorktreeFiles) or not self.files.is_large(path):
+            return False
+        if any(phase not in ('add-to-file', 'find-and-replace') for phase, function in edits):
+            return False
+        line_edits = [function.keywords for phase, function in edits if phase == 'add-to-file']
+        top_lines = [edit['new_line'] for edit in line_edits if edit['insert_at_top']]
+        bottom_lines = [edit['new_line'] for edit in line_edits if not edit['insert_at_top']]
+        replacement_items = self.replacement_items if any(phase == 'find-and-replace' for phase, function in edits) else ()
+        hits = self.files.stream_edits(path, top_lines, bottom_lines, replacement_items)
+        for edit in line_edits:
+            print (u'\u2713', "%s successfully added to the %s of file %s..."%(edit['new_line'], 'top' if edit['insert_at_top'] else 'bottom', path))
+            results['add-to-file'][path] = edit['new_line']
+        if hits:
+            results['find-and-replace'][path] = hits
+        return True
+
+def plan_package_updates(files, file_paths: list, config: dict, dependency_versions: dict = None, files_to_add: dict = None, candidate_paths: set = None,
+                         latest_versions: dict = None, bump_version: bool = True) -> ChangeSet:
+    '''
+    Plans all the package updates configured in package_manager.yml as one change set.
+
+    Args:
+    - files: WorktreeFiles of a checkout, or a commit_builder_lib.TreeEditor
+    - file_paths: the repo files the find-and-replace rules should look at (from file_index_lib.get_file_paths())
+    - config: configurations loaded from package_manager.yml
+    - dependency_versions: {package hub name: version range} to set in packages.yml
+    - files_to_add: manifest of the files-to-add (from package_updates.get_files_to_add_manifest()), built here if not given
+    - candidate_paths: files the find strings may be in (from search_index_lib.SearchIndex.get_candidate_paths()), None to search every file
+    - latest_versions: {package hub name: latest release} dependencies are moved to if their range doesn't allow it (from release_index_lib)
+    - bump_version: False to leave the project version alone, ie for a campaign stacked on a branch whose version is already bumped
+    '''
+    change_set = ChangeSet(files)
+    change_set.add_to_files(config['files-to-add-to'])
+    change_set.add_files(files_to_add if files_to_add is not None else package_updates.get_files_to_add_manifest(config['files-to-add']))
+    change_set.remove(config['files-to-remove'])
+    change_set.find_and_replace(file_paths, config['find-and-replace'], candidate_paths)
+    change_set.update_project(config, bump_version)
+    change_set.update_package_dependencies(dependency_versions, latest_versions)
+    return change_set
+
+def apply_package_updates(files, file_paths: list, config: dict, dependency_versions: dict = None, files_to_add: dict = None, candidate_paths: set = None,
+                          latest_versions: dict = None, bump_version: bool = True) -> tuple:
+    '''
+    Plans and applies all the package updates configured in package_manager.yml (see plan_package_updates()).
+
+    Returns:
+    - dictionary of {find-and-replace rule: number of matches across the repo}, and the new version of the package
+    '''
+    change_set = plan_package_updates(files, file_paths, config, dependency_versions, files_to_add, candidate_paths, latest_versions, bump_version)
+    results = change_set.apply(workers=config.get('transform-workers', 1))
+    rules_matched = {}
+    for hits in results['find-and-replace'].values():
+        for find, count in hits.items():
+            rules_matched[find] = rules_matched.get(find, 0) + count
+    return rules_matched, results['project-version'].get("dbt_project.yml")
@@ -0,0 +1,301 @@
+#  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
+import git
+
+# gitdb is the object database underneath GitPython, used to write new blobs and trees straight into the repo's object store
+import gitdb
+
+# used to stream objects into the object database
+import io
+
+# used to compute object hashes
+import hashlib
+
+# used to open each repo's object database once per process pool worker
+import functools
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# local stuff
+import package_updates
+import process_pool_lib
+
+## git file modes
+FILE_MODE = 0o100644
+EXECUTABLE_MODE = 0o100755
+TREE_MODE = 0o040000
+
+class TreeEditor:
+    '''
+    Edits the files of a commit without a checkout: files are read as blobs from the object database, changes are kept in memory,
+    and write_tree() writes only the changed blobs plus the trees on their paths. Everything else in the repo is never read.
+
+    Paths are relative to the repo root, ie 'models/stg_jira__issue.sql'.
+    '''
+
+    def __init__(self, cloned_repository: git.Repo, base_commit: str = 'HEAD'):
+        self.cloned_repository = cloned_repository
+        self.base_tree_binsha = cloned_repository.commit(base_commit).tree.binsha
+        # new objects are written as loose objects straight from python (GitPython's own odb.store() runs a `git hash-object` per object)
+        self.object_store = gitdb.LooseObjectDB(os.path.join(cloned_repository.common_dir, 'objects'))
+        self.trees = {} # folder path -> {name: (binsha, mode)} of the base commit, parsed once per folder
+        self.changes = {} # path -> (mode, content bytes), or None if the file is removed
+
+    def get_tree_entries(self, tree_binsha: bytes) -> dict:
+        return {name: (binsha, mode) for binsha, mode, name in git.objects.fun.tree_entries_from_data(self.cloned_repository.odb.stream(tree_binsha).read())}
+
+    def get_folder(self, path: str) -> dict:
+        '''
+        Returns the entries of a folder in the base commit as {name: (binsha, mode)}, or None if there is no such folder.
+        '''
+        path = path.strip('/')
+        if path not in self.trees:
+            if not path:
+                self.trees[path] = self.get_tree_entries(self.base_tree_binsha)
+            else:
+                entry = self.get_entry(path)
+                self.trees[path] = self.get_tree_entries(entry[0]) if entry and entry[1] == TREE_MODE else None
+        return self.trees[path]
+
+    def get_entry(self, path: str) -> tuple:
+        '''
+        Returns (binsha, mode) of the file or folder at `path` in the base commit, or None if there is nothing there.
+        '''
+        folder, separator, name = path.strip('/').rpartition('/')
+        entries = self.get_folder(folder)
+        return entries.get(name) if entries else None
+
+    def get_blob(self, path: str) -> tuple:
+        '''
+        Returns (blob sha, mode) of a file as it currently is, without reading it, or None if there is no such file.
+        '''
+        path = path.strip('/')
+        if path in self.changes:
+            return (gitdb.util.bin_to_hex(self.hash_object(b'blob', self.changes[path][1])).decode(), self.changes[path][0]) if self.changes[path] else None
+        entry = self.get_entry(path)
+        if entry is None or entry[1] == TREE_MODE:
+            return None
+        return gitdb.util.bin_to_hex(entry[0]).decode(), entry[1]
+
+    def is_directory(self, path: str) -> bool:
+        prefix = path.strip('/') + '/'
+        if any(changed_path.startswith(prefix) and change is not None for changed_path, change in self.changes.items()):
+            return True
+        return any(file_path not in self.changes or self.changes[file_path] is not None for file_path in self.list_files(path))
+
+    def exists(self, path: str) -> bool:
+        path = path.strip('/')
+        if path in self.changes:
+            return self.changes[path] is not None
+        entry = self.get_entry(path)
+        return (entry is not None and entry[1] != TREE_MODE) or self.is_directory(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        '''
+        Returns the current content of a file, or None if it doesn't exist.
+        '''
+        path = path.strip('/')
+        if path in self.changes:
+            return self.changes[path][1] if self.changes[path] is not None else None
+        entry = self.get_entry(path)
+        if entry is None or entry[1] == TREE_MODE:
+            return None
+        return self.cloned_repository.odb.stream(entry[0]).read()
+
+    def read(self, path: str) -> str:
+        content = self.read_bytes(path)
+        return content.decode() if content is not None else None
+
+    def write(self, path: str, content, mode: int = None) -> None:
+        '''
+        Sets the content (str or bytes) of a file. Existing files keep their mode (ie executable scripts) unless `mode` is given.
+        '''
+        path = path.strip('/')
+        if isinstance(content, str):
+            content = content.encode()
+        entry = self.get_entry(path)
+        is_file = entry is not None and entry[1] != TREE_MODE
+        if mode is None:
+            mode = entry[1] if is_file else FILE_MODE
+        if is_file and entry[1] == mode and entry[0] == self.hash_object(b'blob', content):
+            self.changes.pop(path, None) # back to the original content
+        else:
+            self.changes[path] = (mode, content)
+
+    def list_files(self, path: str) -> list:
+        '''
+        Returns the paths of all files under a folder in the base commit.
+        '''
+        path = path.strip('/')
+        entries = self.get_folder(path)
+        file_paths = []
+        for name, (binsha, mode) in (entries or {}).items():
+            child_path = path + '/' + name if path else name
+            if mode == TREE_MODE:
+                file_paths += self.list_files(child_path)
+            else:
+                file_paths.append(child_path)
+        return file_paths
+
+    def remove(self, path: str) -> None:
+        '''
+        Removes a file, or a folder with everything in it.
+        '''
+        path = path.strip('/')
+        prefix = path + '/'
+        for changed_path in list(self.changes):
+            if changed_path.startswith(prefix):
+                self.changes[changed_path] = None
+        for file_path in self.list_files(path):
+            self.changes[file_path] = None
+        entry = self.get_entry(path)
+        if (entry is not None and entry[1] != TREE_MODE) or path in self.changes:
+            self.changes[path] = None
+
+    def get_changed_paths(self) -> list:
+        return sorted(self.changes)
+
+    def replace_in_files(self, file_paths: list, replacement_items: tuple, workers: int = 1) -> list:
+        '''
+        Applies find-and-replace rules to files that no other update touches, reading only their blobs.
+        With `workers` > 1, large repos are sent to the process pool as (path, blob sha) shards.
+
+        Returns:
+        - list of (file path, {find string: number of replacements}) for every file that changed, (file path, None) for files that don't exist
+          and (file path, error message) for files that aren't UTF-8 text
+        '''
+        blobs, results = [], []
+        for path in file_paths:
+            entry = self.get_entry(path)
+            if path in self.changes or entry is None or entry[1] == TREE_MODE:
+                results.append((path, None))
+            else:
+                blobs.append((path, gitdb.util.bin_to_hex(entry[0]).decode()))
+        if workers > 1 and len(blobs) >= package_updates.PARALLEL_MIN_FILES:
+            environment_items = tuple(sorted(self.cloned_repository.git.environment().items()))
+            changed_files = process_pool_lib.map_shards(find_and_replace_blobs, blobs, workers, self.cloned_repository.common_dir, environment_items, replacement_items)
+        else:
+            changed_files = replace_in_blobs(self.cloned_repository, blobs, replacement_items)
+        for path, new_file_data, hits in changed_files:
+            if new_file_data is not None:
+                self.write(path, new_file_data)
+            results.append((path, hits))
+        return results
+
+    def hash_object(self, object_type: bytes, data: bytes) -> bytes:
+        '''
+        Returns the binary sha git gives an object, without writing it.
+        '''
+        return hashlib.sha1(b'%s %d\0' %(object_type, len(data)) + data).digest()
+
+    def store(self, object_type: bytes, data: bytes) -> bytes:
+        '''
+        Writes an object to the repo's object database and returns its binary sha.
+        '''
+        binsha = self.hash_object(object_type, data)
+        if not self.object_store.has_object(binsha):
+            self.object_store.store(gitdb.IStream(object_type, len(data), io.BytesIO(data)))
+        return binsha
+
+    def build_tree(self, path: str, changes: dict) -> bytes:
+        '''
+        Returns the binary sha of the folder at `path` with `changes` (relative to the folder) applied, or None if the folder ends up empty.
+        Sub-folders without changes are reused as they are.
+        '''
+        entries = dict(self.get_folder(path) or {})
+        changes_by_directory = {}
+        for changed_path, change in changes.items():
+            name, separator, rest = changed_path.partition('/')
+            if separator:
+                changes_by_directory.setdefault(name, {})[rest] = change
+            elif change is None:
+                entries.pop(name, None)
+            else:
+                mode, content = change
+                entries[name] = (self.store(b'blob', content), mode)
+
+        for name, directory_changes in changes_by_directory.items():
+            binsha = self.build_tree(path + '/' + name if path else name, directory_changes)
+            if binsha is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = (binsha, TREE_MODE)
+
+        if not entries:
+            return None
+        # git sorts tree entries by name, with folders sorting as if their name ended in '/'
+        sorted_entries = sorted(entries.items(), key=lambda entry: entry[0].encode() + (b'/' if entry[1][1] == TREE_MODE else b''))
+        stream = io.BytesIO()
+        git.objects.fun.tree_to_stream([(binsha, mode, name) for name, (binsha, mode) in sorted_entries], stream.write)
+        return self.store(b'tree', stream.getvalue())
+
+    def write_tree(self) -> str:
+        '''
+        Writes the changed files and the trees above them to the object database.
+
+        Returns:
+        - hash of the new root tree (the same hash `git write-tree` gives for the same content)
+        '''
+        binsha = self.build_tree('', self.changes)
+        if binsha is None:
+            binsha = self.store(b'tree', b'')
+        return gitdb.util.bin_to_hex(binsha).decode()
+
+def commit_tree(cloned_repository: git.Repo, tree_hash: str, branch_name: str, commit_message: str, repository_author, parent_commits: list) -> str:
+    '''
+    Creates a commit of a tree written by TreeEditor.write_tree() and points the local branch at it, ready for pr_lib.push_branches().
+
+    Args:
+    - cloned_repository: where the tree was written
+    - tree_hash: from TreeEditor.write_tree()
+    - branch_name: local branch to point at the new commit
+    - commit_message
+    - repository_author: author (and committer) of the commit
+    - parent_commits: commits to build on, see pr_lib.get_parent_commits()
+
+    Returns:
+    - sha of the new commit
+    '''
+    tree = git.Tree(cloned_repository, gitdb.util.hex_to_bin(tree_hash), mode=TREE_MODE, path='')
+    commit = git.Commit.create_from_tree(cloned_repository, tree, commit_message.format(branch_name),
+                                         parent_commits=[cloned_repository.commit(parent_commit) for parent_commit in parent_commits], head=False,
+                                         author=repository_author, committer=repository_author)
+    cloned_repository.git.update_ref('refs/heads/' + branch_name, commit.hexsha)
+    print("Committed changes...")
+    return commit.hexsha
+
+@functools.lru_cache(maxsize=8)
+def open_object_database(git_dir: str, environment_items: tuple) -> git.Repo:
+    '''
+    Opens a repo's object database once per process pool worker.
+    '''
+    repository = git.Repo(git_dir)
+    repository.git.update_environment(**dict(environment_items)) # ie GIT_SSH_COMMAND, for partial clones that fetch blobs on demand
+    return repository
+
+def replace_in_blobs(repository: git.Repo, blobs: list, replacement_items: tuple) -> list:
+    '''
+    Applies the find-and-replace rules to a list of (file path, blob sha).
+
+    Returns:
+    - list of (file path, new content, {find string: number of replacements}) for every file that changed,
+      and (file path, None, error message) for files that aren't UTF-8 text
+    '''
+    pattern, replacements = package_updates.compile_replacements(replacement_items), dict(replacement_items)
+    results = []
+    for path, blob_sha in blobs:
+        try:
+            current_file_data = repository.odb.stream(gitdb.util.hex_to_bin(blob_sha)).read().decode()
+        except UnicodeDecodeError as error: # one binary or mis-encoded file doesn't stop the others
+            results.append((path, None, str(error)))
+            continue
+        new_file_data, hits = package_updates.apply_find_and_replace(current_file_data, pattern, replacements)
+        if new_file_data != current_file_data:
+            results.append((path, new_file_data, hits))
+    return results
+
+def find_and_replace_blobs(blobs: list, git_dir: str, environment_items: tuple, replacement_items: tuple) -> list:
+    '''
+    replace_in_blobs() for a process pool worker, which reads the blobs itself.
+    '''
+    return replace_in_blobs(open_object_database(git_dir, environment_items), blobs, replacement_items)
@@ -0,0 +1,46 @@
+# local stuff
+import package_registry_lib
+
+def get_upstream_repos(repo_names: list, registry: package_registry_lib.PackageRegistry) -> dict:
+    '''
+    Builds the dependency graph of the repos in a rollout from the packages.yml dependencies recorded in the package registry.
+    Only dependencies that are part of the rollout themselves are kept, ie dbt_jira -> [dbt_jira_source] if both are being updated.
+
+    Args:
+    - repo_names: repositories to update (from package_manager.yml)
+    - registry: the package registry (repos missing from it are treated as having no dependencies)
+
+    Returns:
+    - dictionary of {repo name: list of the repos in the rollout it depends on}
+    '''
+    hub_names = {package_registry_lib.get_hub_name(repo_name, registry.owner).lower(): repo_name for repo_name in repo_names}
+    upstream_repos = {}
+    for repo_name in repo_names:
+        package = registry.get(repo_name)
+        dependencies = package.dependencies if package is not None else []
+        upstream_repos[repo_name] = [hub_names[dependency.lower()] for dependency in dependencies
+                                     if dependency.lower() in hub_names and hub_names[dependency.lower()] != repo_name]
+    return upstream_repos
+
+def get_waves(repo_names: list, upstream_repos: dict) -> list:
+    '''
+    Splits the repos into waves in topological order: every repo comes in a later wave than all the repos it depends on,
+    so the repos of a wave can run in parallel. Within a wave, repos keep the order they are listed in.
+
+    Args:
+    - repo_names: repositories to update (from package_manager.yml)
+    - upstream_repos: from get_upstream_repos()
+
+    Returns:
+    - list of waves, each a list of repo names
+    '''
+    remaining = list(dict.fromkeys(repo_names))
+    done, waves = set(), []
+    while remaining:
+        wave = [repo_name for repo_name in remaining if all(upstream in done for upstream in upstream_repos.get(repo_name, []))]
+        if not wave:
+            raise ValueError("Circular dependencies between packages: %s" %(", ".join(remaining)))
+        waves.append(wave)
+        done.update(wave)
+        remaining = [repo_name for repo_name in remaining if repo_name not in done]
+    return waves
@@ -0,0 +1,111 @@
+# used to store the file index of each commit on disk between runs
+import json
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# used to fingerprint the filter rules so a change to them invalidates the cached index
+import hashlib
+
+#  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
+import git
+
+# local stuff
+import local_load_lib
+
+## Default filter rules, used when `file-index` isn't set in package_manager.yml
+## DO include only sql and yml files, but don't include _tmp models, packages.yml, or buildkite creds
+DEFAULT_INCLUDE_SUFFIXES = ['.sql', '.yml']
+DEFAULT_EXCLUDE_SUFFIXES = ['tmp.sql', 'packages.yml', 'sample.profiles.yml']
+
+def get_filter_rules(config: dict) -> dict:
+    '''
+    Reads the file filter rules from the `file-index` config, falling back to the defaults for anything not set.
+
+    Args:
+    - config: configurations loaded from package_manager.yml
+
+    Returns:
+    - dictionary with `include-suffixes` and `exclude-suffixes` lists
+    '''
+    file_index_config = config.get('file-index') or {}
+    return {
+        'include-suffixes': list(file_index_config.get('include-suffixes', DEFAULT_INCLUDE_SUFFIXES)),
+        'exclude-suffixes': list(file_index_config.get('exclude-suffixes', DEFAULT_EXCLUDE_SUFFIXES)),
+    }
+
+def is_candidate_file(file_path: str, filter_rules: dict) -> bool:
+    '''
+    Checks a file path against the filter rules.
+
+    Args:
+    - file_path: path of the file relative to the repo root
+    - filter_rules: from get_filter_rules()
+    '''
+    file_name = file_path.rsplit('/', 1)[-1]
+    if file_name.endswith(tuple(filter_rules['exclude-suffixes'])):
+        return False
+    return file_name.endswith(tuple(filter_rules['include-suffixes']))
+
+def list_tree_paths(cloned_repository: git.Repo, commit_sha: str) -> list:
+    '''
+    Lists every file in the commit's tree with a single `git ls-tree` call against the local clone (no GitHub API calls).
+
+    Args:
+    - cloned_repository: the local clone
+    - commit_sha: commit whose tree should be listed
+    '''
+    output = cloned_repository.git.ls_tree('-r', '--name-only', '-z', commit_sha)
+    return [path for path in output.split('\0') if path]
+
+def get_file_paths(cloned_repository: git.Repo, repo_name: str, config: dict) -> list:
+    '''
+    Returns the list of file paths in the cloned repo's HEAD commit that pass the `file-index` filter rules.
+    The result is cached on disk by commit SHA (and filter rules), so repeat runs against an unchanged repo don't even list the tree.
+
+    Args:
+    - cloned_repository: the local clone (from repo_lib.clone_repo())
+    - repo_name: name of the repo, used to key the cache
+    - config: configurations loaded from package_manager.yml
+
+    Returns:
+    - list of file paths in the repo
+    '''
+    filter_rules = get_filter_rules(config)
+    commit_sha = cloned_repository.head.commit.hexsha
+    rules_hash = hashlib.sha1(json.dumps(filter_rules, sort_keys=True).encode()).hexdigest()[:12]
+    cache_file = os.path.join(local_load_lib.get_cache_directory('file_index', repo_name), "%s-%s.json" %(commit_sha, rules_hash))
+
+    if os.path.exists(cache_file):
+        with open(cache_file) as file:
+            file_path_list = json.load(file)
+        print ("Loaded %s indexed files for %s from cache..." %(len(file_path_list), commit_sha[:7]))
+        return file_path_list
+
+    file_path_list = [path for path in list_tree_paths(cloned_repository, commit_sha) if is_candidate_file(path, filter_rules)]
+    with open(cache_file, 'w') as file:
+        json.dump(file_path_list, file)
+    print ("Indexed %s files for %s..." %(len(file_path_list), commit_sha[:7]))
+    return file_path_list
+
+def update_file_paths(cloned_repository: git.Repo, file_paths: list, config: dict, base_commit: str, commit: str) -> list:
+    '''
+    Brings the file paths of `base_commit` (from get_file_paths()) up to date with a later local commit, ie one made by an earlier campaign:
+    files it removed are left out and files it added are listed if they pass the filter rules. Nothing is cached.
+
+    Args:
+    - cloned_repository: the local clone
+    - file_paths: file paths of `base_commit`
+    - config: configurations loaded from package_manager.yml
+    - base_commit: the commit `file_paths` were listed for
+    - commit: the later commit
+    '''
+    filter_rules = get_filter_rules(config)
+    removed, added = set(), []
+    entries = cloned_repository.git.diff('--name-status', '--no-renames', '-z', base_commit, commit).split('\0')
+    for status, path in zip(entries[0::2], entries[1::2]):
+        if status == 'D':
+            removed.add(path)
+        elif status == 'A' and is_candidate_file(path, filter_rules):
+            added.append(path)
+    return [path for path in file_paths if path not in removed] + added
@@ -0,0 +1,289 @@
+# allows you to interact with GitHub repositories and other GitHub resources. It is a wrapper around the GitHub REST API, which means that it allows you to perform all of the same actions that you can perform using the GitHub web interface.
+import github
+
+# HTTP library, used for the conditional (ETag) requests that PyGithub doesn't support
+import requests
+
+# used to count API calls by kind
+import collections
+
+# used to store cached responses on disk
+import json
+
+# used to turn request urls into cache file names
+import hashlib
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# the client is shared by all rollout worker threads
+import threading
+
+# used to wait for the rate limit to reset and to back off between retries
+import time
+
+# local stuff
+import local_load_lib
+
+## Seconds to wait for GitHub to accept a connection and to answer, so a hung connection fails the call instead of stalling its worker for good
+REQUEST_TIMEOUT = (10, 60)
+
+class GithubClient:
+    '''
+    GitHub client shared by every worker of a rollout. All API traffic goes through it so that it can:
+    - keep track of the remaining rate-limit budget and pause before it runs out
+    - retry secondary rate-limit (abuse) and 5xx responses with backoff, and time out hung requests (REQUEST_TIMEOUT)
+    - answer `get_repo` / `get_contents` with conditional requests against a local ETag cache (304 responses don't count against the quota)
+    - run batched GraphQL queries and mutations (see graphql())
+    - count API calls by kind, printed at the end of the run with print_api_call_summary()
+
+    PyGithub clients aren't thread-safe, so each thread gets its own underlying github.Github.
+    '''
+
+    def __init__(self, access_token: str, base_url: str = 'https://api.github.com', reserve: int = 100, max_retries: int = 5):
+        self.access_token = access_token
+        self.base_url = base_url.rstrip('/')
+        self.reserve = reserve # number of calls to keep in hand before pausing until the rate limit resets
+        self.max_retries = max_retries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset_time = None
+        self.rate_limit_unavailable = False # set once the server turns out not to report a rate limit
+        self.api_calls = collections.Counter()
+        self.cache_directory = local_load_lib.get_cache_directory('etags')
+
+    @property
+    def pygithub(self) -> github.Github:
+        '''
+        The calling thread's PyGithub client.
+        '''
+        if getattr(self.local, 'github', None) is None:
+            self.local.github = github.Github(self.access_token, base_url=self.base_url)
+        return self.local.github
+
+    @property
+    def session(self) -> requests.Session:
+        '''
+        The calling thread's HTTP session for conditional requests.
+        '''
+        if getattr(self.local, 'session', None) is None:
+            self.local.session = requests.Session()
+            self.local.session.headers.update({'Authorization': 'token ' + self.access_token, 'Accept': 'application/vnd.github+json'})
+        return self.local.session
+
+    def count(self, kind: str) -> None:
+        with self.lock:
+            self.api_calls[kind] += 1
+        self.local.api_calls = self.get_thread_api_calls() + 1
+
+    def get_thread_api_calls(self) -> int:
+        '''
+        Number of API calls made so far by the calling thread (used to attribute API calls to the stages of each repo).
+        '''
+        return getattr(self.local, 'api_calls', 0)
+
+    def update_budget(self, remaining, reset_time) -> None:
+        '''
+        Records the rate-limit budget from the latest response.
+        '''
+        if remaining is None or reset_time is None:
+            return
+        with self.lock:
+            self.remaining = int(remaining)
+            self.reset_time = int(reset_time)
+
+    def wait_for_budget(self) -> None:
+        '''
+        Sleeps until the rate limit resets if fewer than `reserve` calls are left in the current window.
+        '''
+        with self.lock:
+            remaining, reset_time = self.remaining, self.reset_time
+        if remaining is not None and remaining < self.reserve and reset_time is not None:
+            wait = max(0, reset_time - time.time()) + 1
+            print ("Only %s API calls left, waiting %.0fs for the rate limit to reset..." %(remaining, wait))
+            time.sleep(wait)
+            with self.lock:
+                if self.reset_time == reset_time:
+                    self.remaining = None # budget unknown until the next response
+
+    def call(self, kind: str, function, *args, **kwargs):
+        '''
+        Makes a PyGithub call with rate-limit pacing, backoff on secondary rate limits and 5xx errors, and counting.
+
+        Args:
+        - kind: name the call is counted under, ie 'create_pull'
+        - function: the PyGithub method to call, followed by its arguments
+        '''
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_budget()
+            self.count(kind)
+            try:
+                result = function(*args, **kwargs)
+                self.update_budget(*self.last_rate_limit())
+                return result
+            except github.RateLimitExceededException as error:
+                if attempt == self.max_retries:
+                    raise
+                self.back_off(error, attempt)
+            except github.GithubException as error:
+                if not (is_secondary_rate_limit(error) or error.status >= 500) or attempt == self.max_retries:
+                    raise
+                self.back_off(error, attempt)
+
+    def last_rate_limit(self) -> tuple:
+        '''
+        Returns the (remaining, reset time) headers of the calling thread's last PyGithub response.
+        PyGithub asks /rate_limit instead if the response didn't have them: if that fails too (ie GitHub Enterprise with rate limiting turned off),
+        the budget isn't tracked for the rest of the run.
+        '''
+        if self.rate_limit_unavailable:
+            return None, None
+        try:
+            remaining, limit = self.pygithub.rate_limiting
+            return remaining, self.pygithub.rate_limiting_resettime
+        except github.GithubException:
+            self.rate_limit_unavailable = True
+            return None, None
+
+    def back_off(self, error: github.GithubException, attempt: int) -> None:
+        '''
+        Sleeps before retrying a rate-limited call (or a 5xx error): for as long as GitHub asks (Retry-After or reset time), otherwise exponentially.
+        '''
+        headers = {key.lower(): value for key, value in (getattr(error, 'headers', None) or {}).items()}
+        if headers.get('retry-after'):
+            wait = int(headers['retry-after'])
+        elif headers.get('x-ratelimit-remaining') == '0' and headers.get('x-ratelimit-reset'):
+            wait = max(0, int(headers['x-ratelimit-reset']) - time.time()) + 1
+        else:
+            wait = min((5 if error.status >= 500 else 60) * 2 ** attempt, 600) # server errors are usually brief
+        print ("%s (HTTP %s), retrying in %.0fs..." %('GitHub server error' if error.status >= 500 else 'Rate limited by GitHub', error.status, wait))
+        time.sleep(wait)
+
+    def get(self, kind: str, path: str, params: dict = None) -> dict:
+        '''
+        Conditional GET against the REST API. The ETag of every response is cached on disk and sent back as If-None-Match,
+        so unchanged resources come back as 304s that don't count against the rate limit.
+
+        Args:
+        - kind: name the call is counted under
+        - path: API path, ie '/repos/fivetran/dbt_jira'
+        - params: query string parameters
+        '''
+        url = self.base_url + path
+        cache_key = hashlib.sha1((url + json.dumps(params or {}, sort_keys=True)).encode()).hexdigest()
+        cache_file = os.path.join(self.cache_directory, cache_key + '.json')
+        cached = None
+        if os.path.exists(cache_file):
+            with open(cache_file) as file:
+                cached = json.load(file)
+
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_budget()
+            headers = {'If-None-Match': cached['etag']} if cached else {}
+            response = self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            self.update_budget(response.headers.get('x-ratelimit-remaining'), response.headers.get('x-ratelimit-reset'))
+            if response.status_code == 304:
+                self.count(kind + ' (not modified)')
+                return cached['data']
+            self.count(kind)
+            if response.status_code in (403, 429) and attempt < self.max_retries and \
+                    ('rate limit' in response.text.lower() or response.headers.get('retry-after')):
+                self.back_off(github.GithubException(response.status_code, response.text, dict(response.headers)), attempt)
+                continue
+            if response.status_code >= 500 and attempt < self.max_retries:
+                self.back_off(github.GithubException(response.status_code, response.text, dict(response.headers)), attempt)
+                continue
+            if response.status_code >= 400:
+                raise github.GithubException(response.status_code, get_response_data(response), dict(response.headers))
+            data = response.json()
+            if response.headers.get('etag'):
+                temporary_file = cache_file + '.%s.tmp' %(threading.get_ident())
+                with open(temporary_file, 'w') as file:
+                    json.dump({'etag': response.headers['etag'], 'data': data}, file)
+                os.replace(temporary_file, cache_file)
+            return data
+
+    @property
+    def graphql_url(self) -> str:
+        # GitHub Enterprise serves the REST API under /api/v3 and the GraphQL API under /api/graphql
+        if self.base_url.endswith('/api/v3'):
+            return self.base_url[:-len('/v3')] + '/graphql'
+        return self.base_url + '/graphql'
+
+    def graphql(self, kind: str, query: str, variables: dict = None) -> tuple:
+        '''
+        Runs a GraphQL query or mutation, with backoff on rate limits and 5xx errors, and counting.
+        GraphQL has its own rate-limit budget (in points, not calls), so it doesn't draw down the REST budget tracked by wait_for_budget().
+
+        Args:
+        - kind: name the call is counted under
+        - query: GraphQL document
+        - variables: values of the document's variables
+
+        Returns:
+        - the `data` of the response and its list of `errors`. A batched document can partly fail: the fields that failed are None in `data`
+        '''
+        for attempt in range(self.max_retries + 1):
+            self.count(kind)
+            response = self.session.post(self.graphql_url, json={'query': query, 'variables': variables or {}}, timeout=REQUEST_TIMEOUT)
+            if response.status_code >= 500 and attempt < self.max_retries:
+                self.back_off(github.GithubException(response.status_code, response.text, dict(response.headers)), attempt)
+                continue
+            result = get_response_data(response) or {}
+            if not isinstance(result, dict): # ie the HTML error page of a proxy
+                raise github.GithubException(response.status_code, result, dict(response.headers))
+            errors = result.get('errors') or []
+            rate_limited = any(error.get('type') == 'RATE_LIMITED' for error in errors) or \
+                (response.status_code in (403, 429) and ('rate limit' in response.text.lower() or response.headers.get('retry-after')))
+            if rate_limited and attempt < self.max_retries:
+                self.back_off(github.GithubException(response.status_code, result, dict(response.headers)), attempt)
+                continue
+            if response.status_code >= 400 or result.get('data') is None:
+                raise github.GithubException(response.status_code, result, dict(response.headers))
+            return result['data'], errors
+
+    def get_repo(self, full_name: str) -> github.Repository.Repository:
+        '''
+        Same as github.Github.get_repo(), through the ETag cache.
+        '''
+        data = self.get('get_repo', '/repos/' + full_name)
+        return self.pygithub.create_from_raw_data(github.Repository.Repository, data)
+
+    def get_contents(self, repo: github.Repository.Repository, path: str, ref: str = None) -> github.ContentFile.ContentFile:
+        '''
+        Same as repo.get_contents() for a single file, through the ETag cache.
+        '''
+        data = self.get('get_contents', '/repos/%s/contents/%s' %(repo.full_name, path), {'ref': ref} if ref else None)
+        return self.pygithub.create_from_raw_data(github.ContentFile.ContentFile, data)
+
+    def print_api_call_summary(self) -> None:
+        '''
+        Prints how many API calls of each kind were made during the run.
+        '''
+        print ("\nGitHub API calls this run:")
+        for kind, count in sorted(self.api_calls.items()):
+            print ("  %s: %s" %(kind, count))
+        print ("  total (excluding not modified): %s" %(sum(count for kind, count in self.api_calls.items() if not kind.endswith('(not modified)'))))
+        if self.remaining is not None:
+            print ("  rate limit remaining: %s" %(self.remaining))
+
+def get_response_data(response: requests.Response):
+    '''
+    Returns the decoded JSON body of a response, or its text if it isn't JSON (ie the HTML page of a 502), or None if it is empty.
+    '''
+    if not response.content:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+def is_secondary_rate_limit(error: github.GithubException) -> bool:
+    '''
+    Checks whether an error is one of GitHub's secondary ("abuse") rate limits, which should be retried after a pause.
+    '''
+    if error.status == 429:
+        return True
+    message = str(error.data.get('message', '')) if isinstance(error.data, dict) else str(error.data)
+    return error.status == 403 and 'rate limit' in message.lower()
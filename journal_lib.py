@@ -0,0 +1,114 @@
+# used to hash the configurations and to store journal entries
+import json
+import hashlib
+
+# the rollout plan's nested configurations are read-only mappings
+import collections.abc
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# journal entries are written by all rollout worker threads
+import threading
+
+# used to timestamp journal entries
+import time
+
+## The stages a repo goes through during a rollout, in order
+STAGES = ['cloned', 'transformed', 'committed', 'pushed', 'pr_opened']
+
+def to_json(value):
+    '''
+    Serializes what json doesn't know about: the read-only mappings of a rollout plan as dictionaries, anything else as text.
+    '''
+    return dict(value) if isinstance(value, collections.abc.Mapping) else str(value)
+
+def get_config_hash(config: dict) -> str:
+    '''
+    Fingerprints the configurations of a rollout, leaving out the list of repositories and the rollout settings
+    so that adding repos to (or speeding up) an interrupted rollout still resumes it, and the watch settings (see main.watch_pull_requests()).
+
+    Args:
+    - config: configurations loaded from package_manager.yml
+    '''
+    rollout_config = {key: value for key, value in config.items() if key not in ('repositories', 'max-parallel-repos', 'watch-interval-seconds', 'watch-max-interval-seconds')}
+    return hashlib.sha256(json.dumps(rollout_config, sort_keys=True, default=to_json).encode()).hexdigest()[:16]
+
+class RunJournal:
+    '''
+    Durable record of how far each repo got in a rollout, stored as JSON lines in `runs/<config hash>/journal.jsonl`.
+
+    Every stage a repo completes is appended (and flushed to disk) as soon as it happens, so if a run crashes,
+    re-running with the same configurations picks up where it left off: finished repos are skipped and partial ones resume.
+    '''
+
+    def __init__(self, config: dict, runs_directory: str = 'runs'):
+        self.config_hash = get_config_hash(config)
+        self.run_directory = os.path.join(runs_directory, self.config_hash)
+        self.journal_path = os.path.join(self.run_directory, 'journal.jsonl')
+        self.lock = threading.Lock()
+        self.state = {}
+        os.makedirs(self.run_directory, exist_ok=True)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as file:
+                for line in file:
+                    if line.strip():
+                        self.apply(json.loads(line))
+
+    def apply(self, entry: dict) -> None:
+        repo_state = self.state.setdefault(entry['repo'], {})
+        repo_state.update({key: value for key, value in entry.items() if key not in ('repo', 'time')})
+
+    def record(self, repo_name: str, stage: str, **details) -> None:
+        '''
+        Appends a completed stage to the journal.
+
+        Args:
+        - repo_name
+        - stage: one of STAGES
+        - details: anything to remember about the stage, ie commit=<sha> or tree=<content hash>
+        '''
+        entry = dict(repo=repo_name, stage=stage, time=time.time(), **details)
+        with self.lock:
+            with open(self.journal_path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            self.apply(entry)
+
+    def get(self, repo_name: str) -> dict:
+        '''
+        Returns everything recorded for a repo so far (empty if the repo hasn't started).
+        '''
+        with self.lock:
+            return dict(self.state.get(repo_name, {}))
+
+    def is_complete(self, repo_name: str) -> bool:
+        '''
+        Checks whether a repo already went through the whole rollout.
+        '''
+        return self.get(repo_name).get('stage') == STAGES[-1]
+
+    def get_pull_request_urls(self) -> dict:
+        '''
+        Returns the PRs opened (or found open) by the rollout so far.
+
+        Returns:
+        - dictionary of {repo name: list of PR urls}, one url per branch the repo was pushed to
+        '''
+        with self.lock:
+            pull_urls = {}
+            for repo_name, repo_state in self.state.items():
+                urls = list((repo_state.get('pr_urls') or {}).values()) or [repo_state.get('pr_url')]
+                if repo_state.get('stage') == STAGES[-1] and any(urls):
+                    pull_urls[repo_name] = [url for url in urls if url]
+            return pull_urls
+
+    def clear(self) -> None:
+        '''
+        Forgets all progress so the next run starts the rollout over.
+        '''
+        with self.lock:
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.state = {}
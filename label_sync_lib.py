@@ -0,0 +1,128 @@
+# allows you to interact with GitHub repositories and other GitHub resources. It is a wrapper around the GitHub REST API, which means that it allows you to perform all of the same actions that you can perform using the GitHub web interface.
+import github
+
+# repos are synced concurrently
+import concurrent.futures
+
+# allows you to read, write, and parse YAML files
+import yaml
+
+# local stuff
+import github_client_lib
+
+def normalize_label(label: dict) -> dict:
+    '''
+    Returns a label as {name, color, description}, the way the labels API compares them (lowercase color without '#', empty description as '').
+    '''
+    return {'name': str(label['name']), 'color': str(label.get('color') or 'ededed').lstrip('#').lower(), 'description': label.get('description') or ''}
+
+def load_label_set(labels_file: str) -> dict:
+    '''
+    Loads the label sync configurations (see labels/labels.yml).
+    '''
+    with open(labels_file) as file:
+        return yaml.safe_load(file) or {}
+
+def get_repo_labels(client: github_client_lib.GithubClient, owner: str, repo_name: str) -> list:
+    '''
+    Lists the labels of a repo, 100 per page. The pages are conditional requests, so a repo whose labels haven't changed costs no rate limit.
+    '''
+    labels, page = [], 1
+    while True:
+        listing = client.get('list_labels', '/repos/%s/%s/labels' %(owner, repo_name), {'per_page': 100, 'page': page})
+        labels += listing
+        if len(listing) < 100:
+            return labels
+        page += 1
+
+def get_label_changes(canonical_labels: list, current_labels: list, delete_unlisted: bool = False) -> list:
+    '''
+    Computes the fewest API calls that make a repo's labels match the canonical set. Label names are case-insensitive on GitHub,
+    so a label that only differs in case is renamed rather than deleted and re-created (which would remove it from every issue and PR).
+
+    Args:
+    - canonical_labels: the labels every repo should have
+    - current_labels: the repo's labels, as listed by get_repo_labels()
+    - delete_unlisted: also delete the repo's labels that aren't in the canonical set
+
+    Returns:
+    - list of (action, current label or None, canonical label or None), action being 'create', 'update' or 'delete'
+    '''
+    current = {label['name'].lower(): label for label in current_labels}
+    changes = []
+    for label in canonical_labels:
+        label = normalize_label(label)
+        existing = current.get(label['name'].lower())
+        if existing is None:
+            changes.append(('create', None, label))
+        elif normalize_label(existing) != label:
+            changes.append(('update', existing, label))
+    if delete_unlisted:
+        canonical_names = set(str(label['name']).lower() for label in canonical_labels)
+        changes += [('delete', label, None) for name, label in sorted(current.items()) if name not in canonical_names]
+    return changes
+
+def apply_label_changes(client: github_client_lib.GithubClient, owner: str, repo_name: str, changes: list) -> None:
+    '''
+    Applies the changes from get_label_changes() to a repo, through the shared client so calls are paced against the rate limit.
+    '''
+    repo = client.pygithub.create_from_raw_data(github.Repository.Repository, {'url': '%s/repos/%s/%s' %(client.base_url, owner, repo_name),
+                                                                                 'name': repo_name, 'full_name': '%s/%s' %(owner, repo_name)})
+    for action, current_label, label in changes:
+        if action == 'create':
+            client.call('create_label', repo.create_label, label['name'], label['color'], label['description'])
+        elif action == 'update':
+            existing = client.pygithub.create_from_raw_data(github.Label.Label, current_label)
+            client.call('edit_label', existing.edit, label['name'], label['color'], label['description'])
+        else:
+            existing = client.pygithub.create_from_raw_data(github.Label.Label, current_label)
+            client.call('delete_label', existing.delete)
+
+def sync_repo_labels(client: github_client_lib.GithubClient, owner: str, repo_name: str, canonical_labels: list, delete_unlisted: bool, dry_run: bool) -> list:
+    '''
+    Brings one repo's labels in line with the canonical set.
+
+    Returns:
+    - the changes made (or that would be made, for a dry run)
+    '''
+    changes = get_label_changes(canonical_labels, get_repo_labels(client, owner, repo_name), delete_unlisted)
+    for action, current_label, label in changes:
+        print ("%s%s: %s label %s" %('[dry run] ' if dry_run else '', repo_name, action, (label or current_label)['name']))
+    if not dry_run:
+        apply_label_changes(client, owner, repo_name, changes)
+    return changes
+
+def sync_labels(client: github_client_lib.GithubClient, owner: str, repo_names: list, label_set: dict, max_workers: int = 8, dry_run: bool = False) -> dict:
+    '''
+    Syncs the labels of every repo with the canonical label set, `max_workers` repos at a time. Nothing is cloned: labels are read and written through the API.
+
+    Args:
+    - client: Github client shared by all repos (from repo_lib.get_github_client())
+    - owner: organization of the repos
+    - repo_names: repos to sync
+    - label_set: label sync configurations, the canonical labels are `labels`, or copied from `source-repository` if there are none
+    - max_workers: how many repos are synced at the same time
+    - dry_run: only print the changes
+
+    Returns:
+    - dictionary of {repo name: list of changes, or the error if the sync failed}
+    '''
+    canonical_labels = label_set.get('labels') or []
+    if not canonical_labels and label_set.get('source-repository'):
+        canonical_labels = get_repo_labels(client, owner, label_set['source-repository'])
+        print ("Copying %s labels from %s..." %(len(canonical_labels), label_set['source-repository']))
+    if not canonical_labels:
+        raise ValueError("No labels to sync: set `labels` or `source-repository`")
+    repo_names = [repo_name for repo_name in repo_names if repo_name != label_set.get('source-repository')]
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {repo_name: executor.submit(sync_repo_labels, client, owner, repo_name, canonical_labels, bool(label_set.get('delete-unlisted-labels')), dry_run)
+                   for repo_name in repo_names}
+        for repo_name, future in futures.items():
+            try:
+                results[repo_name] = future.result()
+            except github.GithubException as error:
+                print (u'\u2717', "Syncing labels of %s FAILED. Error: %s..." %(repo_name, error))
+                results[repo_name] = error
+    return results
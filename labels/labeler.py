@@ -1,60 +1,54 @@
-import subprocess
-import yaml
-import ruamel.yaml
-import os
-import git
-
-
-class Author:
-    name: str
-    email: str
-
-def load_configurations() -> dict:
-    with open("packages.yml") as file:
-        config = ruamel.yaml.load(file, Loader=ruamel.yaml.RoundTripLoader, preserve_quotes=True)        
-    return config
-
-def load_credentials() -> dict:
-    with open("credentials.yml") as file:
-        creds = yaml.load(file, Loader=yaml.FullLoader)
-    return creds
-
-def clone_repo(gh_link: str, path_to_repository: str, ssh_key: str) -> None:
-    try:
-        branch = "master"
-        cloned_repository = git.Repo.clone_from(gh_link, path_to_repository, branch=branch,
-                                            env={"GIT_SSH_COMMAND": 'ssh -i ' + ssh_key})
-    except:
-        branch = "main"
-        cloned_repository = git.Repo.clone_from(gh_link, path_to_repository, branch=branch,
-                                env={"GIT_SSH_COMMAND": 'ssh -i ' + ssh_key})
-    return cloned_repository, branch
-
-creds = load_credentials()
-config = load_configurations()
-# client = get_github_client(creds["access_token"])
-write_to_directory = "repositories"
-repository_author = Author 
-repository_author.name = creds["repository_author_name"]
-repository_author.email = creds["repository_author_email"]
-ssh_key = creds["ssh_key"]
-
-for repo_name in config["repositories"]:
-    print ("Label update in progress for: ", repo_name)
-    ## Not sure why default branch here doesn't work
-    gh_link = "git@github.com:fivetran/" + repo_name + ".git"
-    path_to_repository = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                        write_to_directory + '/' + repo_name )
-
-    cloned_repository, default_branch = clone_repo(gh_link, path_to_repository, ssh_key)
-
-    print("Adding labels for %s" %repo_name)
-    # labels = ['test_label_1'] ## will change this into a dictionary so we can get colors and descriptions
-    ## Alternatively we can generate one "true set" of labels and then just clone it from repo to repo
-    # for label_name in labels:
-    # description = "\"this is a test description\""
-    # label = "test_label_1"
-    # subprocess.check_call("./create_label.sh %s %s %s" % (repo_name, label, description), shell=True)
-    subprocess.check_call("./clone_labels.sh %s" % (repo_name), shell=True)
+'''
+Syncs the labels of every repository in package_manager.yml with the canonical label set in labels/labels.yml, through the GitHub API.
+Run it from the root of this repo:
+
+    python3 labels/labeler.py [--dry-run]
+'''
+# used to parse the command line options
+import argparse
 
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
 
+# gives us access to the import path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# local stuff
+import local_load_lib
+import rollout_config_lib
+import repo_lib
+import label_sync_lib
+
+## The canonical label set, next to this script
+LABELS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'labels.yml')
+
+def main(dry_run: bool = False, labels_file: str = LABELS_FILE) -> dict:
+    '''
+    Syncs the labels of the repositories configured in package_manager.yml.
+
+    Args:
+    - dry_run: only print the label changes each repository would get
+    - labels_file: the label sync configurations
+
+    Returns:
+    - dictionary of {repo name: list of label changes, or the error if the sync failed}
+    '''
+    creds = local_load_lib.load_credentials()
+    config = rollout_config_lib.load_rollout_plan()
+    label_set = label_sync_lib.load_label_set(labels_file)
+    client = repo_lib.get_github_client(creds["access_token"], base_url=creds.get("github_base_url", 'https://api.github.com'))
+
+    results = label_sync_lib.sync_labels(client, label_set.get('owner', 'fivetran'), list(config['repositories'] or []), label_set,
+                                         max_workers=config.get('max-parallel-repos', 1), dry_run=dry_run)
+    num_changes = sum(len(changes) for changes in results.values() if isinstance(changes, list))
+    num_failed = sum(1 for changes in results.values() if not isinstance(changes, list))
+    print (u'\u2713', "%s label changes across %s repositories (%s failed)..." %(num_changes, len(results), num_failed))
+    client.print_api_call_summary()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the labels of the repositories in package_manager.yml with labels/labels.yml.")
+    parser.add_argument('--dry-run', action='store_true', help="only print the label changes each repository would get")
+    args = parser.parse_args()
+    main(dry_run=args.dry_run)
@@ -1,27 +1,12 @@
 # allows you to read, write, and parse YAML files
 import yaml
 
-# ruamel.yaml is a YAML 1.2 loader/dumper package for Python. It is a fork of the PyYAML library
-# powerful and flexible YAML parser that can be used for a variety of tasks. It is a good choice for applications that require a high degree of control over the YAML format.
-import ruamel.yaml
-
 # The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
 import os
 
 # high-level interface to the operating system's file manipulation functions. It provides a number of functions for copying, moving, deleting, and renaming files and directories.
 import shutil
 
-def load_configurations() -> dict:
-    """
-    Loads all configurations from `package_manager.yml` file located in root repo
-    
-    Returns:
-    - dictionary object of configurations that were defined in yml
-    """
-    with open("package_manager.yml") as file:
-        config = ruamel.yaml.load(file, Loader=ruamel.yaml.RoundTripLoader, preserve_quotes=True)        
-    return config
-
 def load_credentials() -> dict:
     '''
     load the credentials you created in the prerequisites for using this package:
@@ -47,4 +32,16 @@ def clear_working_directory(write_to_directory: str) -> None:
         try: 
             shutil.rmtree(write_to_directory + '/')
         except OSError as e:
-            raise OSError(f"The " + write_to_directory + " directory cannot be removed: {e}")
\ No newline at end of file
+            raise OSError(f"The " + write_to_directory + " directory cannot be removed: {e}")
+
+def get_cache_directory(*sub_directories: str) -> str:
+    '''
+    Returns (and creates if needed) a folder inside `.package_updater_cache/`, which persists between runs
+    unlike the `repositories` working directory.
+
+    Args:
+    - sub_directories: path of the folder inside the cache, ie get_cache_directory('file_index', 'dbt_jira')
+    '''
+    cache_directory = os.path.join('.package_updater_cache', *sub_directories)
+    os.makedirs(cache_directory, exist_ok=True)
+    return cache_directory
@@ -5,12 +5,35 @@ import os
 import shutil
 #  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
 import git
+# used to bind the shared configurations to the per-repo pipeline before handing it to the worker pool
+import functools
+# used to name the log folder of each run
+import time
+# used to parse the command line options (ie --plan)
+import argparse
 
 # local stuff
 import local_load_lib
 import repo_lib
 import pull_request_lib as pr_lib
 import package_updates
+import rollout_lib
+import file_index_lib
+import github_client_lib
+import plan_lib
+import journal_lib
+import trace_lib
+import commit_builder_lib
+import process_pool_lib
+import package_registry_lib
+import dependency_graph_lib
+import change_set_lib
+import pull_request_batch_lib
+import search_index_lib
+import rollout_config_lib
+import release_index_lib
+import objects
+import pr_watch_lib
 
 class Author:
     '''
@@ -19,7 +42,401 @@ class Author:
     name: str
     email: str
 
-def main():
+def apply_package_updates(path_to_repository: str, file_paths: list, config: dict, dependency_versions: dict = None, files_to_add: dict = None,
+                          cloned_repository: git.Repo = None, candidate_paths: set = None, latest_versions: dict = None, bump_version: bool = True) -> tuple:
+    '''
+    Applies all the package updates configured in package_manager.yml to a cloned repo.
+    The updates are planned as one change set (see change_set_lib), so each file is read and written at most once.
+
+    Args:
+    - path_to_repository: the path to the cloned repo
+    - file_paths: the repo files find-and-replace should look at (from file_index_lib.get_file_paths())
+    - config: configurations loaded from package_manager.yml
+    - dependency_versions: {package hub name: version range} to set in packages.yml, ie for upstream packages bumped earlier in the rollout
+    - files_to_add: manifest of the files-to-add (from package_updates.get_files_to_add_manifest()), built once per run
+    - cloned_repository: the clone, files to add that it already has with the same content are then skipped without reading them
+    - candidate_paths: files the find strings may be in (from get_candidate_paths()), None to search every file
+    - latest_versions: {package hub name: latest release} dependencies are moved to if their range doesn't allow it (from release_index_lib)
+    - bump_version: False to leave the project version alone, ie for a campaign stacked on a branch whose version is already bumped
+
+    Returns:
+    - dictionary of {find-and-replace rule: number of matches across the repo}, and the new version of the package
+    '''
+    files = change_set_lib.WorktreeFiles(path_to_repository, cloned_repository,
+                                         streaming_threshold=int(config.get('streaming-threshold-mb', 10) * 1024 * 1024))
+    return change_set_lib.apply_package_updates(files=files, file_paths=file_paths, config=config,
+                                                dependency_versions=dependency_versions, files_to_add=files_to_add, candidate_paths=candidate_paths,
+                                                latest_versions=latest_versions, bump_version=bump_version)
+
+def get_dependency_versions(repo_name: str, upstream_repos: dict, released_versions: dict, config: dict = None) -> dict:
+    '''
+    Returns the packages.yml version ranges that are set as they are: the upstream packages of a repo that were bumped earlier in the rollout,
+    and `fivetran-utils-version` if it is configured.
+
+    Args:
+    - repo_name
+    - upstream_repos: {repo name: repos in the rollout it depends on} (from dependency_graph_lib.get_upstream_repos())
+    - released_versions: {repo name: new version} of the repos updated so far
+    - config: configurations loaded from package_manager.yml
+
+    Returns:
+    - dictionary of {package hub name: version range}
+    '''
+    dependency_versions = {}
+    fivetran_utils_version = (config or {}).get('fivetran-utils-version')
+    if fivetran_utils_version:
+        dependency_versions['fivetran/fivetran_utils'] = fivetran_utils_version if isinstance(fivetran_utils_version, str) else list(fivetran_utils_version)
+    dependency_versions.update({package_registry_lib.get_hub_name(upstream): package_updates.get_dependency_version_range(released_versions[upstream])
+                                for upstream in upstream_repos.get(repo_name, []) if released_versions.get(upstream)})
+    return dependency_versions
+
+def get_candidate_paths(repo_name: str, cloned_repository: git.Repo, config: rollout_config_lib.RolloutPlan, search_index: search_index_lib.SearchIndex,
+                        base_commit: str = None) -> set:
+    '''
+    Returns the files of a clone the find-and-replace rules may match, from the search index, or None if every file has to be searched.
+    A clone with all of its blobs (any clone-mode but partial) is indexed first if the index doesn't have its commit yet.
+    The default branch as cloned (`base_commit`, HEAD if not given) is what gets indexed, never a commit of the rollout.
+    '''
+    if search_index is None:
+        return None
+    commit_sha = base_commit or cloned_repository.head.commit.hexsha
+    if config.get('clone-mode', 'full') != 'partial':
+        search_index.index_commit(repo_name, cloned_repository, commit_sha)
+    return search_index.get_candidate_paths(repo_name, commit_sha, [find for find, replace in config.replacement_items])
+
+def get_repo_names(config: dict, registry: package_registry_lib.PackageRegistry, search_index: search_index_lib.SearchIndex) -> list:
+    '''
+    Returns the repos to roll out to: `repositories`, narrowed down to the ones that contain one of the `repositories-containing` strings if set.
+    With `repositories-containing` and no `repositories`, every package in the registry is searched.
+    '''
+    repo_names = list(config['repositories'] or [])
+    if search_index is None:
+        return repo_names
+    texts = [str(text) for text in config.get('repositories-containing') or []]
+    if texts and not repo_names:
+        repo_names = sorted(registry.packages)
+    search_index.index_mirrors(repo_names)
+    if not texts:
+        return repo_names
+    return search_index_lib.select_repositories(search_index, repo_names, texts)
+
+def search_repositories(text: str) -> None:
+    '''
+    Prints the files that contain `text` in every package with a cached mirror (see search_index_lib), without cloning or calling the API.
+    '''
+    config = rollout_config_lib.load_rollout_plan()
+    search_index = search_index_lib.SearchIndex()
+    search_index.index_mirrors(list(config['repositories'] or []) or sorted(package_registry_lib.PackageRegistry().packages))
+    matches = search_index.search(text)
+    for repo_name, paths in matches.items():
+        print (repo_name)
+        for path in paths:
+            print ("    " + path)
+    print ("'%s' found in %s files across %s of %s indexed repositories" %(text, sum(len(paths) for paths in matches.values()), len(matches),
+                                                                        len(search_index.get_indexed_repos())))
+
+def get_run_journal(config: rollout_config_lib.RolloutPlan, campaigns: list) -> journal_lib.RunJournal:
+    '''
+    Returns the run journal of the rollout, whose hash covers package_manager.yml and the configurations of every campaign file.
+    '''
+    return journal_lib.RunJournal(config if len(campaigns) == 1 else dict(config, campaigns=[dict(campaign.config) for campaign in campaigns[1:]]))
+
+def watch_pull_requests() -> dict:
+    '''
+    Follows the CI checks of every PR the rollout configured in package_manager.yml has opened so far (as recorded in its run journal)
+    until they all pass or fail, see pr_watch_lib. Nothing is cloned and the API is only called for the batched check queries.
+
+    Returns:
+    - the number of PRs per result, ie {'pass': 40, 'fail': 2}
+    '''
+    config = rollout_config_lib.load_rollout_plan()
+    journal = get_run_journal(config, rollout_config_lib.load_campaigns(config))
+    pull_urls = journal.get_pull_request_urls()
+    if not pull_urls:
+        print ("No PRs recorded in %s yet, run the rollout first..." %(journal.journal_path))
+        return {}
+    creds = local_load_lib.load_credentials()
+    client = repo_lib.get_github_client(creds["access_token"], base_url=creds.get("github_base_url", 'https://api.github.com'))
+    watch = pr_watch_lib.PullRequestWatch(client, 'fivetran', pull_urls,
+                                          interval=config['watch-interval-seconds'], max_interval=config['watch-max-interval-seconds'])
+    print ("Watching the checks of %s PRs across %s repositories..." %(len(watch.pulls), len(pull_urls)))
+    try:
+        counts = watch.watch()
+    except KeyboardInterrupt:
+        print ("\nStopped watching...")
+        counts = watch.get_counts()
+    watch.print_summary()
+    client.print_api_call_summary()
+    return counts
+
+def plan_repository(repo_name: str, config: dict, creds: dict, write_to_directory: str, plan_directory: str, upstream_repos: dict, released_versions: dict,
+                    campaigns: list, search_index: search_index_lib.SearchIndex = None, latest_versions: dict = None) -> dict:
+    '''
+    Dry run of the rollout for a single repo: applies all package updates to a checkout of the repo's cached mirror
+    and writes the resulting diff to `plan_directory`, without committing, pushing or calling the GitHub API.
+    A mirror is only cloned (once) if the repo isn't cached yet. The campaigns are applied one after another to the same checkout,
+    so the diff is everything the rollout changes, whatever branch each campaign is committed to.
+
+    Args:
+    - repo_name: name of the repo to plan (from package_manager.yml)
+    - config: configurations loaded from package_manager.yml
+    - creds: credentials loaded from credentials.yml
+    - write_to_directory: folder the repo gets checked out into
+    - plan_directory: folder the plan of this run is written to
+    - upstream_repos: {repo name: repos in the rollout it depends on} (from dependency_graph_lib.get_upstream_repos())
+    - released_versions: {repo name: new version} of the repos planned so far, this repo's new version is added to it
+    - campaigns: the objects.Update of every campaign (from rollout_config_lib.load_campaigns()), with their files_to_add manifest
+    - search_index: the search index, find-and-replace only opens the files it says may match (None searches every file)
+    - latest_versions: {package hub name: latest release} from the release index, None to leave dependencies that aren't in the rollout alone
+
+    Returns:
+    - change statistics of the repo for the plan summary
+    '''
+    trace_lib.set_repo(repo_name)
+    gh_link = "git@github.com:fivetran/" + repo_name + ".git"
+    path_to_repository = os.path.abspath(os.path.join(write_to_directory, repo_name))
+    with trace_lib.span('clone', clone_mode='mirror'):
+        cloned_repository = repo_lib.clone_repo_from_mirror(gh_link, repo_name, path_to_repository, creds["ssh_key"], fetch=False)
+    with trace_lib.span('get_file_paths') as attributes:
+        file_paths = file_index_lib.get_file_paths(cloned_repository=cloned_repository, repo_name=repo_name, config=config)
+        attributes['files_indexed'] = len(file_paths)
+    rules_matched = {}
+    for number, campaign in enumerate(campaigns):
+        if len(campaigns) > 1:
+            print ("Planning campaign %s..." %(campaign.name))
+        with trace_lib.span('search_index') as attributes:
+            candidate_paths = get_candidate_paths(repo_name, cloned_repository, campaign.config, search_index)
+            if candidate_paths is not None and number > 0:
+                # the files earlier campaigns changed aren't what the index has
+                candidate_paths.update(cloned_repository.git.diff('--name-only', 'HEAD').splitlines())
+            attributes['candidate_files'] = len(candidate_paths) if candidate_paths is not None else None
+        # only the first campaign points packages.yml at the upstream packages of the rollout, and bumps the version
+        dependency_versions = get_dependency_versions(repo_name, upstream_repos if number == 0 else {}, released_versions, campaign.config)
+        with trace_lib.span('transform', profile=True):
+            campaign_rules, new_version = apply_package_updates(path_to_repository=path_to_repository, file_paths=file_paths, config=campaign.config,
+                                                                dependency_versions=dependency_versions, files_to_add=campaign.files_to_add,
+                                                                cloned_repository=cloned_repository, candidate_paths=candidate_paths,
+                                                                latest_versions=latest_versions if campaign.config.get('update-dependency-versions') else None,
+                                                                bump_version=(number == 0))
+        if number == 0:
+            released_versions[repo_name] = new_version
+        for rule, count in campaign_rules.items():
+            rules_matched[rule] = rules_matched.get(rule, 0) + count
+    with trace_lib.span('plan') as attributes:
+        stats = plan_lib.write_repository_plan(cloned_repository, repo_name, plan_directory, rules_matched)
+        attributes['files_touched'] = stats['files touched']
+    return stats
+
+def transform_campaign(campaign: objects.Update, repo_name: str, cloned_repository: git.Repo, path_to_repository: str, in_memory: bool, base_commit: str,
+                       start_commit: str, file_paths: list, search_index: search_index_lib.SearchIndex, dependency_versions: dict, latest_versions: dict,
+                       bump_version: bool) -> tuple:
+    '''
+    Applies the package updates of one campaign to a clone, on top of `start_commit`, and stages the result without committing it.
+
+    Args:
+    - campaign: the campaign to apply
+    - repo_name
+    - cloned_repository: the clone
+    - path_to_repository: the path to the clone
+    - in_memory: whether the clone is edited in the object database (`commit-mode: in-memory`) instead of a checkout
+    - base_commit: the default branch as cloned, `file_paths` are its files
+    - start_commit: commit the campaign builds on: the base commit, or the commit of an earlier campaign on the same branch
+    - file_paths: the files of the base commit find-and-replace should look at (from file_index_lib.get_file_paths())
+    - search_index: the search index, find-and-replace only opens the files it says may match (None searches every file)
+    - dependency_versions: {package hub name: version range} to set in packages.yml
+    - latest_versions: {package hub name: latest release} from the release index, used if the campaign sets `update-dependency-versions`
+    - bump_version: False to leave the project version alone (it is already bumped on the branch)
+
+    Returns:
+    - hash of the staged tree, and the new version of the package
+    '''
+    config = campaign.config
+    if start_commit != base_commit:
+        file_paths = file_index_lib.update_file_paths(cloned_repository, file_paths, config, base_commit, start_commit)
+
+    # only the files that can contain a `find` string get opened by find-and-replace
+    with trace_lib.span('search_index') as attributes:
+        candidate_paths = get_candidate_paths(repo_name, cloned_repository, config, search_index, base_commit)
+        if candidate_paths is not None and start_commit != base_commit:
+            # the files earlier campaigns changed aren't what the index has
+            candidate_paths.update(cloned_repository.git.diff('--name-only', base_commit, start_commit).splitlines())
+        attributes['candidate_files'] = len(candidate_paths) if candidate_paths is not None else None
+
+    latest_versions = latest_versions if config.get('update-dependency-versions') else None
+    if in_memory:
+        # read the blobs the rules target straight from the object database and write only the changed blobs and trees
+        editor = commit_builder_lib.TreeEditor(cloned_repository, start_commit)
+        with trace_lib.span('transform', profile=True):
+            _, new_version = change_set_lib.apply_package_updates(files=editor, file_paths=file_paths, config=config, dependency_versions=dependency_versions,
+                                                                  files_to_add=campaign.files_to_add, candidate_paths=candidate_paths,
+                                                                  latest_versions=latest_versions, bump_version=bump_version)
+        with trace_lib.span('stage') as attributes:
+            content_hash = editor.write_tree()
+            attributes['files_touched'] = len(editor.get_changed_paths())
+    else:
+        # Essentially run `$ git checkout -B branch_name start_commit` (maybe move to pr_lib?)
+        pr_lib.checkout_branch(cloned_repository=cloned_repository, branch_name=campaign.branch_name, start_point=start_commit)
+        with trace_lib.span('transform', profile=True):
+            _, new_version = apply_package_updates(path_to_repository=path_to_repository, file_paths=file_paths, config=config, dependency_versions=dependency_versions,
+                                                   files_to_add=campaign.files_to_add, cloned_repository=cloned_repository, candidate_paths=candidate_paths,
+                                                   latest_versions=latest_versions, bump_version=bump_version)
+        with trace_lib.span('stage') as attributes:
+            content_hash = pr_lib.stage_changes(cloned_repository)
+            attributes['files_touched'] = len(pr_lib.get_staged_paths(cloned_repository))
+    return content_hash, new_version
+
+def update_repository(repo_name: str, client: github_client_lib.GithubClient, config: dict, creds: dict, repository_author: Author, write_to_directory: str, journal: journal_lib.RunJournal,
+                      registry: package_registry_lib.PackageRegistry, upstream_repos: dict, released_versions: dict, pull_requests: dict, campaigns: list,
+                      search_index: search_index_lib.SearchIndex = None, latest_versions: dict = None) -> dict:
+    '''
+    Runs the whole rollout for a single repo: API setup, clone, apply package updates, commit, push, and queue the PR.
+    The repo is cloned once for all campaigns: each campaign is committed on its own, on top of the earlier campaigns with the same branch,
+    and every branch is pushed in a single push.
+    Every completed stage is recorded in the run journal, so a re-run with the same configurations skips repos that are done
+    and only does the unfinished work of the others.
+
+    Args:
+    - repo_name: name of the repo to update (from package_manager.yml)
+    - client: Github client shared by all repos (from get_github_client())
+    - config: configurations loaded from package_manager.yml
+    - creds: credentials loaded from credentials.yml
+    - repository_author: author of the commit
+    - write_to_directory: folder the repo gets cloned into
+    - journal: the run journal of this rollout
+    - registry: the package registry, the repo's metadata is read from it instead of the API
+    - upstream_repos: {repo name: repos in the rollout it depends on} (from dependency_graph_lib.get_upstream_repos())
+    - released_versions: {repo name: new version} of the repos rolled out so far, this repo's new version is added to it
+    - pull_requests: {branch name: PR batch of the branch}, the repo is added to the batch of every branch it pushes
+    - campaigns: the objects.Update of every campaign (from rollout_config_lib.load_campaigns()), with their files_to_add manifest
+    - search_index: the search index, find-and-replace only opens the files it says may match (None searches every file)
+    - latest_versions: {package hub name: latest release} from the release index, None to leave dependencies that aren't in the rollout alone
+
+    Returns:
+    - stats about the run for the rollout summary
+    '''
+    if journal.is_complete(repo_name):
+        print (u'\u2713', "Already rolled out to %s in a previous run, skipping..." %(repo_name))
+        released_versions[repo_name] = journal.get(repo_name).get('version')
+        return {'resumed': 'already complete'}
+    print ("PR in progress for: ", repo_name)
+    trace_lib.set_repo(repo_name)
+
+    ## set everything up for github: from the package registry if the repo is in it, otherwise from the API
+    with trace_lib.span('setup_repo') as attributes:
+        repo = registry.get_repo(client, repo_name)
+        attributes['from_registry'] = repo is not None
+        if repo is None:
+            repo = repo_lib.setup_repo(client, repo_name, config['branch-name'])
+    gh_link = "git@github.com:fivetran/" + repo_name + ".git"
+    path_to_repository = os.path.abspath(os.path.join(write_to_directory, repo_name))
+
+    # clone the repo's default branch, as read from the repo metadata - this returns the git cloned repo and how long the clone took
+    # in-memory commit-mode never checks out any files: only the git objects are fetched
+    default_branch = repo.default_branch
+    in_memory = config.get('commit-mode', 'worktree') == 'in-memory'
+    cloned_repository, clone_seconds = repo_lib.clone_repo(gh_link, repo_name, path_to_repository, creds["ssh_key"],
+                                                           default_branch=default_branch, clone_mode=config.get('clone-mode', 'full'), no_checkout=in_memory)
+    journal.record(repo_name, 'cloned')
+    base_commit = cloned_repository.head.commit.hexsha
+
+    # list the .sql/.yml files find-and-replace should look at, straight from the clone's git tree
+    with trace_lib.span('get_file_paths') as attributes:
+        file_paths = file_index_lib.get_file_paths(cloned_repository=cloned_repository, repo_name=repo_name, config=config)
+        attributes['files_indexed'] = len(file_paths)
+
+    # Apply the changes of each campaign and commit them. The package updates only run locally, so they are simply re-applied when resuming
+    # Commits go on top of the branch on origin if it exists, so the push is a fast-forward (merging in the default branch if it moved since)
+    # A branch someone else pushed to is left alone: stacking on it would revert their commit
+    branches = {} # branch name -> {'tip': latest local commit or None, 'remote_tip': tip on origin or None, 'campaigns': campaigns applied}
+    known_commits = set((journal.get(repo_name).get('commits') or {}).values())
+    for campaign in campaigns:
+        if campaign.branch_name not in branches:
+            remote_tip = pr_lib.get_remote_branch_tip(cloned_repository, campaign.branch_name)
+            if remote_tip and not pr_lib.is_own_commit(cloned_repository, remote_tip, repository_author, known_commits):
+                author = cloned_repository.commit(remote_tip).author
+                raise pr_lib.DivergedBranch("%s on origin has a commit the updater didn't make (%s by %s), not stacking on it"
+                                            %(campaign.branch_name, remote_tip[:7], author.email))
+            branches[campaign.branch_name] = {'tip': None, 'remote_tip': remote_tip, 'campaigns': []}
+    new_version = None
+    for number, campaign in enumerate(campaigns):
+        branch = branches[campaign.branch_name]
+        if len(campaigns) > 1:
+            print ("Applying campaign %s (%s)..." %(campaign.name, campaign.branch_name))
+        start_commit = branch['tip'] or base_commit
+        # packages.yml is pointed at the new versions of the upstream packages rolled out in earlier waves by the first campaign
+        dependency_versions = get_dependency_versions(repo_name, upstream_repos if number == 0 else {}, released_versions, campaign.config)
+        content_hash, campaign_version = transform_campaign(campaign=campaign, repo_name=repo_name, cloned_repository=cloned_repository,
+                                                            path_to_repository=path_to_repository, in_memory=in_memory, base_commit=base_commit,
+                                                            start_commit=start_commit, file_paths=file_paths, search_index=search_index,
+                                                            dependency_versions=dependency_versions, latest_versions=latest_versions,
+                                                            bump_version=not branch['campaigns'])
+        branch['campaigns'].append(campaign)
+        if number == 0:
+            new_version = campaign_version
+        if content_hash == pr_lib.get_tree_hash(cloned_repository, start_commit):
+            print (u'\u2713', "No changes from %s, skipping..." %(campaign.name))
+            continue
+        with trace_lib.span('commit'):
+            # the first commit to a branch already on origin merges in the default branch if it moved since (see pr_lib.get_parent_commits())
+            parent_commits = [branch['tip']] if branch['tip'] else pr_lib.get_parent_commits(cloned_repository, base_commit, branch['remote_tip'])
+            if in_memory:
+                branch['tip'] = commit_builder_lib.commit_tree(cloned_repository=cloned_repository, tree_hash=content_hash, branch_name=campaign.branch_name,
+                                                               commit_message=campaign.config['commit-message'], repository_author=repository_author,
+                                                               parent_commits=parent_commits)
+            else:
+                branch['tip'] = pr_lib.commit_changes(cloned_repository=cloned_repository, branch_name=campaign.branch_name,
+                                                      commit_message=campaign.config['commit-message'], repository_author=repository_author,
+                                                      parent_commits=parent_commits)
+        campaign.repos.append(repo_name)
+    changed_branches = [branch_name for branch_name, branch in branches.items() if branch['tip']]
+    journal.record(repo_name, 'transformed', trees={branch_name: pr_lib.get_tree_hash(cloned_repository, branches[branch_name]['tip']) for branch_name in changed_branches},
+                   version=new_version)
+    released_versions[repo_name] = new_version
+
+    if not changed_branches:
+        print (u'\u2713', "No changes to roll out to %s, skipping..." %(repo_name))
+        journal.record(repo_name, 'pr_opened', pr_url=None)
+        return {'clone': "%.1fs" %(clone_seconds), 'resumed': 'nothing to change'}
+    journal.record(repo_name, 'committed', commits={branch_name: branches[branch_name]['tip'] for branch_name in changed_branches})
+
+    # If a branch is already on origin with exactly this content, the change was pushed by a previous run: skip straight to the PR
+    branches_to_push = []
+    for branch_name in changed_branches:
+        branch = branches[branch_name]
+        if branch['remote_tip'] and pr_lib.get_tree_hash(cloned_repository, branch['remote_tip']) == pr_lib.get_tree_hash(cloned_repository, branch['tip']):
+            print (u'\u2713', "Changes already pushed to %s, skipping push..." %(branch_name))
+            branch['tip'] = branch['remote_tip']
+        else:
+            branches_to_push.append(branch_name)
+    if branches_to_push:
+        with trace_lib.span('push'):
+            pr_lib.push_branches(cloned_repository=cloned_repository, branch_names=branches_to_push)
+    journal.record(repo_name, 'pushed', commits={branch_name: branches[branch_name]['tip'] for branch_name in changed_branches})
+
+    # The PRs are opened (or their title/body updated) together with the PRs of all other repos once the rollout is pushed, see main()
+    for branch_name in changed_branches:
+        pull_requests[branch_name].add(repo_name, default_branch)
+
+    return {'clone': "%.1fs" %(clone_seconds),
+            'pr': ", ".join('existing' if pull_requests[branch_name].get_open_pull_request(repo_name) else 'new' for branch_name in changed_branches)}
+
+def main(plan: bool = False, restart: bool = False, profile: bool = False, chrome_trace: bool = False):
+    '''
+    Runs the rollout configured in package_manager.yml.
+
+    Args:
+    - plan: only work out and write the diff each repo would get (see plan_repository()), without committing or pushing anything
+    - restart: ignore the progress recorded by previous runs of the same configurations and start the rollout over
+    - profile: capture cProfile output of the transformation stages in logs/<timestamp>/profiles/
+    - chrome_trace: also write the stage timings as a Chrome trace to logs/<timestamp>/trace.chrome.json
+    '''
+    ## Loads the configurations from your package_manager.yml, validated and compiled into a read-only rollout plan
+    ## An invalid file fails here, before anything is cleared, cloned or requested
+    config = rollout_config_lib.load_rollout_plan()
+
+    ## The changes of package_manager.yml are the first campaign of the rollout, the files listed in its `campaigns` are the others
+    campaigns = rollout_config_lib.load_campaigns(config)
+
     ## This is the name of the directory pkgs will be cloned into. Lets clear it out if it exists from a previous run
     write_to_directory = "repositories" 
     local_load_lib.clear_working_directory(write_to_directory)
@@ -29,11 +446,50 @@ def main():
     ## Loads credentials from your credentials.yml file, you will need to create a file that resembles `samples.credentials.yml`
     creds = local_load_lib.load_credentials()
 
-    ## Currently loads configurations from your package_manager.yml
-    config = local_load_lib.load_configurations()
+    ## Each repo's output is written to its own file in logs/<timestamp>/ 
+    run_timestamp = time.strftime("%Y%m%d-%H%M%S")
+    log_directory = os.path.join("logs", run_timestamp)
+
+    ## Packages are rolled out in waves: a package only starts once every package it depends on (in packages.yml) is done,
+    ## so its packages.yml can be pointed at their new versions
+    registry = package_registry_lib.PackageRegistry()
+    released_versions = {}
+
+    ## The files-to-add are read and hashed once for the whole run, repos then only get the ones they don't already have
+    for campaign in campaigns:
+        campaign.files_to_add = package_updates.get_files_to_add_manifest(campaign.config['files-to-add'])
+
+    ## The trigram index of the cached mirrors in .package_updater_cache/search_index.sqlite picks the repos (`repositories-containing`)
+    ## and the files find-and-replace opens
+    search_index = search_index_lib.SearchIndex() if config.get('search-index', False) or config.get('repositories-containing') else None
+
+    ## With `update-dependency-versions`, dependencies whose range doesn't allow their latest release are moved to it
+    ## The release tags of every package are kept in .package_updater_cache/release_index.json
+    release_index = release_index_lib.ReleaseIndex(registry.owner) if any(campaign.config.get('update-dependency-versions', False) for campaign in campaigns) else None
+
+    if plan:
+        ## Dry run: write each repo's diff and change statistics to plans/<timestamp>/ and stop there
+        plan_directory = os.path.join("plans", run_timestamp)
+        os.makedirs(plan_directory, exist_ok=True)
+        trace_lib.start(log_directory, chrome_trace=chrome_trace, profile=profile)
+        try:
+            repo_names = get_repo_names(config, registry, search_index)
+            upstream_repos = dependency_graph_lib.get_upstream_repos(repo_names, registry)
+            pipeline = functools.partial(plan_repository, config=config, creds=creds, write_to_directory=write_to_directory, plan_directory=plan_directory,
+                                         upstream_repos=upstream_repos, released_versions=released_versions, campaigns=campaigns, search_index=search_index,
+                                         latest_versions=release_index.get_latest_versions() if release_index else None)
+            results = rollout_lib.run_waves(waves=dependency_graph_lib.get_waves(repo_names, upstream_repos), upstream_repos=upstream_repos,
+                                            pipeline=pipeline, max_parallel_repos=config.get('max-parallel-repos', 1), log_directory=log_directory)
+            rollout_lib.print_summary(results)
+            plan_lib.write_plan_summary(results, plan_directory)
+        finally:
+            process_pool_lib.shutdown()
+            trace_lib.stop()
+        return
 
     ## The below is required for you to clone the respective repos inside your package_manager.yml
-    client = repo_lib.get_github_client(creds["access_token"])
+    ## One client is shared by all repos so the rate limit budget is tracked across the whole run
+    client = repo_lib.get_github_client(creds["access_token"], base_url=creds.get("github_base_url", 'https://api.github.com'))
 
     # Create author object
     repository_author = Author
@@ -42,41 +498,82 @@ def main():
     ## Assigns Author object an email
     repository_author.email = creds["repository_author_email"] 
 
-    ## Iterates over all repos that are currently included in `package_manager.yml`
-    ## Make sure there aren't more than 10 or so packages uncommented out 
-    ## maybe move to own function? 
-    for repo_name in config["repositories"]:
-        print ("PR in progress for: ", repo_name)
-
-        ## set everything up for github
-        repo = repo_lib.setup_repo(client, repo_name, config['branch-name'])
-        file_paths = repo_lib.get_file_paths(repo)
-        gh_link = "git@github.com:fivetran/" + repo_name + ".git"
-        path_to_repository = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                            write_to_directory + '/' + repo_name )
-
-        # clone the repo - this returns the git cloned repo and its default branch (main vs master)
-        cloned_repository, default_branch = repo_lib.clone_repo(gh_link, path_to_repository, creds["ssh_key"])
-        
-        # Essentially run `$ git checkout -b branch_name` (maybe move to pr_lib?)
-        working_branch = pr_lib.checkout_branch(cloned_repository=cloned_repository, branch_name=config['branch-name'])
-
-        # Apply changes to package
-        package_updates.add_to_file(files_to_add_to=config['files-to-add-to'], path_to_repository=path_to_repository)
-        package_updates.add_files(file_paths=config['files-to-add'], path_to_repository=path_to_repository)
-        package_updates.remove_files(file_paths=config['files-to-remove'], path_to_repository=path_to_repository)
-        package_updates.find_and_replace(file_paths=file_paths, find_and_replace_texts=config['find-and-replace'], path_to_repository=path_to_repository)
-        package_updates.update_project(repo=repo, path_to_repository=path_to_repository, config=config)
-        
-        # call update_packages once function works
-
-        # Add and commit changes to branch
-        pr_lib.commit_changes(cloned_repository=cloned_repository, branch_name=config['branch-name'], commit_message=config['commit-message'], repository_author=repository_author)
-
-        # Push changes to remote and open PR if one does not already exist
-        # Body of PR is configured in pull_request_body.md
-        pr_lib.push_changes(cloned_repository=cloned_repository, branch_name=config['branch-name'], repo_name=repo_name, repo=repo, default_branch=default_branch, new_branch=working_branch, pr_title=config['pull-request-title'])
+    ## Every stage of the run is timed into logs/<timestamp>/trace.jsonl, with the API calls it made
+    ## The trace is written out and the process pool shut down even when the rollout fails
+    trace_lib.start(log_directory, api_call_counter=client.get_thread_api_calls, chrome_trace=chrome_trace, profile=profile)
+    try:
+        ## Default branches, versions etc. of all Fivetran dbt packages are kept in .package_updater_cache/package_registry.json
+        ## Only the packages pushed to since the last run are re-read from GitHub
+        with trace_lib.span('refresh_registry'):
+            registry.refresh(client)
+        repo_names = get_repo_names(config, registry, search_index)
+        if release_index is not None:
+            with trace_lib.span('refresh_release_index'):
+                release_index.refresh(client, registry)
+        upstream_repos = dependency_graph_lib.get_upstream_repos(repo_names, registry)
+
+        ## Progress of each repo is recorded in runs/<config hash>/journal.jsonl. Re-running the same configurations resumes the rollout
+        ## The configurations of every campaign file are part of the hash
+        journal = get_run_journal(config, campaigns)
+        if restart:
+            journal.clear()
+        print ("Run journal: %s" %(journal.journal_path))
+
+        ## The open PRs of each rollout branch are looked up for all repos at once, in batched GraphQL queries
+        ## Body of PR is configured in pull_request_body.md (`pull-request-body`), campaigns stacked on a branch get the PR of its first campaign
+        pull_requests = {}
+        with trace_lib.span('lookup_pull_requests'):
+            for campaign in campaigns:
+                if campaign.branch_name not in pull_requests:
+                    pull_requests[campaign.branch_name] = pull_request_batch_lib.PullRequestBatch(client, registry.owner, campaign.config,
+                                                                                                 pr_lib.get_pull_request_body(campaign.config['pull-request-body']))
+                    pull_requests[campaign.branch_name].lookup(repo_names)
+
+        ## Runs the rollout for all repos that are currently included in `package_manager.yml`, wave by wave, `max-parallel-repos` at a time
+        pipeline = functools.partial(update_repository, client=client, config=config, creds=creds, repository_author=repository_author,
+                                     write_to_directory=write_to_directory, journal=journal, registry=registry,
+                                     upstream_repos=upstream_repos, released_versions=released_versions, pull_requests=pull_requests, campaigns=campaigns,
+                                     search_index=search_index, latest_versions=release_index.get_latest_versions() if release_index else None)
+        results = rollout_lib.run_waves(waves=dependency_graph_lib.get_waves(repo_names, upstream_repos), upstream_repos=upstream_repos,
+                                        pipeline=pipeline, max_parallel_repos=config.get('max-parallel-repos', 1), log_directory=log_directory)
+
+        ## Open the PRs of every pushed repo: a few batched GraphQL mutations per branch for the whole rollout
+        pull_urls = {}
+        with trace_lib.span('pull_request'):
+            for branch_name, batch in pull_requests.items():
+                for repo_name, pull_url in batch.submit().items():
+                    pull_urls.setdefault(repo_name, {})[branch_name] = pull_url
+        for repo_name, branch_urls in pull_urls.items():
+            journal.record(repo_name, 'pr_opened', pr_url=branch_urls.get(config['branch-name']), **({'pr_urls': branch_urls} if len(pull_requests) > 1 else {}))
+        rollout_lib.print_summary(results)
+        if len(campaigns) > 1:
+            for campaign in campaigns:
+                print ("Campaign %s (%s): committed to %s of %s repos" %(campaign.name, campaign.branch_name, len(campaign.repos), len(repo_names)))
+        client.print_api_call_summary()
+    finally:
+        process_pool_lib.shutdown()
+        trace_lib.stop()
+
+    ## Keep the mirror cache under its disk limit, never evicting the repos we just used
+    if config.get('clone-mode', 'full') == 'mirror':
+        repo_lib.evict_mirrors(max_size_mb=config.get('clone-cache-max-size-mb', 5000), keep=repo_names)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Roll out the updates configured in package_manager.yml to Fivetran dbt packages.")
+    parser.add_argument('--plan', action='store_true', help="dry run: write the diff each repo would get to plans/<timestamp>/ without committing or pushing")
+    parser.add_argument('--restart', action='store_true', help="start the rollout over instead of resuming the progress recorded for the same configurations")
+    parser.add_argument('--profile', action='store_true', help="capture cProfile output of the transformation stages in logs/<timestamp>/profiles/")
+    parser.add_argument('--chrome-trace', action='store_true', help="also write the stage timings as a Chrome trace to logs/<timestamp>/trace.chrome.json")
+    parser.add_argument('--search', metavar='TEXT', help="list the files that contain TEXT in the cached packages and exit, without cloning anything")
+    parser.add_argument('--watch', action='store_true', help="follow the CI checks of the PRs the rollout opened until they all pass or fail, without rolling anything out")
+    args = parser.parse_args()
+    try:
+        if args.search is not None:
+            search_repositories(args.search)
+        elif args.watch:
+            watch_pull_requests()
+        else:
+            main(plan=args.plan, restart=args.restart, profile=args.profile, chrome_trace=args.chrome_trace)
+    except rollout_config_lib.ConfigError as error:
+        parser.exit(1, "%s\n" %(error))
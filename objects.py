@@ -1,7 +1,7 @@
 # allows you to interact with GitHub repositories and other GitHub resources. It is a wrapper around the GitHub REST API, which means that it allows you to perform all of the same actions that you can perform using the GitHub web interface.
 import github
 
-## This file is not being used anywhere yet -- just a start
+## Package records are built and stored by package_registry_lib. Updates are the campaigns of a rollout, loaded by rollout_config_lib
 
 class Package:
     '''
@@ -14,8 +14,14 @@ class Package:
     repo: github.Repository.Repository
     default_branch = 'main'
     required_dbt_version: str
+    pushed_at: str # when the repo was last pushed to, tells the registry whether the record is stale
+    repo_data: dict # the repo metadata the Repository object is rebuilt from, without an API call
+    dependencies: list # packages listed in its packages.yml, ie ['fivetran/jira_source', 'fivetran/fivetran_utils']
 
-    def __init__(self, name, connectors, version, type, repo, default_branch, required_dbt_version):
+    ## attributes stored in the package registry (repo is rebuilt from repo_data)
+    STORED_ATTRIBUTES = ['name', 'connectors', 'version', 'type', 'default_branch', 'required_dbt_version', 'pushed_at', 'repo_data', 'dependencies']
+
+    def __init__(self, name, connectors, version, type, repo, default_branch, required_dbt_version, pushed_at=None, repo_data=None, dependencies=None):
         self.name = name
         self.connectors = connectors
         self.version = version
@@ -23,16 +29,33 @@ class Package:
         self.repo = repo
         self.default_branch = default_branch
         self.required_dbt_version = required_dbt_version
+        self.pushed_at = pushed_at
+        self.repo_data = repo_data
+        self.dependencies = dependencies or []
+
+    def to_dict(self) -> dict:
+        return {attribute: getattr(self, attribute) for attribute in self.STORED_ATTRIBUTES}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Package':
+        return cls(repo=None, **{attribute: data.get(attribute) for attribute in cls.STORED_ATTRIBUTES})
 
 
 class Update:
     '''
-    The mass-update we are applying.
+    One mass-update (campaign) of a rollout: the changes configured in package_manager.yml, or in one of the files listed in its `campaigns`.
+    Every repo is cloned once for all campaigns, and each campaign is committed on its own: campaigns with the same branch-name are stacked
+    on that branch (one PR), a campaign with a branch-name of its own gets its own branch and PR.
     '''
     name: str
-    repos: list
-    added_files = []
-    removed_files = []
-    add_to_file_rules = {}
-    find_and_replace_rules = {} 
-    status: str
\ No newline at end of file
+    config: dict # the campaign's rollout plan (see rollout_config_lib.load_campaigns())
+    branch_name: str
+    files_to_add: dict # manifest of its files-to-add, built once per run (see package_updates.get_files_to_add_manifest())
+    repos: list # repos the campaign was committed to
+
+    def __init__(self, name, config, files_to_add=None):
+        self.name = name
+        self.config = config
+        self.branch_name = config['branch-name']
+        self.files_to_add = files_to_add
+        self.repos = []
@@ -0,0 +1,216 @@
+# allows you to interact with GitHub repositories and other GitHub resources. It is a wrapper around the GitHub REST API, which means that it allows you to perform all of the same actions that you can perform using the GitHub web interface.
+import github
+
+# file contents come back base64 encoded from the contents API
+import base64
+
+# used to refresh stale packages concurrently
+import concurrent.futures
+
+# the registry is stored as JSON
+import json
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# the registry is read by all rollout worker threads
+import threading
+
+# allows you to read, write, and parse YAML files
+import yaml
+
+# local stuff
+import local_load_lib
+import github_client_lib
+import objects
+
+## Bump this when the stored format changes, older registries are then rebuilt from scratch
+REGISTRY_FORMAT_VERSION = 2
+
+## The repo metadata kept for each package, enough for PyGithub to open PRs without fetching the repo again
+REPO_DATA_KEYS = ['id', 'node_id', 'name', 'full_name', 'url', 'html_url', 'default_branch', 'pushed_at', 'archived', 'private']
+
+def get_package_type(repo_name: str) -> str:
+    '''
+    Returns 'source', 'transform' or 'utility' for a Fivetran dbt repo, based on its name.
+    '''
+    if repo_name.endswith('_source'):
+        return 'source'
+    if repo_name.endswith('_utils'):
+        return 'utility'
+    return 'transform'
+
+def get_connectors(repo_name: str, package_type: str, packages_yml: dict) -> list:
+    '''
+    Returns the connectors a package models: its own name for source packages,
+    the Fivetran source packages it depends on for transform packages (ie dbt_ad_reporting).
+
+    Args:
+    - repo_name
+    - package_type: from get_package_type()
+    - packages_yml: the repo's parsed packages.yml (None if it has none)
+    '''
+    if package_type == 'utility':
+        return []
+    if package_type == 'source':
+        return [repo_name[len('dbt_'):-len('_source')]]
+    connectors = []
+    for package in (packages_yml or {}).get('packages') or []:
+        name = str(package.get('package', '')) if isinstance(package, dict) else ''
+        if name.startswith('fivetran/') and name.endswith('_source'):
+            connectors.append(name[len('fivetran/'):-len('_source')])
+    return connectors or [repo_name[len('dbt_'):]]
+
+def get_dependencies(packages_yml: dict) -> list:
+    '''
+    Returns the hub names of the packages a repo's packages.yml installs, ie ['fivetran/jira_source', 'fivetran/fivetran_utils'].
+    '''
+    return [str(package['package']) for package in (packages_yml or {}).get('packages') or [] if isinstance(package, dict) and 'package' in package]
+
+def get_hub_name(repo_name: str, owner: str = 'fivetran') -> str:
+    '''
+    Returns the name a package is installed by in packages.yml, ie dbt_jira_source -> fivetran/jira_source.
+    '''
+    return '%s/%s' %(owner, repo_name[len('dbt_'):] if repo_name.startswith('dbt_') else repo_name)
+
+class PackageRegistry:
+    '''
+    Local index of every Fivetran dbt package, stored in `.package_updater_cache/package_registry.json` as objects.Package records
+    (name, connectors, version, type, default branch, required dbt version).
+
+    refresh() lists the organization's repos (conditional requests, so an unchanged listing costs no rate limit) and only re-reads
+    dbt_project.yml / packages.yml of repos that were pushed to since they were indexed. Everything else in a rollout
+    (default branches, Repository objects to open PRs on, package versions) is then read from the index instead of the API.
+    '''
+
+    def __init__(self, owner: str = 'fivetran', registry_file: str = None):
+        self.owner = owner
+        self.registry_file = registry_file or os.path.join(local_load_lib.get_cache_directory(), 'package_registry.json')
+        self.lock = threading.Lock()
+        self.packages = {}
+        if os.path.exists(self.registry_file):
+            with open(self.registry_file) as file:
+                stored = json.load(file)
+            if stored.get('format') == REGISTRY_FORMAT_VERSION and stored.get('owner') == owner:
+                self.packages = {name: objects.Package.from_dict(data) for name, data in stored['packages'].items()}
+
+    def save(self) -> None:
+        '''
+        Writes the registry to disk (atomically, so an interrupted run never leaves a half-written index).
+        '''
+        with self.lock:
+            stored = {'format': REGISTRY_FORMAT_VERSION, 'owner': self.owner,
+                      'packages': {name: package.to_dict() for name, package in sorted(self.packages.items())}}
+        temporary_file = self.registry_file + '.tmp'
+        with open(temporary_file, 'w') as file:
+            json.dump(stored, file, separators=(',', ':'))
+        os.replace(temporary_file, self.registry_file)
+
+    def list_repos(self, client: github_client_lib.GithubClient) -> list:
+        '''
+        Lists all dbt repos of the organization (excluding archived ones), one conditional request per page of 100.
+        '''
+        repos, page = [], 1
+        while True:
+            listing = client.get('list_repos', '/orgs/%s/repos' %(self.owner), {'per_page': 100, 'page': page, 'sort': 'full_name'})
+            repos += [repo_data for repo_data in listing if repo_data['name'].startswith('dbt_') and not repo_data.get('archived')]
+            if len(listing) < 100:
+                return repos
+            page += 1
+
+    def read_yaml_file(self, client: github_client_lib.GithubClient, repo_name: str, path: str, ref: str) -> dict:
+        '''
+        Reads and parses a YAML file of a repo through the contents API (None if the repo has no such file).
+        '''
+        try:
+            data = client.get('get_contents', '/repos/%s/%s/contents/%s' %(self.owner, repo_name, path), {'ref': ref})
+        except github.GithubException as error:
+            if error.status == 404:
+                return None
+            raise
+        return yaml.safe_load(base64.b64decode(data['content']))
+
+    def build_package(self, client: github_client_lib.GithubClient, repo_data: dict) -> objects.Package:
+        '''
+        Builds the Package record of a repo from its metadata, dbt_project.yml and packages.yml.
+        '''
+        repo_name = repo_data['name']
+        try:
+            project = self.read_yaml_file(client, repo_name, 'dbt_project.yml', repo_data['default_branch']) or {}
+            packages_yml = self.read_yaml_file(client, repo_name, 'packages.yml', repo_data['default_branch'])
+        except yaml.YAMLError as error:
+            print (u'\u2717', "Reading the dbt project of %s FAILED. Error: %s..." %(repo_name, error))
+            project, packages_yml = {}, None
+        package_type = get_package_type(repo_name)
+        required_dbt_version = project.get('require-dbt-version')
+        return objects.Package(
+            name=repo_name,
+            connectors=get_connectors(repo_name, package_type, packages_yml),
+            version=str(project['version']) if project.get('version') is not None else None,
+            type=package_type,
+            repo=None,
+            default_branch=repo_data['default_branch'],
+            required_dbt_version=[str(version) for version in required_dbt_version] if isinstance(required_dbt_version, list) else required_dbt_version,
+            pushed_at=repo_data.get('pushed_at'),
+            repo_data={key: repo_data[key] for key in REPO_DATA_KEYS if key in repo_data},
+            dependencies=get_dependencies(packages_yml),
+        )
+
+    def is_stale(self, repo_data: dict) -> bool:
+        '''
+        Checks whether a listed repo is missing from the registry or has been pushed to (or had its metadata changed) since it was indexed.
+        '''
+        package = self.packages.get(repo_data['name'])
+        if package is None or package.pushed_at != repo_data.get('pushed_at'):
+            return True
+        return package.repo_data != {key: repo_data[key] for key in REPO_DATA_KEYS if key in repo_data}
+
+    def refresh(self, client: github_client_lib.GithubClient, max_workers: int = 8) -> None:
+        '''
+        Brings the registry up to date with the organization: new repos are added, repos pushed to since they were indexed are re-read,
+        and deleted or archived repos are dropped.
+
+        Args:
+        - client: Github client (from get_github_client())
+        - max_workers: how many stale packages are re-read at the same time
+        '''
+        listed_repos = self.list_repos(client)
+        stale_repos = [repo_data for repo_data in listed_repos if self.is_stale(repo_data)]
+        if stale_repos:
+            print ("Refreshing %s of %s packages in the package registry..." %(len(stale_repos), len(listed_repos)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for package in executor.map(lambda repo_data: self.build_package(client, repo_data), stale_repos):
+                with self.lock:
+                    self.packages[package.name] = package
+        listed_names = set(repo_data['name'] for repo_data in listed_repos)
+        with self.lock:
+            self.packages = {name: package for name, package in self.packages.items() if name in listed_names}
+        self.save()
+        print (u'\u2713', "Package registry up to date: %s packages (%s refreshed)..." %(len(listed_repos), len(stale_repos)))
+
+    def get(self, repo_name: str) -> objects.Package:
+        '''
+        Returns the Package record of a repo, or None if it isn't in the registry.
+        '''
+        with self.lock:
+            return self.packages.get(repo_name)
+
+    def get_by_hub_name(self, hub_name: str) -> objects.Package:
+        '''
+        Returns the Package record of a dependency as written in packages.yml, ie 'fivetran/jira_source' -> dbt_jira_source.
+        '''
+        owner, separator, name = hub_name.partition('/')
+        if owner.lower() != self.owner.lower() or not separator:
+            return None
+        return self.get('dbt_' + name.lower())
+
+    def get_repo(self, client: github_client_lib.GithubClient, repo_name: str) -> github.Repository.Repository:
+        '''
+        Returns the repo as a PyGithub Repository rebuilt from the registry (no API call), for the calling thread's client.
+        Returns None if the repo isn't in the registry.
+        '''
+        package = self.get(repo_name)
+        if package is None or not package.repo_data:
+            return None
+        package.repo = client.pygithub.create_from_raw_data(github.Repository.Repository, package.repo_data)
+        return package.repo
@@ -4,12 +4,6 @@ import os
 # high-level interface to the operating system's file manipulation functions. It provides a number of functions for copying, moving, deleting, and renaming files and directories.
 import shutil
 
-# The pathlib module in Python provides a way to work with file paths in a more object-oriented way (requires python >= 3.4)
-import pathlib
-
-# allows you to interact with GitHub repositories and other GitHub resources. It is a wrapper around the GitHub REST API, which means that it allows you to perform all of the same actions that you can perform using the GitHub web interface.
-import github
-
 # ruamel.yaml is a YAML 1.2 loader/dumper package for Python. It is a fork of the PyYAML library
 # powerful and flexible YAML parser that can be used for a variety of tasks. It is a good choice for applications that require a high degree of control over the YAML format.
 import ruamel.yaml
@@ -17,118 +11,236 @@ import ruamel.yaml
 # regex
 import re
 
-def remove_files(file_paths: list, path_to_repository: str) -> None:
+# used to cache compiled find-and-replace patterns
+import functools
+
+# used to compute git blob hashes of the files to add
+import hashlib
+
+# used to stream large files chunk by chunk
+import itertools
+
+# local stuff
+import version_range_lib
+
+## the dbt project files whose version gets bumped
+PROJECT_FILES = ["dbt_project.yml", "integration_tests/dbt_project.yml"]
+
+## the file that lists a package's dependencies
+PACKAGES_FILE = "packages.yml"
+
+## the package README, whose dependency matrix repeats the packages.yml version ranges
+README_FILE = "README.md"
+
+def hash_blob(content: bytes) -> str:
+    '''
+    Returns the sha git gives a file with this content (same as `git hash-object`), so files can be compared with a repo's blobs without reading them.
+    '''
+    return hashlib.sha1(b'blob %d\0' %(len(content)) + content).hexdigest()
+
+def get_files_to_add_manifest(file_paths: list, files_to_add_directory: str = 'files_to_add') -> dict:
     '''
-    given a list of file paths and a git repo, remove the files from the repo.
+    Indexes the configured files-to-add once per run. Folders are expanded to every file in them, so they get merged into the repo's folder of the same name.
 
     Args:
-    - file paths to remove 
-    - cloned repo pathway 
+    - file_paths: files-to-add configured in package_manager.yml (files or folders inside `files_to_add_directory`)
+    - files_to_add_directory: default is 'files_to_add' but can be overwritten
+
+    Returns:
+    - dictionary of {path in the repo: (content bytes, whether the file is executable, git blob sha)}
     '''
-    for file in file_paths: 
-        try:
-            print ("Removing file: %s..." %(file))
-            path_to_repository_file = os.path.join(path_to_repository, file) # returns path_to_repository/file_path/../file.sql
-            if os.path.isdir(path_to_repository_file):
-                shutil.rmtree(path_to_repository_file)
-                print (u'\u2713',"Folder: %s successfully removed..."%(file))
-            else:
-                os.remove(path_to_repository_file)
-                print (u'\u2713',"File: %s successfully removed..."%(file))
-        except Exception as e:
-            print (u'\u2717', "Removing file %s FAILED. Error: %s..." %(file, e))
-
-def add_files(file_paths: list, path_to_repository: str, files_to_add_directory='files_to_add') -> None:
-    '''
-    given a list of file paths and a git repo, add the files to from the repo. 
-    The file paths should map onto file paths inside of the `files_to_add/` folder of this package.
-    doesn't return anything
+    manifest = {}
+    for file in file_paths or []:
+        file_to_add = os.path.join(files_to_add_directory, file)
+        if os.path.isdir(file_to_add):
+            source_files = [os.path.join(root, name) for root, dirs, names in os.walk(file_to_add) for name in names]
+        elif os.path.exists(file_to_add):
+            source_files = [file_to_add]
+        else:
+            print (u'\u2717', "Adding file %s. Error: %s not found..." %(file, file_to_add))
+            continue
+        for source_file in sorted(source_files):
+            with open(source_file, 'rb') as source:
+                content = source.read()
+            path = os.path.relpath(source_file, files_to_add_directory).replace(os.sep, '/')
+            manifest[path] = (content, os.access(source_file, os.X_OK), hash_blob(content))
+    return manifest
+
+def compile_find_and_replace(find_and_replace_texts: list) -> tuple:
+    '''
+    Compiles all find-and-replace rules into a single regex so that every rule can be applied in one scan of a file.
+
+    Alternatives are tried in the order the rules are listed, so when two `find` strings match at the same
+    spot the earlier rule wins. Rules are applied to the original text only: a replacement is never matched again by another rule.
 
     Args:
-    - file paths: files to add (within their directory `files_to_add_directory`)
-    - path_to_repository: cloned repo
-    - files_to_add_directory = default is 'files_to_add' but can be overwritten
+    - find_and_replace_texts: list configured in package_manager.yml
+
+    Returns:
+    - compiled pattern (None if there are no rules) and a dictionary mapping each `find` string to its `replace` string
     '''
-    for file in file_paths:
-        try:
-            print("Adding file: %s..." %(file))
-            path_to_repository_file = os.path.join(path_to_repository, file) # returns path_to_repository/file_path/../file.sql
-            file_to_add=files_to_add_directory + '/' + file # the files to add should be stored in the docs folder
-            if os.path.isdir(file_to_add):
-                shutil.copytree(file_to_add, path_to_repository_file) # FYI copytee also has an optional `ignore` list argument if so needed
-                print (u'\u2713', "%s directory successfully added..."%(file))
-            else:
-                shutil.copy(file_to_add, path_to_repository_file)
-                print (u'\u2713', "%s file successfully added..."%(file))
-        except Exception as e:
-            print (u'\u2717', "Adding file %s. Error: %s..." %(file, e))
-
-def find_and_replace(file_paths: list, find_and_replace_texts: list, path_to_repository: str) -> None:
-    '''
-    find and replaces instances of text in the files of a repo
+    replacements = {}
+    for texts in find_and_replace_texts or []:
+        find = str(texts['find'])
+        if find and find not in replacements:
+            replacements[find] = str(texts['replace'])
+    if not replacements:
+        return None, replacements
+    return compile_replacements(tuple(replacements.items())), replacements
+
+def apply_find_and_replace(content: str, pattern: re.Pattern, replacements: dict) -> tuple:
+    '''
+    Applies the compiled find-and-replace rules to a string in a single pass.
 
     Args:
-    - file_paths: the repo files to be adjusted
-    - find_and_replace_texts: list configured in package_manager.yml 
-    - path_to_repository: the path to the cloned repo
+    - content: text to update
+    - pattern, replacements: from compile_find_and_replace()
+
+    Returns:
+    - the updated text and a dictionary of hit counts per `find` string (only rules that matched are included)
     '''
-    num_files_to_update=len(file_paths)
-    num_current_file=0
-    for checked_file in file_paths:
-        num_current_file+=1
-        print ("Files find-and-replaced: " , num_current_file , "/", num_files_to_update)
-        path_to_repository_file = os.path.join(path_to_repository, checked_file)
-        repo_file = pathlib.Path(path_to_repository_file)
-        if repo_file.exists():
-            for texts in find_and_replace_texts:
-                file = open(path_to_repository_file, 'r') # open the file for reading
-                current_file_data = file.read() # load in the file content
-                file.close() # close the file
-                new_file_data = current_file_data.replace(texts['find'], texts['replace']) # replace strings
-                file = open(path_to_repository_file, 'w') # reopen the file for writing
-                file.write(new_file_data) # overwrite the file
-                file.close() # close the file
-        else:
-            print("Ignoring "+path_to_repository_file+". Not found")
+    hits = {}
+    def replace(match):
+        find = match.group(0)
+        hits[find] = hits.get(find, 0) + 1
+        return replacements[find]
+    new_content = pattern.sub(replace, content)
+    return new_content, hits
 
-def add_to_file(files_to_add_to: list, path_to_repository: str) -> None:
+## below this many files, find-and-replace stays in-process: starting the work on the process pool costs more than it saves
+PARALLEL_MIN_FILES = 200
+
+@functools.lru_cache(maxsize=16)
+def compile_replacements(replacement_items: tuple) -> re.Pattern:
+    '''
+    Compiles the pattern for a {find: replace} dictionary (as a tuple of its items), once per process.
     '''
-    Takes a list of dictionaries configured as such in the config yml file:
+    return re.compile('|'.join(re.escape(find) for find, replace in replacement_items))
+
+## files bigger than this are transformed in chunks instead of being read whole (`streaming-threshold-mb` in package_manager.yml)
+STREAMING_MIN_BYTES = 10 * 1024 * 1024
+
+## bytes read at a time when a file is streamed
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+def replace_in_chunks(chunks, replacement_items: tuple, output=None) -> dict:
+    '''
+    Applies find-and-replace rules to content that arrives in chunks (bytes), so only about one chunk is held in memory whatever the size of the file.
+    The last (longest find string - 1) bytes of each chunk are carried over to the next one: a match can start in one chunk and end in
+    the next, but it can't start in the carried bytes without needing bytes that haven't arrived yet. The matches are the same ones
+    apply_find_and_replace() finds in the whole content (UTF-8 find strings never match in the middle of a character).
 
-    files-to-add-to:
-    - file_paths: ['.buildkite/run_models.sh']
-      insert_at_top: false
-      new_line: run-operation fivetran_utils.drop_schemas --target "$db"
-    
     Args:
-    - files_to_add_to: list of dictionaries-version of the above
-    - path_to_repository: path to the cloned repo (ie 'repositories/dbt_jira')
-    '''
-    for rule in files_to_add_to:
-        insert_at_top = rule['insert_at_top']
-        new_line = rule['new_line']
-
-        for file in rule['file_paths']:
-            try:
-                print("Adding %s to file: %s..." %(new_line, file))
-                path_to_repository_file = os.path.join(path_to_repository, file)
-                repo_file = pathlib.Path(path_to_repository_file)
-                if repo_file.exists():
-                    if insert_at_top:
-                        with open(path_to_repository_file, 'r') as new_file: # read in the file
-                            content = new_file.read() # load in file
-                        with open(path_to_repository_file, 'w') as new_file: # read in the file but we'll write to it
-                            new_file.write(new_line + '\n') # start the file with the new line(s)
-                            new_file.write(content) # write the rest of the file
-                            print (u'\u2713', "%s successfully added to the top of file %s..."%(new_line, file))
-                    else: 
-                        with open(path_to_repository_file, 'a') as new_file: # open file for appending
-                            new_file.write('\n' + new_line + '\n') # write to end of file
-                            print (u'\u2713', "%s successfully added to the bottom of file %s..."%(new_line, file))
-                else:
-                    print("Ignoring "+path_to_repository_file+". Not found")
-            except Exception as e:
-                print (u'\u2717', "Adding %s file %s. Error: %s..." %(new_line, file, e))
+    - chunks: iterable of bytes
+    - replacement_items: the {find: replace} rules as a tuple of their items
+    - output: binary file the new content is written to, or None to only count the matches
+
+    Returns:
+    - dictionary of {find string: number of replacements}
+    '''
+    replacements = {find.encode(): replace.encode() for find, replace in replacement_items}
+    pattern = re.compile(b'|'.join(re.escape(find) for find in replacements)) if replacements else None
+    keep = max(len(find) for find in replacements) - 1 if replacements else 0
+    hits, carry = {}, b''
+    for chunk in itertools.chain(chunks, [b'']): # the empty chunk at the end flushes the carry
+        content = carry + chunk
+        end = len(content) - keep if chunk else len(content) # matches starting from here on may continue in the next chunk
+        position = 0
+        for match in (pattern.finditer(content) if pattern is not None else []):
+            if match.start() >= end:
+                break
+            if output is not None:
+                output.write(content[position:match.start()])
+                output.write(replacements[match.group(0)])
+            find = match.group(0).decode()
+            hits[find] = hits.get(find, 0) + 1
+            position = match.end()
+        end = max(end, position)
+        if output is not None:
+            output.write(content[position:end])
+        carry = content[end:]
+    return hits
+
+def read_chunks(path_to_file: str, chunk_size: int = STREAM_CHUNK_BYTES):
+    with open(path_to_file, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def stream_file(path_to_file: str, replacement_items: tuple = (), top_lines: list = (), bottom_lines: list = ()) -> dict:
+    '''
+    Rewrites a large file in chunks: `top_lines` and `bottom_lines` are added the way add_line_to_content() adds them, then the
+    find-and-replace rules are applied. The new content goes to a temporary file next to the original, which then replaces it in
+    one atomic rename (keeping its mode), so the file is never left half written.
+    A file that only gets find-and-replace rules is scanned first and not rewritten at all if no rule matches.
+
+    Returns:
+    - dictionary of {find string: number of replacements}
+    '''
+    if not top_lines and not bottom_lines and not replace_in_chunks(read_chunks(path_to_file), replacement_items):
+        return {}
+    def chunks():
+        for new_line in reversed(top_lines): # each line goes on top of the ones before it
+            yield (new_line + '\n').encode()
+        yield from read_chunks(path_to_file)
+        for new_line in bottom_lines:
+            yield ('\n' + new_line + '\n').encode()
+    folder, name = os.path.split(path_to_file)
+    temporary_file = os.path.join(folder, '.%s.package_updater.tmp' %(name))
+    try:
+        with open(temporary_file, 'wb') as output:
+            hits = replace_in_chunks(chunks(), replacement_items, output)
+        shutil.copymode(path_to_file, temporary_file)
+        os.replace(temporary_file, path_to_file)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+    return hits
+
+def find_and_replace_shard(file_paths: list, path_to_repository: str, replacement_items: tuple, streaming_threshold: int = STREAMING_MIN_BYTES) -> list:
+    '''
+    Applies the find-and-replace rules to a list of files and rewrites the ones that changed. Runs in a process pool worker
+    (or in-process for small repos), so it only returns what ChangeSet.apply() needs to report.
+    Files bigger than `streaming_threshold` bytes are streamed (see stream_file()) instead of being read whole.
+
+    Returns:
+    - list of (file path, {find string: number of replacements}) for every file that changed, (file path, None) for files that don't exist
+      and (file path, error message) for files that aren't UTF-8 text
+    '''
+    pattern, replacements = compile_replacements(replacement_items), dict(replacement_items)
+    results = []
+    for checked_file in file_paths:
+        path_to_repository_file = os.path.join(path_to_repository, checked_file)
+        if not os.path.exists(path_to_repository_file):
+            results.append((checked_file, None))
+            continue
+        if os.path.getsize(path_to_repository_file) > streaming_threshold:
+            hits = stream_file(path_to_repository_file, replacement_items)
+            if hits:
+                results.append((checked_file, hits))
+            continue
+        try:
+            with open(path_to_repository_file, 'r', encoding='utf-8', newline='') as file:
+                current_file_data = file.read() # load in the file content (line endings as they are)
+        except UnicodeDecodeError as error: # one binary or mis-encoded file doesn't stop the others
+            results.append((checked_file, str(error)))
+            continue
+        new_file_data, hits = apply_find_and_replace(current_file_data, pattern, replacements)
+        if new_file_data != current_file_data: # only rewrite files that actually changed
+            with open(path_to_repository_file, 'w', encoding='utf-8', newline='') as file:
+                file.write(new_file_data)
+            results.append((checked_file, hits))
+    return results
+
+def add_line_to_content(content: str, new_line: str, insert_at_top: bool) -> str:
+    '''
+    Returns the file content with `new_line` added at the top or the bottom, as configured in `files-to-add-to`.
+    '''
+    if insert_at_top:
+        return new_line + '\n' + content # start the file with the new line(s), then the rest of the file
+    return content + '\n' + new_line + '\n' # write to end of file
 
 def uptick_project_version(current_version: str, bump_type: str) -> str:
     '''
@@ -154,94 +266,237 @@ def uptick_project_version(current_version: str, bump_type: str) -> str:
     new_version = ".".join(current_version_split)
     return new_version
 
-def update_project(repo: github.Repository.Repository, path_to_repository: str, config: str) -> None:
+def get_yaml_value_span(content_lines: list, mapping: ruamel.yaml.comments.CommentedMap, key: str) -> tuple:
     '''
-    WIP: currently does not work consistently enough. Did not work in last rollout for 1/2 of packages
+    Finds where the value of a top-level key sits in the original text of a round-trip loaded YAML file,
+    so it can be edited in place without re-dumping (and reformatting) the whole file.
 
-    Intention is to update all `dbt_project.yml` (root project and /integration_tests) for a major.minor.patch version bump
+    Args:
+    - content_lines: the file content split into lines (keeping line endings)
+    - mapping: the file loaded with the RoundTripLoader
+    - key: top-level key whose value we want
 
-    Future ideas:
-    - Creates changelog entry (can leveage add_to_file())
+    Returns:
+    - (start line, start column, end line, end column) of the value's text, end column exclusive
     '''
-    files = ["dbt_project.yml","integration_tests/dbt_project.yml"]
-    file_paths = []
-    for f in files:
-        file_paths.insert(0, os.path.join(path_to_repository, f))
-        project_content = repo.get_contents(f)
-        project = ruamel.yaml.load(
-            project_content.decoded_content, # decoded_content is in bytes? perhaps stream should = contents
-            Loader=ruamel.yaml.RoundTripLoader, # RoundTripLoader in ruamel.yaml is a loader that preserves the structure of the YAML document when loading it into a Python object. This means that the order of the keys in a dictionary, the order of the items in a list, and the nesting of objects will be preserved when the YAML document is loaded.
-            preserve_quotes=True
-        )
+    value = mapping[key]
+    line, column = mapping.lc.value(key)
+    if isinstance(value, ruamel.yaml.comments.CommentedSeq) and not value.fa.flow_style():
+        # block sequence: the span covers every `- item` line, starting at the first dash
+        last_line, last_column = value.lc.item(len(value) - 1) if len(value) else (line, column)
+        return line, column, last_line, get_yaml_scalar_end(content_lines[last_line], last_column)
 
-        try:
-            old_version = project["version"]
-            new_version = uptick_project_version(current_version = old_version, bump_type = config["version-bump-type"])
+    if isinstance(value, ruamel.yaml.comments.CommentedSeq):
+        # flow sequence: scan forward to the matching closing bracket (it may wrap over several lines)
+        depth, scan_line, scan_column = 0, line, column
+        while True:
+            character = content_lines[scan_line][scan_column]
+            if character in '[{':
+                depth += 1
+            elif character in ']}':
+                depth -= 1
+                if depth == 0:
+                    return line, column, scan_line, scan_column + 1
+            scan_column += 1
+            if scan_column >= len(content_lines[scan_line]):
+                scan_line, scan_column = scan_line + 1, 0
 
-            path_to_repository_file = os.path.join(path_to_repository, f)
+    return line, column, line, get_yaml_scalar_end(content_lines[line], column)
 
-            # read in the file    
-            with open(path_to_repository_file, 'r') as file:
-                file_contents = file.read()
+def get_yaml_scalar_end(line: str, column: int) -> int:
+    '''
+    Returns the column right after a single-line scalar that starts at `column`, ignoring any trailing comment.
+    '''
+    text = line.rstrip('\r\n')
+    if text[column] in '\'"':
+        # quoted scalar: ends at the closing quote
+        return text.index(text[column], column + 1) + 1
+    # plain scalar: ends before any trailing comment
+    end_column = text.find(' #', column)
+    end_column = len(text) if end_column == -1 else end_column
+    return len(text[:end_column].rstrip())
 
-            # use re module to replace package version  
-            new_contents = re.sub(old_version, new_version, file_contents)
-            
-            # use re to replace -- this currently isn't working
-            # if f == "dbt_project.yml" and config["require-dbt-version"] is not None:
-            #     print(type(project["require-dbt-version"]))
-            #     print(type(config["require-dbt-version"]))
-            #     old_dbt_version = project["require-dbt-version"]
-            #     new_dbt_version = config["require-dbt-version"]
-            #     new_contents = re.sub(old_dbt_version, new_dbt_version, file_contents)
+def replace_yaml_span(content_lines: list, span: tuple, new_text: str) -> list:
+    '''
+    Replaces the text inside a span from get_yaml_value_span() and returns the new list of lines.
+    '''
+    start_line, start_column, end_line, end_column = span
+    new_content = content_lines[start_line][:start_column] + new_text + content_lines[end_line][end_column:]
+    return content_lines[:start_line] + new_content.splitlines(keepends=True) + content_lines[end_line + 1:]
 
-            with open(path_to_repository_file, 'w') as file:
-                file.write(new_contents)
+def format_dbt_version_range(version_range, block_indent: int = None) -> str:
+    '''
+    Formats a dbt version range from package_manager.yml (ie [">=1.4.0", "<2.0.0"] or ">=1.4.0") the way dbt project files write it.
 
-        except github.GithubException as error:
-            print("dbt project.yml files not found. Error: %s" %(error))
+    Args:
+    - version_range: list or string of version constraints
+    - block_indent: column of the dashes if the range should be written as a block sequence rather than a flow sequence
+    '''
+    if isinstance(version_range, str):
+        return '"%s"' %(version_range)
+    if block_indent is not None:
+        return ('\n' + ' ' * block_indent).join('- "%s"' %(version) for version in version_range)
+    return '[' + ', '.join('"%s"' %(version) for version in version_range) + ']'
 
-def update_packages(repo: github.Repository.Repository, branch_name: str, config: dict, source_bump_type: str) -> None:
+def bump_project_file(file_contents: str, config: dict, is_root_project: bool, bump_version: bool = True) -> tuple:
     '''
-    WIP: Currently, this function does not perform as easily as desired. Will need to be updated. 
-    The intention is to update root packages.yml files such that a new version bump is incorporated for relevant packages without having to specify specific package versions for all packages.
+    Bumps the version of a `dbt_project.yml` file's content, and sets its `require-dbt-version` if this is the root project
+    and `require-dbt-version` is configured in package_manager.yml.
+
+    The content is loaded once with the round-trip loader to find the `version:` and `require-dbt-version:` nodes.
+    Only the text of those nodes is rewritten, so comments, quoting and any other version-looking text in the file are left alone.
 
-    Future ideas:
-    - add source package (or any package) bumping
-    - update README dependency matrix as well 
+    Args:
+    - file_contents: content of the dbt_project.yml file
+    - config: configurations loaded from package_manager.yml
+    - is_root_project: False for integration_tests/dbt_project.yml
+    - bump_version: False to only set require-dbt-version, ie for a campaign stacked on a branch whose version is already bumped
+
+    Returns:
+    - the new file content, the old and new project versions, and whether require-dbt-version was set
     '''
-    try:
-        packages_content = repo.get_contents("packages.yml")
-        packages = ruamel.yaml.load(
-            packages_content.decoded_content,
-            Loader=ruamel.yaml.RoundTripLoader,
-            preserve_quotes=True,
-        )
-        
-        for package in packages["packages"]:
-            if "package" in package and package["package"] == 'fivetran/fivetran_utils':
-                package["version"] = config['fivetran-utils-version'] # as set in the package_manager.yml
-            if "package" in package and "fivetran" in package["package"] and source_bump_type != 'patch' and package["package"] != 'fivetran/fivetran_utils': # switch back to source
-                old_vesion_range = package["version"]
-                min_version = ''
-                max_version = ''
-                for char in old_vesion_range:
-                    if char.isnumeric() or char == '.':
-                        if min_version.count('.') < 2:
-                            min_version = min_version + char
-                        else:
-                            max_version = max_version + char
-                new_min_version = uptick_project_version(min_version, source_bump_type)
-                new_max_version = uptick_project_version(max_version, source_bump_type)
-                new_version_range = '[' + '">=' + new_min_version + '"' + ', "' + new_max_version + '"]'
-                package['version'] = new_version_range
-
-        repo.update_file(
-            path=packages_content.path,
-            message="Updating package dependencies",
-            content=ruamel.yaml.dump(packages, Dumper=ruamel.yaml.RoundTripDumper),
-            sha=packages_content.sha,
-            branch=branch_name,
-        )
-    except github.GithubException:
-        print("'packages.yml' not found in repo.")
\ No newline at end of file
+    project = ruamel.yaml.load(
+        file_contents,
+        Loader=ruamel.yaml.RoundTripLoader, # RoundTripLoader in ruamel.yaml is a loader that preserves the structure of the YAML document when loading it into a Python object. This means that the order of the keys in a dictionary, the order of the items in a list, and the nesting of objects will be preserved when the YAML document is loaded.
+        preserve_quotes=True
+    )
+    content_lines = file_contents.splitlines(keepends=True)
+
+    # find the dbt version span before we change the line layout with the version bump
+    dbt_version_span = None
+    if is_root_project and config.get("require-dbt-version") and "require-dbt-version" in project:
+        dbt_version_span = get_yaml_value_span(content_lines, project, "require-dbt-version")
+
+    # edit from the bottom of the file up so earlier spans stay valid
+    edits = []
+    old_version = str(project["version"])
+    new_version = old_version
+    if bump_version:
+        new_version = uptick_project_version(current_version = old_version, bump_type = config["version-bump-type"])
+        version_span = get_yaml_value_span(content_lines, project, "version")
+        start_line, start_column, end_line, end_column = version_span
+        edits.append((version_span, content_lines[start_line][start_column:end_column].replace(old_version, new_version)))
+
+    if dbt_version_span is not None:
+        block_indent = None
+        dbt_version = project["require-dbt-version"]
+        if isinstance(dbt_version, ruamel.yaml.comments.CommentedSeq) and not dbt_version.fa.flow_style():
+            block_indent = dbt_version_span[1]
+        edits.append((dbt_version_span, format_dbt_version_range(config["require-dbt-version"], block_indent)))
+
+    for span, new_text in sorted(edits, reverse=True):
+        content_lines = replace_yaml_span(content_lines, span, new_text)
+    return ''.join(content_lines), old_version, new_version, dbt_version_span is not None
+
+def get_dependency_version_range(version: str) -> list:
+    '''
+    Returns the packages.yml version range that accepts a package version and its later patches, ie 0.9.2 -> [">=0.9.0", "<0.10.0"]
+    (pre-1.0 minors can be breaking) and 1.2.0 -> [">=1.0.0", "<2.0.0"].
+    '''
+    major, minor = [int(part) for part in version.split('.')[:2]]
+    if major == 0:
+        return [">=0.%s.0" %(minor), "<0.%s.0" %(minor + 1)]
+    return [">=%s.0.0" %(major), "<%s.0.0" %(major + 1)]
+
+def get_new_version_range(package: str, current_version, dependency_versions: dict, latest_versions: dict = None):
+    '''
+    Works out the version range a dependency should have.
+
+    Args:
+    - package: hub name of the dependency, ie 'fivetran/jira_source'
+    - current_version: its current version range
+    - dependency_versions: {package hub name: version range} that are set as they are (upstream packages bumped in the rollout, fivetran-utils-version)
+    - latest_versions: {package hub name: latest release} (from release_index_lib.ReleaseIndex.get_latest_versions()). A range that
+      doesn't allow the latest release is moved to the range of that release, ranges that already allow it are left alone
+
+    Returns:
+    - the new version range, or None to keep the current one
+    '''
+    if package in dependency_versions:
+        return dependency_versions[package]
+    if not latest_versions or package not in latest_versions:
+        return None
+    latest_version = version_range_lib.parse_version(latest_versions[package])
+    constraints = version_range_lib.parse_version_range(current_version)
+    if version_range_lib.is_satisfied(latest_version, constraints):
+        return None
+    if any(operator in ('>=', '>', '=') and bound > latest_version for operator, bound in constraints):
+        return None # already ahead of the latest release, never downgrade
+    return get_dependency_version_range(latest_versions[package])
+
+def set_package_versions(file_contents: str, dependency_versions: dict, latest_versions: dict = None) -> tuple:
+    '''
+    Sets the version range of packages in the content of a packages.yml file. Only the text of the `version:` nodes is rewritten,
+    so comments, quoting and the other packages are left alone.
+
+    Args:
+    - file_contents: content of the packages.yml file
+    - dependency_versions: {package hub name: version range}, ie {'fivetran/jira_source': [">=0.7.0", "<0.8.0"]}
+    - latest_versions: {package hub name: latest release}, see get_new_version_range()
+
+    Returns:
+    - the new file content and the list of (package, version range) that changed
+    '''
+    packages = ruamel.yaml.load(file_contents, Loader=ruamel.yaml.RoundTripLoader, preserve_quotes=True)
+    content_lines = file_contents.splitlines(keepends=True)
+    edits, updated_packages = [], []
+    for package in (packages or {}).get('packages') or []:
+        if not isinstance(package, dict) or 'package' not in package or 'version' not in package:
+            continue
+        current_version = package['version']
+        current_range = [str(version) for version in current_version] if isinstance(current_version, list) else str(current_version)
+        try:
+            version_range = get_new_version_range(str(package['package']), current_range, dependency_versions, latest_versions)
+        except ValueError:
+            continue # not a version range we can read, ie a jinja expression: left as it is
+        if version_range is None or current_range == version_range:
+            continue
+        span = get_yaml_value_span(content_lines, package, 'version')
+        block_indent = None
+        if isinstance(current_version, ruamel.yaml.comments.CommentedSeq) and not current_version.fa.flow_style():
+            block_indent = span[1]
+        edits.append((span, format_dbt_version_range(version_range, block_indent)))
+        updated_packages.append((str(package['package']), version_range))
+
+    # edit from the bottom of the file up so earlier spans stay valid
+    for span, new_text in sorted(edits, reverse=True):
+        content_lines = replace_yaml_span(content_lines, span, new_text)
+    return ''.join(content_lines), updated_packages
+
+## a `- package: fivetran/jira_source` line of a README dependency matrix, and the `version: ...` line that follows it
+README_PACKAGE_PATTERN = re.compile(r'^(\s*-?\s*package:\s*)["\']?([\w./-]+)["\']?\s*$')
+README_VERSION_PATTERN = re.compile(r'^(\s*version:\s*)(\S.*?)\s*$')
+
+def set_readme_package_versions(file_contents: str, dependency_versions: dict, latest_versions: dict = None) -> tuple:
+    '''
+    Sets the version ranges of the dependency matrix in a package README, the yml snippets that show which packages it installs
+    (ie `- package: fivetran/fivetran_utils` followed by `version: [">=0.4.0", "<0.5.0"]`), the same way set_package_versions() sets them in packages.yml.
+    Only single-line versions are rewritten, everything else in the README is left alone.
+
+    Returns:
+    - the new file content and the list of (package, version range) that changed
+    '''
+    content_lines = file_contents.splitlines(keepends=True)
+    updated_packages, package = [], None
+    for number, line in enumerate(content_lines):
+        package_match = README_PACKAGE_PATTERN.match(line)
+        if package_match:
+            package = package_match.group(2)
+            continue
+        version_match = README_VERSION_PATTERN.match(line)
+        if package is None or version_match is None:
+            if not line.strip() or line.lstrip().startswith(('-', '`')):
+                package = None # the version belongs to the package line right above it
+            continue
+        try:
+            current_version = ruamel.yaml.load(version_match.group(2), Loader=ruamel.yaml.RoundTripLoader)
+            current_range = [str(version) for version in current_version] if isinstance(current_version, list) else str(current_version)
+            version_range = get_new_version_range(package, current_range, dependency_versions, latest_versions)
+        except (ValueError, ruamel.yaml.YAMLError):
+            version_range = None # not a version range we can read, ie a jinja expression
+        if version_range is not None and current_range != version_range:
+            newline = line[len(line.rstrip('\r\n')):]
+            content_lines[number] = version_match.group(1) + format_dbt_version_range(version_range) + newline
+            updated_packages.append((package, version_range))
+        package = None
+    return ''.join(content_lines), updated_packages
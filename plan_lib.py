@@ -0,0 +1,60 @@
+#  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
+import git
+
+# used to write the machine-readable plan summary
+import json
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+def write_repository_plan(cloned_repository: git.Repo, repo_name: str, plan_directory: str, rules_matched: dict) -> dict:
+    '''
+    Writes the unified diff of everything the package updates changed in a (never committed) clone to `plan_directory/repo_name.diff`
+    and works out the change statistics of the repo.
+
+    Args:
+    - cloned_repository: the clone the package updates were applied to
+    - repo_name
+    - plan_directory: folder the plan of this run is written to
+    - rules_matched: dictionary of {rule: number of matches} from the package updates
+
+    Returns:
+    - dictionary of change statistics: files touched, lines added, lines removed, rules matched
+    '''
+    # stage everything (including new and removed files) so the diff covers them too. Nothing is ever committed
+    cloned_repository.git.add(all=True)
+    diff = cloned_repository.git.diff('--cached', '--no-color', '--no-ext-diff')
+    numstat = cloned_repository.git.diff('--cached', '--numstat')
+
+    files_touched, lines_added, lines_removed = 0, 0, 0
+    for line in numstat.splitlines():
+        added, removed, path = line.split('\t', 2)
+        files_touched += 1
+        if added != '-': # binary files have no line counts
+            lines_added += int(added)
+            lines_removed += int(removed)
+
+    with open(os.path.join(plan_directory, repo_name + '.diff'), 'w') as file:
+        file.write(diff + '\n' if diff else '')
+
+    stats = {
+        'files touched': files_touched,
+        'lines added': lines_added,
+        'lines removed': lines_removed,
+        'rules matched': rules_matched,
+    }
+    print (u'\u2713', "Planned %s: %s files touched, +%s/-%s lines..." %(repo_name, files_touched, lines_added, lines_removed))
+    return stats
+
+def write_plan_summary(results: list, plan_directory: str) -> None:
+    '''
+    Writes the change statistics of every repo in the plan to `plan_directory/summary.json`.
+
+    Args:
+    - results: list of RolloutResult objects from rollout_lib.run_rollout()
+    - plan_directory: folder the plan of this run is written to
+    '''
+    summary = {result.repo_name: dict(result.stats, status=result.status, error=result.error) for result in results}
+    with open(os.path.join(plan_directory, 'summary.json'), 'w') as file:
+        json.dump(summary, file, indent=2, sort_keys=True)
+    print ("\nPlan written to %s/" %(plan_directory))
@@ -0,0 +1,161 @@
+# used to wait between polls
+import time
+
+# local stuff
+import github_client_lib
+import pull_request_batch_lib
+
+## How each statusCheckRollup state of a PR's head commit is reported. A commit without checks has no rollup
+RESULTS = {'SUCCESS': 'pass', 'FAILURE': 'fail', 'ERROR': 'fail', 'PENDING': 'pending', 'EXPECTED': 'pending', None: 'no checks'}
+
+## A PR whose commit still has no checks after this many polls (CI may not have picked it up yet) stops being watched
+NO_CHECKS_MAX_POLLS = 5
+
+## Checks listed per PR, plenty for the Buildkite pipelines and GitHub Actions of a dbt package
+CHECKS_PER_PULL_REQUEST = 50
+
+def get_pull_number(pull_url: str) -> int:
+    '''
+    Returns the number of a PR from its url, ie https://github.com/fivetran/dbt_jira/pull/12 -> 12.
+    '''
+    return int(pull_url.rstrip('/').rsplit('/', 1)[-1])
+
+def get_failed_checks(contexts: list) -> list:
+    '''
+    Returns (name, details url) of the failed check runs and commit statuses of a rollup.
+    '''
+    failed = []
+    for context in contexts:
+        if context.get('__typename') == 'CheckRun' and context.get('conclusion') in ('FAILURE', 'TIMED_OUT', 'CANCELLED', 'STARTUP_FAILURE', 'ACTION_REQUIRED'):
+            failed.append((context['name'], context.get('detailsUrl')))
+        elif context.get('__typename') == 'StatusContext' and context.get('state') in ('FAILURE', 'ERROR'):
+            failed.append((context['context'], context.get('targetUrl')))
+    return failed
+
+class PullRequestWatch:
+    '''
+    Follows the CI checks of the PRs of a rollout until every one of them has passed, failed, been merged or closed.
+
+    Each poll asks for the state of the head commit's checks (check runs and commit statuses, as GitHub's statusCheckRollup)
+    of all unfinished PRs at once, BATCH_SIZE PRs per GraphQL query, so a poll costs the same handful of requests for 5 PRs or 80.
+    Finished PRs are never asked about again. The wait between polls doubles (up to `max_interval`) every time a poll finds nothing new,
+    and drops back to `interval` as soon as a check finishes.
+    '''
+
+    def __init__(self, client: github_client_lib.GithubClient, owner: str, pull_urls: dict, interval: int = 30, max_interval: int = 600):
+        self.client = client
+        self.owner = owner
+        self.interval = interval
+        self.max_interval = max_interval
+        self.polls = 0
+        self.pulls = {} # (repo name, number) -> {'url': ..., 'result': ..., 'sha': ..., 'failed': [(check, url)], 'no_checks_polls': n}
+        for repo_name, urls in sorted(pull_urls.items()):
+            for pull_url in urls:
+                self.pulls[(repo_name, get_pull_number(pull_url))] = {'url': pull_url, 'result': 'pending', 'sha': None, 'failed': [], 'no_checks_polls': 0}
+
+    def is_finished(self, pull: dict) -> bool:
+        return pull['result'] not in ('pending', 'no checks') or pull['no_checks_polls'] >= NO_CHECKS_MAX_POLLS
+
+    def get_unfinished(self) -> list:
+        return [key for key, pull in self.pulls.items() if not self.is_finished(pull)]
+
+    def poll(self) -> list:
+        '''
+        Reads the check results of every unfinished PR, BATCH_SIZE PRs per GraphQL query.
+
+        Returns:
+        - list of (repo name, number) of the PRs whose result changed
+        '''
+        self.polls += 1
+        changed = []
+        for chunk in pull_request_batch_lib.get_chunks(self.get_unfinished()):
+            repo_names = list(dict.fromkeys(repo_name for repo_name, number in chunk))
+            variables = {'owner': self.owner}
+            variables.update({'name%s' %(index): repo_name for index, repo_name in enumerate(repo_names)})
+            declarations = ", ".join("$%s: String!" %(name) for name in variables)
+            selections = []
+            for index, repo_name in enumerate(repo_names):
+                pull_fields = " ".join("p%s: pullRequest(number: %s) { state commits(last: 1) { nodes { commit { oid statusCheckRollup { state "
+                                       "contexts(first: %s) { nodes { __typename ... on CheckRun { name status conclusion detailsUrl } "
+                                       "... on StatusContext { context state targetUrl } } } } } } } }" %(number, number, CHECKS_PER_PULL_REQUEST)
+                                       for name, number in chunk if name == repo_name)
+                selections.append("  r%s: repository(owner: $owner, name: $name%s) { %s }" %(index, index, pull_fields))
+            data, errors = self.client.graphql('graphql PR checks', "query(%s) {\n%s\n}" %(declarations, "\n".join(selections)), variables)
+
+            for repo_name, number in chunk:
+                repository = data.get('r%s' %(repo_names.index(repo_name))) or {}
+                pull = self.pulls[(repo_name, number)]
+                node = repository.get('p%s' %(number))
+                if node is None:
+                    result, sha, failed = 'not found', None, []
+                elif node['state'] != 'OPEN':
+                    result, sha, failed = node['state'].lower(), None, []
+                else:
+                    commits = node['commits']['nodes']
+                    commit = commits[0]['commit'] if commits else {}
+                    rollup = commit.get('statusCheckRollup')
+                    result = RESULTS.get(rollup['state'] if rollup else None, 'pending')
+                    sha = commit.get('oid')
+                    failed = get_failed_checks(rollup['contexts']['nodes']) if rollup else []
+                if result == 'no checks':
+                    pull['no_checks_polls'] += 1
+                if (result, sha, failed) != (pull['result'], pull['sha'], pull['failed']):
+                    # a new push to the branch restarts the checks of the PR
+                    pull.update({'result': result, 'sha': sha, 'failed': failed})
+                    changed.append((repo_name, number))
+        return changed
+
+    def print_changes(self, changed: list) -> None:
+        for repo_name, number in changed:
+            pull = self.pulls[(repo_name, number)]
+            if pull['result'] == 'pass':
+                print (u'\u2713', "%s #%s: checks passed" %(repo_name, number))
+            elif pull['result'] == 'fail':
+                print (u'\u2717', "%s #%s: checks FAILED (%s) %s" %(repo_name, number, ", ".join(check for check, url in pull['failed']) or 'failed',
+                                                                   pull['url']))
+            else:
+                print ("%s #%s: %s" %(repo_name, number, pull['result']))
+
+    def get_counts(self) -> dict:
+        '''
+        Returns the number of PRs per result, ie {'pass': 40, 'fail': 2, 'pending': 38}.
+        '''
+        counts = {}
+        for pull in self.pulls.values():
+            counts[pull['result']] = counts.get(pull['result'], 0) + 1
+        return counts
+
+    def watch(self, sleep=time.sleep) -> dict:
+        '''
+        Polls until every PR is finished, printing each PR whose result changes and a running count after every poll.
+
+        Args:
+        - sleep: called with the number of seconds to wait between polls
+
+        Returns:
+        - the number of PRs per result (see get_counts())
+        '''
+        interval = self.interval
+        while True:
+            changed = self.poll()
+            self.print_changes(changed)
+            counts = self.get_counts()
+            unfinished = len(self.get_unfinished())
+            tally = ", ".join("%s %s" %(count, result) for result, count in sorted(counts.items()))
+            if not unfinished:
+                print (u'\u2713', "All %s PRs finished after %s polls: %s" %(len(self.pulls), self.polls, tally))
+                return counts
+            interval = self.interval if changed else min(interval * 2, self.max_interval)
+            print ("Checks: %s (%s PRs still running, next poll in %ss)..." %(tally, unfinished, interval))
+            sleep(interval)
+
+    def print_summary(self) -> None:
+        '''
+        Prints a table with the check result of every PR, with the failed checks and where to find them.
+        '''
+        name_width = max([len('Repository')] + [len(repo_name) for repo_name, number in self.pulls])
+        print ("\n%s | %-9s | %s" %('Repository'.ljust(name_width), 'Checks', 'Details'))
+        print ("%s-+-%s-+-%s" %('-' * name_width, '-' * 9, '-' * 20))
+        for (repo_name, number), pull in sorted(self.pulls.items()):
+            details = "; ".join("%s: %s" %(check, url) for check, url in pull['failed']) if pull['failed'] else pull['url']
+            print ("%s | %-9s | %s" %(repo_name.ljust(name_width), pull['result'], details))
@@ -0,0 +1,78 @@
+# provides a high-level interface for running callables on a pool of worker processes. Content transformations are CPU-bound regex work, which threads can't spread over several cores
+import concurrent.futures
+
+# workers are started by a fork server (or spawned where there is none) rather than forked, since the pool is started from inside the rollout's worker threads
+import multiprocessing
+
+# the pool is shared by all rollout worker threads, so creating it is guarded by a lock
+import threading
+
+## The process pool shared by every repo of the run, created the first time a repo has enough files to use it
+pool = None
+pool_workers = 0
+pool_lock = threading.Lock()
+
+## Modules the fork server imports up front: everything the workers' functions need
+PRELOAD_MODULES = ['package_updates', 'commit_builder_lib']
+
+## Each worker gets this many shards, so a shard of slow files doesn't leave the other workers idle
+SHARDS_PER_WORKER = 4
+
+def get_pool(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    '''
+    Returns the shared process pool, starting it (or restarting it with a new size) if needed.
+
+    Args:
+    - workers: number of worker processes (`transform-workers` in package_manager.yml)
+    '''
+    global pool, pool_workers
+    with pool_lock:
+        if pool is None or pool_workers != workers:
+            if pool is not None:
+                pool.shutdown()
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=get_context())
+            pool_workers = workers
+        return pool
+
+def get_context() -> multiprocessing.context.BaseContext:
+    '''
+    Returns the multiprocessing context the pool is started with. The fork server imports the transformation modules once,
+    so every worker forked from it starts with them already loaded instead of importing the whole tool again.
+    '''
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(PRELOAD_MODULES)
+    return context
+
+def map_shards(function, items: list, workers: int, *args) -> list:
+    '''
+    Splits `items` into contiguous shards, runs `function(shard, *args)` for each shard on the process pool,
+    and concatenates the lists the shards return in the order of `items`, so the result doesn't depend on which worker finished first.
+
+    Args:
+    - function: module-level function (it is pickled to the workers) taking a list of items and returning a list of results
+    - items: ie file paths
+    - workers: number of worker processes
+    - args: passed on to every call of `function`, must be picklable
+    '''
+    if not items:
+        return []
+    num_shards = min(len(items), workers * SHARDS_PER_WORKER)
+    shard_size = -(-len(items) // num_shards) # round up
+    shards = [items[start:start + shard_size] for start in range(0, len(items), shard_size)]
+    futures = [get_pool(workers).submit(function, shard, *args) for shard in shards]
+    results = []
+    for future in futures:
+        results += future.result()
+    return results
+
+def shutdown() -> None:
+    '''
+    Stops the worker processes at the end of the run.
+    '''
+    global pool, pool_workers
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown()
+            pool, pool_workers = None, 0
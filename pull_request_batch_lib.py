@@ -0,0 +1,254 @@
+# the PR body carries a hash of itself, so a body edited on GitHub can be told apart from one the rollout wrote
+import hashlib
+import re
+
+# the batch is filled by all rollout worker threads
+import threading
+
+# local stuff
+import github_client_lib
+
+## Repos per GraphQL document, keeps every request well under GitHub's node and complexity limits
+BATCH_SIZE = 50
+
+## GraphQL input type of each batched mutation
+MUTATION_INPUT_TYPES = {
+    'createPullRequest': 'CreatePullRequestInput',
+    'updatePullRequest': 'UpdatePullRequestInput',
+    'addLabelsToLabelable': 'AddLabelsToLabelableInput',
+    'addAssigneesToAssignable': 'AddAssigneesToAssignableInput',
+    'requestReviews': 'RequestReviewsInput',
+}
+
+## Hidden comment at the end of every PR body the rollout writes, with the hash of the body above it
+BODY_MARKER = '<!-- package-updater body %s -->'
+BODY_MARKER_PATTERN = re.compile(r'\s*<!-- package-updater body ([0-9a-f]+) -->\s*$')
+
+def get_body_hash(body: str) -> str:
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()[:12]
+
+def sign_body(body: str) -> str:
+    '''
+    Returns the PR body as the rollout writes it: with normalized line endings, followed by BODY_MARKER.
+    '''
+    body = body.replace('\r\n', '\n').rstrip()
+    return "%s\n\n%s" %(body, BODY_MARKER %(get_body_hash(body)))
+
+def read_body(body: str) -> tuple:
+    '''
+    Splits the body of an open PR into its text and the hash of its BODY_MARKER.
+
+    Returns:
+    - the body without the marker (with normalized line endings, bodies edited on GitHub come back with CRLF), and the hash of the marker or None
+    '''
+    body = (body or '').replace('\r\n', '\n')
+    match = BODY_MARKER_PATTERN.search(body)
+    if match is None:
+        return body.rstrip(), None
+    return body[:match.start()].rstrip(), match.group(1)
+
+def get_chunks(items: list, size: int = BATCH_SIZE) -> list:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def build_mutation(mutations: list) -> tuple:
+    '''
+    Builds one GraphQL document running several mutations, each under its own alias.
+
+    Args:
+    - mutations: list of (alias, mutation name, input, fields to return)
+
+    Returns:
+    - the document and its variables
+    '''
+    variables = {alias: mutation_input for alias, name, mutation_input, fields in mutations}
+    declarations = ", ".join("$%s: %s!" %(alias, MUTATION_INPUT_TYPES[name]) for alias, name, mutation_input, fields in mutations)
+    selections = "\n".join("  %s: %s(input: $%s) { %s }" %(alias, name, alias, fields) for alias, name, mutation_input, fields in mutations)
+    return "mutation(%s) {\n%s\n}" %(declarations, selections), variables
+
+def get_error_messages(errors: list) -> dict:
+    '''
+    Returns {alias: error message} for the failed fields of a batched GraphQL response.
+    '''
+    messages = {}
+    for error in errors:
+        alias = (error.get('path') or [None])[0]
+        messages[alias] = error.get('message')
+    return messages
+
+class PullRequestBatch:
+    '''
+    Opens the pull requests of a rollout through the GraphQL API, a batch of repos per request.
+
+    lookup() runs before any work starts: it finds the open PR of the rollout branch in every target repo, along with the ids of
+    the configured labels, assignees and reviewers. Each repo adds itself with add() once its branch is pushed, and submit() then
+    creates the missing PRs, updates the title and body of open PRs that differ, and skips the rest.
+
+    The body of an open PR is only rewritten if it is still the body the rollout wrote (its BODY_MARKER hash matches),
+    so the edits maintainers make to a PR on GitHub survive re-runs. Only the title of those PRs is kept up to date.
+    '''
+
+    def __init__(self, client: github_client_lib.GithubClient, owner: str, config: dict, body: str):
+        self.client = client
+        self.owner = owner
+        self.branch_name = config['branch-name']
+        self.title = config['pull-request-title']
+        self.body = sign_body(body)
+        self.draft = bool(config.get('pull-request-draft', False))
+        self.labels = list(config.get('pull-request-labels') or [])
+        self.assignees = list(config.get('pull-request-assignees') or [])
+        self.reviewers = list(config.get('pull-request-reviewers') or [])
+        self.lock = threading.Lock()
+        self.repositories = {} # repo name -> {'id': node id, 'pull': open PR or None, 'label_ids': [...]}
+        self.user_ids = {} # login -> node id
+        self.pending = {} # repo name -> default branch
+
+    def lookup(self, repo_names: list) -> None:
+        '''
+        Looks up the open PRs of the rollout branch (and the label and user ids) for all repos, BATCH_SIZE repos per query.
+        '''
+        logins = list(dict.fromkeys(self.assignees + self.reviewers))
+        for chunk_number, chunk in enumerate(get_chunks(list(repo_names))):
+            variables = {'owner': self.owner, 'branch': self.branch_name}
+            variables.update({'name%s' %(number): repo_name for number, repo_name in enumerate(chunk)})
+            variables.update({'label%s' %(number): label for number, label in enumerate(self.labels)})
+            label_fields = " ".join("l%s: label(name: $label%s) { id }" %(number, number) for number in range(len(self.labels)))
+            selections = ["  r%s: repository(owner: $owner, name: $name%s) { id pullRequests(headRefName: $branch, states: OPEN, first: 1) "
+                          "{ nodes { id number url title body } } %s }" %(number, number, label_fields) for number in range(len(chunk))]
+            if chunk_number == 0:
+                variables.update({'user%s' %(number): login for number, login in enumerate(logins)})
+                selections += ["  u%s: user(login: $user%s) { id }" %(number, number) for number in range(len(logins))]
+            declarations = ", ".join("$%s: String!" %(name) for name in variables)
+            data, errors = self.client.graphql('graphql open PRs', "query(%s) {\n%s\n}" %(declarations, "\n".join(selections)), variables)
+
+            for number, repo_name in enumerate(chunk):
+                repository = data.get('r%s' %(number))
+                if repository is None:
+                    continue # not found: update_repository() fails on it anyway
+                pulls = repository['pullRequests']['nodes']
+                label_ids = []
+                for label_number, label in enumerate(self.labels):
+                    if repository.get('l%s' %(label_number)):
+                        label_ids.append(repository['l%s' %(label_number)]['id'])
+                    else:
+                        print (u'\u2717', "Label %s not found in %s, it won't be added to the PR..." %(label, repo_name))
+                self.repositories[repo_name] = {'id': repository['id'], 'pull': pulls[0] if pulls else None, 'label_ids': label_ids}
+            if chunk_number == 0:
+                for number, login in enumerate(logins):
+                    if data.get('u%s' %(number)):
+                        self.user_ids[login] = data['u%s' %(number)]['id']
+                    else:
+                        print (u'\u2717', "GitHub user %s not found, they won't be added to the PRs..." %(login))
+        num_open = sum(1 for repository in self.repositories.values() if repository['pull'])
+        print (u'\u2713', "Found %s open PRs for %s across %s repos..." %(num_open, self.branch_name, len(repo_names)))
+
+    def get_open_pull_request(self, repo_name: str) -> dict:
+        '''
+        Returns the open PR of the rollout branch in a repo (as found by lookup()), or None.
+        '''
+        repository = self.repositories.get(repo_name)
+        return repository['pull'] if repository else None
+
+    def add(self, repo_name: str, default_branch: str) -> None:
+        '''
+        Queues a repo whose branch is pushed for submit().
+        '''
+        with self.lock:
+            self.pending[repo_name] = default_branch
+        if self.get_open_pull_request(repo_name):
+            print ("Committed to pre-existing PR for: ", repo_name)
+        else:
+            print ("PR queued for: ", repo_name)
+
+    def run_mutations(self, kind: str, mutations: list) -> tuple:
+        '''
+        Runs mutations BATCH_SIZE at a time.
+
+        Returns:
+        - {alias: result} of the mutations that succeeded and {alias: error message} of the ones that failed
+        '''
+        results, failures = {}, {}
+        for chunk in get_chunks(mutations):
+            document, variables = build_mutation(chunk)
+            data, errors = self.client.graphql(kind, document, variables)
+            messages = get_error_messages(errors)
+            for alias, name, mutation_input, fields in chunk:
+                if data.get(alias) is not None:
+                    results[alias] = data[alias]
+                else:
+                    failures[alias] = messages.get(alias) or messages.get(None) or 'unknown error'
+        return results, failures
+
+    def submit(self) -> dict:
+        '''
+        Creates, updates or skips the PR of every queued repo.
+
+        Returns:
+        - dictionary of {repo name: PR url} for every queued repo whose PR is open (new, updated or left as it was)
+        '''
+        with self.lock:
+            pending = dict(self.pending)
+            self.pending = {}
+        pull_urls, mutations, aliases = {}, [], {}
+        for number, (repo_name, default_branch) in enumerate(sorted(pending.items())):
+            repository = self.repositories.get(repo_name)
+            if repository is None:
+                print (u'\u2717', "Opening PR for %s FAILED. Error: repo not found by the PR lookup..." %(repo_name))
+                continue
+            pull = repository['pull']
+            if pull is None:
+                mutations.append(('c%s' %(number), 'createPullRequest', {'repositoryId': repository['id'], 'baseRefName': default_branch, 'headRefName': self.branch_name,
+                                                                         'title': self.title, 'body': self.body, 'draft': self.draft}, 'pullRequest { id number url }'))
+                aliases['c%s' %(number)] = repo_name
+            elif pull['title'] != self.title or self.is_body_outdated(pull['body']):
+                update = {'pullRequestId': pull['id'], 'title': self.title}
+                if self.is_body_outdated(pull['body']):
+                    update['body'] = self.body
+                mutations.append(('u%s' %(number), 'updatePullRequest', update, 'pullRequest { id url }'))
+                aliases['u%s' %(number)] = repo_name
+            else:
+                pull_urls[repo_name] = pull['url']
+                print (u'\u2713', "PR for %s already up to date: %s" %(repo_name, pull['url']))
+        if not mutations:
+            return pull_urls
+
+        results, failures = self.run_mutations('graphql create/update PRs', mutations)
+        new_pulls = {}
+        for alias, repo_name in aliases.items():
+            if alias in failures:
+                print (u'\u2717', "Opening PR for %s FAILED. Error: %s..." %(repo_name, failures[alias]))
+                continue
+            pull = results[alias]['pullRequest']
+            pull_urls[repo_name] = pull['url']
+            print (u'\u2713', "PR %s for %s: %s" %('created' if alias.startswith('c') else 'updated', repo_name, pull['url']))
+            if alias.startswith('c'):
+                new_pulls[repo_name] = pull['id']
+
+        # labels, assignees and reviewers are only set on new PRs, so re-running a rollout doesn't ping reviewers again
+        follow_ups, follow_up_repos = [], {}
+        assignee_ids, reviewer_ids = self.get_user_ids(self.assignees), self.get_user_ids(self.reviewers)
+        for number, (repo_name, pull_id) in enumerate(sorted(new_pulls.items())):
+            label_ids = self.repositories[repo_name]['label_ids']
+            if label_ids:
+                follow_ups.append(('l%s' %(number), 'addLabelsToLabelable', {'labelableId': pull_id, 'labelIds': label_ids}, 'clientMutationId'))
+            if assignee_ids:
+                follow_ups.append(('a%s' %(number), 'addAssigneesToAssignable', {'assignableId': pull_id, 'assigneeIds': assignee_ids}, 'clientMutationId'))
+            if reviewer_ids:
+                follow_ups.append(('v%s' %(number), 'requestReviews', {'pullRequestId': pull_id, 'userIds': reviewer_ids, 'union': True}, 'clientMutationId'))
+            follow_up_repos[number] = repo_name
+        if follow_ups:
+            results, failures = self.run_mutations('graphql PR labels/assignees/reviewers', follow_ups)
+            for alias, message in sorted(failures.items()):
+                print (u'\u2717', "Setting the %s of the PR for %s FAILED. Error: %s..." %({'l': 'labels', 'a': 'assignees', 'v': 'reviewers'}[alias[0]],
+                                                                                        follow_up_repos[int(alias[1:])], message))
+        return pull_urls
+
+    def is_body_outdated(self, body: str) -> bool:
+        '''
+        Whether the body of an open PR should be rewritten: it differs from the configured body, and wasn't edited since the rollout
+        wrote it (bodies without a BODY_MARKER, or whose text no longer matches its hash, are left to the maintainers).
+        '''
+        text, body_hash = read_body(body)
+        return text != read_body(self.body)[0] and body_hash == get_body_hash(text)
+
+    def get_user_ids(self, logins: list) -> list:
+        return [self.user_ids[login] for login in logins if login in self.user_ids]
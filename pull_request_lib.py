@@ -1,6 +1,3 @@
-# allows you to interact with GitHub repositories and other GitHub resources. It is a wrapper around the GitHub REST API, which means that it allows you to perform all of the same actions that you can perform using the GitHub web interface.
-import github
-
 #  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
 import git
 
@@ -11,6 +8,11 @@ class Author:
     name: str
     email: str
 
+class DivergedBranch(Exception):
+    '''
+    Raised when the branch on origin has a commit the updater didn't make, ie someone pushed a fix to the PR. Stacking the updates on it would revert that commit.
+    '''
+
 def get_pull_request_body(file_path: str) -> str:
     '''
     Reads the content of a Markdown file and stores it as a string.
@@ -26,74 +28,129 @@ def get_pull_request_body(file_path: str) -> str:
         body = f.read()
     return body
 
-def open_pull_request(repo: github.Repository.Repository, branch_name: str, default_branch: str, pr_title: str) -> None:
+def checkout_branch(cloned_repository: git.Repo, branch_name: str, start_point: str = None) -> git.refs.head.Head:
+    '''
+    Essentially the python function version of this terminal command:
+    git checkout -B <branch that may or may not exist yet> [<start point>]
+
+    The branch is always (re)started from the commit that's currently checked out (the tip of the default branch), so the package updates
+    are applied to a clean tree on every run. If the branch already exists on origin, the new commit is built on top of it (see get_parent_commits()).
+
+    Arguments:
+    - branch_name 
+    - cloned repo
+    - start_point: commit to (re)start the branch from instead, ie the default branch after an earlier campaign committed to another branch
     '''
-    Creates pull request with the following body and prints the url to the command line.
+    print ("Checking out branch: %s..." %(branch_name))
+    cloned_repository.git.checkout('-B', branch_name, *([start_point] if start_point else []))
+    print (u'\u2713', "Checked out branch: %s..." %(branch_name))
+    return cloned_repository.active_branch
 
-    Future ideas: add other parameters to the PR a la https://docs.github.com/en/rest/pulls/pulls?apiVersion=2022-11-28#create-a-pull-request
-    - can create them as drafts first
-    - pull default title from set_defaults() method 
-    - can we add assignees or tags?
+def stage_changes(cloned_repository: git.Repo) -> str:
     '''
-    # body = """This pull request was created automatically 🎉:\n- [ ] Ensure `.buildkite/scripts/run_models.sh` has the new run-operation line\n- [ ] Update the package version (currently `v0.UPDATE.UPDATE`) in the `CHANGELOG`\n- [ ] Update project versions in the `dbt_project.yml` and `integration_tests/dbt_project.yml` files\n- [ ] Update Step 2 of the `README` to align either with this [source package example](https://github.com/fivetran/dbt_shopify_source/tree/main#step-2-install-the-package-skip-if-also-using-the-shopify-transformation-package) or this [transform package example](https://github.com/fivetran/dbt_shopify#step-2-install-the-package)"""
-    body = get_pull_request_body('pull_request_body.md')
-    pull = repo.create_pull(
-        title=pr_title,
-        body=body,
-        head=branch_name,
-        base=default_branch,
-    )
+    Stages every change in the clone (including new and removed files) and returns the hash of the resulting tree.
+    The tree hash identifies the content of the package after the updates, whatever commit it ends up in.
 
-    print(pull.html_url)
+    Args:
+    - cloned_repository: where the changes were made
+    '''
+    cloned_repository.git.add(all=True)
+    return cloned_repository.git.write_tree()
 
-def checkout_branch(cloned_repository: git.Repo, branch_name: str) -> git.refs.head.Head:
+def get_staged_paths(cloned_repository: git.Repo) -> list:
     '''
-    Essentially the python function version of this terminal command:
-    git checkout -b <branch that may or may not exist yet>
+    Returns the paths of the files whose staged content differs from HEAD.
+    '''
+    return cloned_repository.git.diff('--cached', '--name-only', 'HEAD').splitlines()
 
-    Arguments:
-    - branch_name 
-    - cloned repo
+def get_tree_hash(cloned_repository: git.Repo, commit: str) -> str:
+    '''
+    Returns the hash of the tree (ie the content) of a commit.
     '''
-    try: 
-        new_branch = cloned_repository.create_head(branch_name) # Create branch if it doesn't exist
-        print ("Creating new branch: %s... " %(branch_name))
-        working_branch = new_branch.checkout()
-        print (u'\u2713', "New branch %s created..." %(branch_name))
-        print (u'\u2713', "Checking out branch: %s..." %(branch_name))
-    except:
-        working_branch = cloned_repository.git.checkout(branch_name)
-        print ("Branch already exists, checking out branch: %s..."%(branch_name))
-    
-    return working_branch
+    return cloned_repository.git.rev_parse(commit + '^{tree}')
 
-def commit_changes(cloned_repository: git.Repo, branch_name: str, commit_message: str, repository_author: Author) -> None:
+def get_remote_branch_tip(cloned_repository: git.Repo, branch_name: str) -> str:
     '''
-    Add and commit local changes to remote.
+    Looks up the branch on origin and makes sure its tip commit is available locally.
+
+    Args:
+    - cloned_repository
+    - branch_name
+
+    Returns:
+    - sha of the branch's tip on origin, or None if the branch doesn't exist on origin yet
+    '''
+    output = cloned_repository.git.ls_remote('--heads', 'origin', 'refs/heads/' + branch_name)
+    if not output:
+        return None
+    remote_tip = output.split()[0]
+    try:
+        cloned_repository.git.cat_file('-e', remote_tip + '^{commit}')
+    except git.GitCommandError:
+        # shallow clones only need the tip itself
+        if cloned_repository.git.rev_parse('--is-shallow-repository') == 'true':
+            cloned_repository.git.fetch('--depth', '1', 'origin', 'refs/heads/' + branch_name)
+        else:
+            cloned_repository.git.fetch('origin', 'refs/heads/' + branch_name)
+    return remote_tip
+
+def is_own_commit(cloned_repository: git.Repo, commit: str, repository_author: Author, known_commits: set = ()) -> bool:
+    '''
+    Checks whether a commit on origin was made by the updater: either it was recorded in the run journal, or its author is `repository_author`.
+
+    Args:
+    - cloned_repository: where the commit is available (see get_remote_branch_tip())
+    - commit: sha of the commit, ie the tip of the branch on origin
+    - repository_author: author of the updater's commits
+    - known_commits: commits the run journal recorded for the repo
+    '''
+    if commit in known_commits:
+        return True
+    return cloned_repository.commit(commit).author.email == repository_author.email
+
+def get_parent_commits(cloned_repository: git.Repo, base_commit: str, remote_tip: str = None) -> list:
+    '''
+    Returns the parents of the updater's commit to a branch: the tip of the default branch if the branch is new, otherwise the tip of the branch on origin
+    (so the push is a fast-forward), and also the tip of the default branch if the branch doesn't contain it yet, ie the default branch moved since the
+    branch was first pushed. The updates are always applied to the tip of the default branch, so that commit is then a merge: the PR's merge-base
+    becomes the new tip of the default branch and the PR only shows the updates, not the upstream changes made in the meantime.
+
+    Args:
+    - cloned_repository
+    - base_commit: the tip of the default branch the updates were applied to
+    - remote_tip: the tip of the branch on origin, None if it isn't there yet (see get_remote_branch_tip())
+    '''
+    if not remote_tip:
+        return [base_commit]
+    try:
+        contains_base = cloned_repository.is_ancestor(base_commit, remote_tip)
+    except git.GitCommandError:
+        contains_base = False # ie the history of a shallow clone stops before it
+    return [remote_tip] if contains_base else [remote_tip, base_commit]
+
+def commit_changes(cloned_repository: git.Repo, branch_name: str, commit_message: str, repository_author: Author, parent_commits: list = None) -> str:
+    '''
+    Commit the staged changes (see stage_changes()) to the checked out branch.
 
     Args:
     - cloned_repository: where the changes were made
     - branch_name: remote branch to push to
     - commit_message
     - repo author: author of the code changes/PR-to-come.
+    - parent_commits: commits to build on instead of HEAD, see get_parent_commits()
+
+    Returns:
+    - sha of the new commit
     '''
-    cloned_repository.git.add(all=True)    
-    cloned_repository.index.commit(commit_message.format(branch_name), author=repository_author)
+    parent_commits = [cloned_repository.commit(parent_commit) for parent_commit in parent_commits] if parent_commits else None
+    commit = cloned_repository.index.commit(commit_message.format(branch_name), author=repository_author, parent_commits=parent_commits)
     print("Committed changes...")
+    return commit.hexsha
 
-def push_changes(cloned_repository: git.Repo, branch_name: str, repo_name: str, repo: github.Repository.Repository, default_branch: str, new_branch: git.refs.head.Head, pr_title: str) -> None:
+def push_branches(cloned_repository: git.Repo, branch_names: list) -> None:
     '''
-    Creates a pull request if one does not exist, otherwise just pushes changes to remote. 
-
-    WIP: this currently uses a ton of arguments that are definitely somewhat duplicative (ie separating names from entities)
+    Pushes the branches to origin in a single push, raising an error if any of them is rejected.
     '''
-    
     origin = cloned_repository.remote(name='origin')
-    try:
-        origin.push(new_branch)
-        open_pull_request(repo, branch_name, default_branch, pr_title)
-        print ("PR created for: ", repo_name)
-    except: 
-        origin.push(branch_name)
-        print ("Committed to pre-existing PR for: ", repo_name)
-    print("Pushed to remote...")
\ No newline at end of file
+    origin.push(list(branch_names)).raise_if_error()
+    print("Pushed %s to remote..." %(", ".join(branch_names)))
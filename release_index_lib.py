@@ -0,0 +1,91 @@
+# the index is stored as JSON
+import json
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# local stuff
+import local_load_lib
+import github_client_lib
+import package_registry_lib
+import pull_request_batch_lib
+import version_range_lib
+
+## Bump this when the stored format changes, older indexes are then rebuilt from scratch
+RELEASE_INDEX_FORMAT_VERSION = 1
+
+## Most recent tags read per package, the latest release is always among them
+TAGS_PER_PACKAGE = 100
+
+class ReleaseIndex:
+    '''
+    Local index of the release tags of every Fivetran dbt package, stored in `.package_updater_cache/release_index.json`.
+
+    refresh() runs once per rollout, after the package registry is refreshed: only packages pushed to since their tags were read
+    (a new tag is a push) are looked up again, in batched GraphQL queries, so keeping all packages up to date costs a request or two.
+    '''
+
+    def __init__(self, owner: str = 'fivetran', index_file: str = None):
+        self.owner = owner
+        self.index_file = index_file or os.path.join(local_load_lib.get_cache_directory(), 'release_index.json')
+        self.repos = {} # repo name -> {'pushed_at': ..., 'tags': [...]}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as file:
+                stored = json.load(file)
+            if stored.get('format') == RELEASE_INDEX_FORMAT_VERSION and stored.get('owner') == owner:
+                self.repos = stored['repos']
+
+    def save(self) -> None:
+        stored = {'format': RELEASE_INDEX_FORMAT_VERSION, 'owner': self.owner, 'repos': dict(sorted(self.repos.items()))}
+        temporary_file = self.index_file + '.tmp'
+        with open(temporary_file, 'w') as file:
+            json.dump(stored, file, separators=(',', ':'))
+        os.replace(temporary_file, self.index_file)
+
+    def fetch_tags(self, client: github_client_lib.GithubClient, repo_names: list) -> dict:
+        '''
+        Reads the most recent tags of packages, BATCH_SIZE packages per GraphQL query.
+
+        Returns:
+        - dictionary of {repo name: list of tag names}, repos that weren't found are left out
+        '''
+        tags = {}
+        for chunk in pull_request_batch_lib.get_chunks(list(repo_names)):
+            variables = {'owner': self.owner}
+            variables.update({'name%s' %(number): repo_name for number, repo_name in enumerate(chunk)})
+            declarations = ", ".join("$%s: String!" %(name) for name in variables)
+            selections = ["  r%s: repository(owner: $owner, name: $name%s) { refs(refPrefix: \"refs/tags/\", first: %s, "
+                          "orderBy: {field: TAG_COMMIT_DATE, direction: DESC}) { nodes { name } } }" %(number, number, TAGS_PER_PACKAGE) for number in range(len(chunk))]
+            data, errors = client.graphql('graphql release tags', "query(%s) {\n%s\n}" %(declarations, "\n".join(selections)), variables)
+            for number, repo_name in enumerate(chunk):
+                repository = data.get('r%s' %(number))
+                if repository is not None:
+                    tags[repo_name] = [node['name'] for node in repository['refs']['nodes']]
+        return tags
+
+    def refresh(self, client: github_client_lib.GithubClient, registry: package_registry_lib.PackageRegistry) -> None:
+        '''
+        Brings the index up to date with the (already refreshed) package registry: the tags of new packages and packages pushed to
+        since they were indexed are read again, and packages that left the registry are dropped.
+        '''
+        stale_repos = {name: package.pushed_at for name, package in registry.packages.items()
+                       if name not in self.repos or self.repos[name]['pushed_at'] != package.pushed_at}
+        for repo_name, tags in self.fetch_tags(client, sorted(stale_repos)).items():
+            self.repos[repo_name] = {'pushed_at': stale_repos[repo_name], 'tags': tags}
+        self.repos = {name: releases for name, releases in self.repos.items() if name in registry.packages}
+        self.save()
+        print (u'\u2713', "Release index up to date: %s packages (%s refreshed)..." %(len(self.repos), len(stale_repos)))
+
+    def get_latest_versions(self) -> dict:
+        '''
+        Returns the latest release of every indexed package, keyed the way packages.yml installs it.
+
+        Returns:
+        - dictionary of {package hub name: version}, ie {'fivetran/jira_source': '0.7.1'}
+        '''
+        latest_versions = {}
+        for repo_name, releases in self.repos.items():
+            latest = version_range_lib.get_latest_version(releases['tags'])
+            if latest is not None:
+                latest_versions[package_registry_lib.get_hub_name(repo_name, self.owner)] = version_range_lib.format_version(latest)
+        return latest_versions
@@ -18,18 +18,36 @@ import ruamel.yaml
 #  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
 import git
 
-def get_github_client(access_token: str) -> github.Github:
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# high-level interface to the operating system's file manipulation functions. It provides a number of functions for copying, moving, deleting, and renaming files and directories.
+import shutil
+
+# used to time each clone
+import time
+
+# local stuff
+import local_load_lib
+import github_client_lib
+import trace_lib
+
+## marker file touched every time a mirror is used, its mtime drives the LRU eviction of the mirror cache
+MIRROR_LAST_USED_FILE = 'package_updater_last_used'
+
+def get_github_client(access_token: str, base_url: str = 'https://api.github.com') -> github_client_lib.GithubClient:
     '''
     Args: 
     - access_token from credentials yaml, see README instructions
+    - base_url of the GitHub API, only needs changing for GitHub Enterprise or the offline benchmark's fake API
     
     Returns:
-    - Github client (an integrated development environment)
+    - rate-limit aware Github client, shared by all repos in the rollout (see github_client_lib)
     '''
-    return github.Github(access_token)
+    return github_client_lib.GithubClient(access_token, base_url=base_url)
 
 
-def setup_repo(client: github.Github, repo_name: str, branch_name: str) -> github.Repository.Repository:
+def setup_repo(client: github_client_lib.GithubClient, repo_name: str, branch_name: str) -> github.Repository.Repository:
     '''
     returns the github repo so we can interact with it
 
@@ -44,49 +62,154 @@ def setup_repo(client: github.Github, repo_name: str, branch_name: str) -> githu
     repo = client.get_repo("Fivetran/" + repo_name)
     return repo
 
-def clone_repo(gh_link: str, path_to_repository: str, ssh_key: str) -> None:
+## extra `git clone` options for each clone-mode. mirror mode is handled by clone_repo_from_mirror()
+CLONE_MODE_OPTIONS = {
+    'full': {},
+    'shallow': {'depth': 1, 'single_branch': True}, # only the tip commit of the default branch
+    'partial': {'depth': 1, 'single_branch': True, 'filter': 'blob:none'}, # as shallow, but file contents are only downloaded when checked out
+}
+
+def clone_repo(gh_link: str, repo_name: str, path_to_repository: str, ssh_key: str, default_branch: str, clone_mode: str = 'full', no_checkout: bool = False) -> tuple:
     ''' 
-    creates (but doesn't return) a cloned repo -> this will get put in the root/repositories/ folder
+    creates a cloned repo of the default branch -> this will get put in the root/repositories/ folder
 
     Args:
     - github repo link
+    - repo name
     - path to repostiory
     - ssh key you created (see README Credential instructions)
+    - default branch of the repo, from the repo metadata fetched in setup_repo() (ie `repo.default_branch`)
+    - clone mode: full, shallow, partial or mirror (`clone-mode` in package_manager.yml)
+    - no_checkout: only fetch the git objects, without writing any files to disk (for the in-memory `commit-mode`)
+
+    Returns:
+    - the cloned git repo and how many seconds the clone took
     '''
-    try:
-        default_branch = "master"
-        cloned_repository = git.Repo.clone_from(gh_link, path_to_repository, branch=default_branch,
-                                            env={"GIT_SSH_COMMAND": 'ssh -i ' + ssh_key})
-    except:
-        default_branch = "main"
-        cloned_repository = git.Repo.clone_from(gh_link, path_to_repository, branch=default_branch,
-                                env={"GIT_SSH_COMMAND": 'ssh -i ' + ssh_key})
-    return cloned_repository, default_branch
+    with trace_lib.span('clone', clone_mode=clone_mode) as attributes:
+        start = time.time()
+        if clone_mode == 'mirror':
+            path_to_mirror = get_mirror_path(repo_name)
+            size_before = get_object_store_size(path_to_mirror) if os.path.exists(path_to_mirror) else 0
+            cloned_repository = clone_repo_from_mirror(gh_link, repo_name, path_to_repository, ssh_key, default_branch, no_checkout=no_checkout)
+            attributes['bytes_transferred'] = get_object_store_size(path_to_mirror) - size_before
+        elif clone_mode in CLONE_MODE_OPTIONS:
+            cloned_repository = git.Repo.clone_from(gh_link, path_to_repository, branch=default_branch,
+                                                env={"GIT_SSH_COMMAND": 'ssh -i ' + ssh_key}, no_checkout=no_checkout, **CLONE_MODE_OPTIONS[clone_mode])
+            cloned_repository.git.update_environment(GIT_SSH_COMMAND='ssh -i ' + ssh_key)
+            attributes['bytes_transferred'] = get_object_store_size(cloned_repository.git_dir)
+        else:
+            raise ValueError("Unknown clone-mode '%s'. Expected one of: full, shallow, partial, mirror" %(clone_mode))
+        clone_seconds = time.time() - start
+    print (u'\u2713', "Cloned %s (%s, %s clone) in %.1fs..." %(repo_name, default_branch, clone_mode, clone_seconds))
+    return cloned_repository, clone_seconds
+
+def get_object_store_size(git_dir: str) -> int:
+    '''
+    Returns the size in bytes of a repo's object database (packs and loose objects), which is what a clone or fetch downloads.
+    '''
+    stats = dict(line.split(': ', 1) for line in git.Git().execute(['git', '--git-dir', git_dir, 'count-objects', '-v']).splitlines())
+    return (int(stats['size']) + int(stats['size-pack'])) * 1024
+
+def get_mirror_path(repo_name: str) -> str:
+    '''
+    Returns where the mirror of a repo is (or would be) stored.
+    '''
+    return os.path.join(local_load_lib.get_cache_directory('mirrors'), repo_name + '.git')
 
-def get_file_paths(repo: github.Repository.Repository) -> list:
+def get_mirror(gh_link: str, repo_name: str, ssh_key: str, fetch: bool = True) -> git.Repo:
     '''
-    takes GitHub repository object as input and returns a list of file paths in the repository that
-    meet the requirements in the last `if` statement of this function
+    Returns the local bare mirror of a repo from `.package_updater_cache/mirrors/`.
+    The first time a repo is used it is cloned in full; on every later run only the new objects are fetched.
 
     Args:
-    - github repo object from setup_repo()
+    - github repo link
+    - repo name, used as the key of the mirror
+    - ssh key you created (see README Credential instructions)
+    - fetch: set to False to use an existing mirror as-is, without any network access
+    '''
+    path_to_mirror = get_mirror_path(repo_name)
+    ssh_env = {"GIT_SSH_COMMAND": 'ssh -i ' + ssh_key}
+    if os.path.exists(path_to_mirror):
+        mirror = git.Repo(path_to_mirror)
+        mirror.git.update_environment(**ssh_env)
+        mirror.git.worktree('prune') # forget worktrees of previous runs, whose folders have been cleared out
+        if fetch:
+            print ("Fetching updates into mirror of %s..." %(repo_name))
+            mirror.git.fetch('origin', '--prune', '--tags')
+    else:
+        print ("Creating mirror of %s..." %(repo_name))
+        mirror = git.Repo.clone_from(gh_link, path_to_mirror, bare=True, env=ssh_env)
+        mirror.git.update_environment(**ssh_env)
+        # a bare clone has no fetch refspec, map remote branches straight onto local ones so `git fetch` keeps them current
+        mirror.git.config('remote.origin.fetch', '+refs/heads/*:refs/heads/*')
+    touch_file(os.path.join(path_to_mirror, MIRROR_LAST_USED_FILE))
+    return mirror
+
+def touch_file(file_path: str) -> None:
+    '''
+    Creates the file if needed and sets its modified time to now (like `touch`).
+    '''
+    with open(file_path, 'a'):
+        os.utime(file_path, None)
+
+def clone_repo_from_mirror(gh_link: str, repo_name: str, path_to_repository: str, ssh_key: str, default_branch: str = None, fetch: bool = True, no_checkout: bool = False) -> git.Repo:
+    '''
+    Clones via the mirror cache: updates the repo's mirror and checks out its default branch
+    in a new worktree at `path_to_repository`. Commits made in the worktree are stored in the mirror and pushed to origin from there.
+
+    Args:
+    - github repo link
+    - repo name
+    - path to repostiory
+    - ssh key you created (see README Credential instructions)
+    - default branch of the repo. If not given, the branch the mirror's HEAD points to (origin's default branch when the mirror was created)
+    - fetch: set to False to check out from an existing mirror without any network access
+    - no_checkout: create the worktree without writing any files to disk (for the in-memory `commit-mode`)
 
     Returns:
-    - list of file paths in the repo 
-    '''
-    file_path_list = []
-    repo_contents = repo.get_contents("") # "" as the `path` loads the contents of the root directory
-    while len(repo_contents) > 1:
-        file_in_dir = repo_contents.pop(0) # removes the file at the top of the list and returns the removed item
-        if file_in_dir.type=='dir':
-            # recursively flatten folders and add contents to repo_contents
-            repo_contents.extend(repo.get_contents(file_in_dir.path))
-        else: 
-            # don't include _tmp models, packages.yml, or buildkite creds
-            # DO include only sql and yml files - update_pre_run
-            if not file_in_dir.name.endswith('tmp.sql') and \
-                not file_in_dir.name.endswith('sample.profiles.yml') and \
-                not file_in_dir.name.endswith('packages.yml') and \
-                (file_in_dir.name.endswith('.sql') or file_in_dir.name.endswith('.yml')):
-                file_path_list.append(file_in_dir.path)
-    return (file_path_list)
\ No newline at end of file
+    - the worktree as a git repo
+    '''
+    mirror = get_mirror(gh_link, repo_name, ssh_key, fetch=fetch)
+    if default_branch is None:
+        default_branch = mirror.git.symbolic_ref('--short', 'HEAD')
+    checkout_options = ['--no-checkout'] if no_checkout else []
+    mirror.git.worktree('add', '--detach', *checkout_options, os.path.abspath(path_to_repository), default_branch)
+    cloned_repository = git.Repo(path_to_repository)
+    cloned_repository.git.update_environment(GIT_SSH_COMMAND='ssh -i ' + ssh_key)
+    return cloned_repository
+
+def get_directory_size(path: str) -> int:
+    '''
+    Returns the total size in bytes of all files in a directory.
+    '''
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+def evict_mirrors(max_size_mb: int, keep: list) -> None:
+    '''
+    Deletes the least recently used mirrors until the mirror cache fits in `max_size_mb`.
+
+    Args:
+    - max_size_mb: disk limit of the mirror cache (`clone-cache-max-size-mb` in package_manager.yml)
+    - keep: names of repos that must not be evicted (ie the ones used in this run)
+    '''
+    mirrors_directory = local_load_lib.get_cache_directory('mirrors')
+    mirrors = []
+    for mirror_name in os.listdir(mirrors_directory):
+        path_to_mirror = os.path.join(mirrors_directory, mirror_name)
+        last_used_file = os.path.join(path_to_mirror, MIRROR_LAST_USED_FILE)
+        last_used = os.path.getmtime(last_used_file) if os.path.exists(last_used_file) else 0
+        mirrors.append((last_used, mirror_name, path_to_mirror, get_directory_size(path_to_mirror)))
+
+    total_size = sum(mirror[3] for mirror in mirrors)
+    for last_used, mirror_name, path_to_mirror, size in sorted(mirrors):
+        if total_size <= max_size_mb * 1024 * 1024:
+            break
+        if mirror_name[:-len('.git')] in keep:
+            continue
+        shutil.rmtree(path_to_mirror)
+        total_size -= size
+        print (u'\u2713', "Evicted %s from the mirror cache (%.1f MB)..." %(mirror_name, size / 1024 / 1024))
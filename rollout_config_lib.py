@@ -0,0 +1,298 @@
+# allows you to read, write, and parse YAML files
+import yaml
+
+# the compiled plan is cached on disk between runs
+import pickle
+
+# used to key the cached plans by the content of package_manager.yml
+import hashlib
+
+# used to suggest the intended key for a misspelled one
+import difflib
+
+# the plan is read like the configurations dictionary it replaces
+import collections.abc
+
+# read-only views of the plan's nested mappings
+import types
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# local stuff
+import local_load_lib
+import package_updates
+import objects
+
+## Bump this when RolloutPlan or the schema changes, plans cached by older versions are then recompiled
+PLAN_FORMAT_VERSION = 6
+
+## Marks the keys package_manager.yml has to set
+REQUIRED = object()
+
+class ConfigError(ValueError):
+    '''
+    Raised when package_manager.yml doesn't match the schema, listing every problem at once.
+    '''
+
+def is_string(value) -> bool:
+    return isinstance(value, str)
+
+def is_flag(value) -> bool:
+    return isinstance(value, bool)
+
+def is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+def is_size(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+def is_string_list(value) -> bool:
+    return value is None or (isinstance(value, list) and all(isinstance(item, str) for item in value))
+
+def is_version_range(value) -> bool:
+    return isinstance(value, str) or (isinstance(value, list) and len(value) > 0 and all(isinstance(item, str) for item in value))
+
+def is_one_of(*choices):
+    check = lambda value: value in choices
+    check.expected = "one of: " + ", ".join(choices)
+    return check
+
+def is_rule_list(value) -> bool:
+    return value is None or (isinstance(value, list) and all(isinstance(item, dict) for item in value))
+
+def is_file_index(value) -> bool:
+    return value is None or (isinstance(value, dict) and all(key in ('include-suffixes', 'exclude-suffixes') and is_string_list(item) for key, item in value.items()))
+
+## What each key of package_manager.yml expects: (check, what the check expects, default)
+SCHEMA = {
+    'pull-request-title': (is_string, "a string", REQUIRED),
+    'branch-name': (is_string, "a string", REQUIRED),
+    'commit-message': (is_string, "a string", REQUIRED),
+    'pull-request-draft': (is_flag, "true or false", False),
+    'pull-request-labels': (is_string_list, "a list of strings", []),
+    'pull-request-assignees': (is_string_list, "a list of strings", []),
+    'pull-request-reviewers': (is_string_list, "a list of strings", []),
+    'pull-request-body': (is_string, "a path", 'pull_request_body.md'),
+    'max-parallel-repos': (is_count, "a whole number of at least 1", 1),
+    'clone-mode': (is_one_of('full', 'shallow', 'partial', 'mirror'), None, 'full'),
+    'clone-cache-max-size-mb': (is_size, "a positive number", 5000),
+    'commit-mode': (is_one_of('worktree', 'in-memory'), None, 'worktree'),
+    'transform-workers': (is_count, "a whole number of at least 1", 1),
+    'search-index': (is_flag, "true or false", False),
+    'repositories-containing': (is_string_list, "a list of strings", []),
+    'streaming-threshold-mb': (is_size, "a positive number", 10),
+    'update-dependency-versions': (is_flag, "true or false", False),
+    'fivetran-utils-version': (is_version_range, "a version range, ie [\">=0.4.0\", \"<0.5.0\"]", None),
+    'version-bump-type': (is_one_of('major', 'minor', 'patch'), None, REQUIRED),
+    'require-dbt-version': (is_version_range, "a version range, ie [\">=1.4.0\", \"<2.0.0\"]", None),
+    'files-to-remove': (is_string_list, "a list of paths", []),
+    'files-to-add': (is_string_list, "a list of paths", []),
+    'files-to-add-to': (is_rule_list, "a list of {file_paths, insert_at_top, new_line} rules", []),
+    'file-index': (is_file_index, "include-suffixes and/or exclude-suffixes lists", None),
+    'find-and-replace': (is_rule_list, "a list of {find, replace} rules", []),
+    'repositories': (is_string_list, "a list of repository names", []),
+    'campaigns': (is_string_list, "a list of paths", []),
+    'watch-interval-seconds': (is_count, "a whole number of at least 1", 30),
+    'watch-max-interval-seconds': (is_count, "a whole number of at least 1", 600),
+}
+
+## Keys only package_manager.yml sets: they apply to the whole rollout, whatever the campaign
+ROLLOUT_KEYS = ['max-parallel-repos', 'clone-mode', 'clone-cache-max-size-mb', 'commit-mode', 'transform-workers', 'search-index',
+                'repositories-containing', 'streaming-threshold-mb', 'file-index', 'repositories', 'campaigns',
+                'watch-interval-seconds', 'watch-max-interval-seconds']
+
+## Keys a campaign file takes from package_manager.yml unless it sets them. Its changes (files-to-add, find-and-replace...) are never inherited
+INHERITED_KEYS = ['pull-request-title', 'branch-name', 'commit-message', 'pull-request-draft', 'pull-request-labels', 'pull-request-assignees',
+                  'pull-request-reviewers', 'pull-request-body', 'version-bump-type']
+
+def validate_rules(config: dict) -> list:
+    '''
+    Checks every files-to-add-to and find-and-replace rule.
+
+    Returns:
+    - list of problems, ie "files-to-add-to[2]: insert_at_top is missing"
+    '''
+    problems = []
+    for number, rule in enumerate(config.get('files-to-add-to') or []):
+        for key, check, expected in [('file_paths', lambda value: is_string_list(value) and bool(value), "a non-empty list of paths"),
+                                     ('insert_at_top', is_flag, "true or false"), ('new_line', is_string, "a string")]:
+            if key not in rule:
+                problems.append("files-to-add-to[%s]: %s is missing" %(number, key))
+            elif not check(rule[key]):
+                problems.append("files-to-add-to[%s]: %s should be %s, not %r" %(number, key, expected, rule[key]))
+        problems += ["files-to-add-to[%s]: unknown key %s" %(number, key) for key in rule if key not in ('file_paths', 'insert_at_top', 'new_line')]
+    for number, rule in enumerate(config.get('find-and-replace') or []):
+        for key in ('find', 'replace'):
+            if key not in rule:
+                problems.append("find-and-replace[%s]: %s is missing" %(number, key))
+            elif isinstance(rule[key], (bool, int, float)):
+                # YAML already turned the text into a value (0.10 -> 0.1, 1_000 -> 1000, yes -> True), so the original text is lost
+                problems.append("find-and-replace[%s]: %s should be a string, not %r (quote the value, ie %s: '...')" %(number, key, rule[key], key))
+            elif not isinstance(rule[key], str):
+                problems.append("find-and-replace[%s]: %s should be a string, not %r" %(number, key, rule[key]))
+        if rule.get('find') == '':
+            problems.append("find-and-replace[%s]: find is empty" %(number))
+        problems += ["find-and-replace[%s]: unknown key %s" %(number, key) for key in rule if key not in ('find', 'replace')]
+    return problems
+
+def validate_config(config: dict, config_file: str = 'package_manager.yml') -> None:
+    '''
+    Checks the configurations loaded from package_manager.yml (or a campaign file) against SCHEMA.
+
+    Raises:
+    - ConfigError listing every missing, misspelled or mistyped key and every broken rule
+    '''
+    if not isinstance(config, dict):
+        raise ConfigError("%s should be a mapping of configurations" %(config_file))
+    problems = []
+    for key, (check, expected, default) in SCHEMA.items():
+        if key not in config:
+            if default is REQUIRED:
+                problems.append("%s is missing" %(key))
+        elif not check(config[key]):
+            problems.append("%s should be %s, not %r" %(key, expected or getattr(check, 'expected'), config[key]))
+    for key in config:
+        if key not in SCHEMA:
+            suggestions = difflib.get_close_matches(str(key), list(SCHEMA), n=1)
+            problems.append("unknown key %s%s" %(key, " (did you mean %s?)" %(suggestions[0]) if suggestions else ""))
+    problems += validate_rules(config)
+    if problems:
+        raise ConfigError("Invalid %s:\n- " %(config_file) + "\n- ".join(problems))
+
+def freeze(value):
+    '''
+    Returns lists as tuples and dictionaries as read-only mappings (recursively), so the plan can't be changed through its values.
+    '''
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, collections.abc.Mapping):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    return value
+
+def thaw(value):
+    '''
+    Returns the tuples and read-only mappings of a plan's values as lists and dictionaries again (recursively), the way YAML loads them.
+    '''
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    if isinstance(value, collections.abc.Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    return value
+
+def get_attribute_name(key: str) -> str:
+    return key.replace('-', '_')
+
+class RolloutPlan(collections.abc.Mapping):
+    '''
+    The validated configurations of a rollout, compiled once from package_manager.yml (see load_rollout_plan()).
+
+    Every key of SCHEMA is an attribute (ie plan.branch_name), and the plan also reads like the configurations dictionary
+    (plan['branch-name'], plan.get('clone-mode')) so it can be handed to everything that took the raw YAML. Keys that
+    package_manager.yml doesn't set read as their default, but only the keys it sets are listed (and fingerprinted by the run journal).
+    The plan is read-only: its lists are tuples, its dictionaries read-only mappings and its attributes can't be set.
+    '''
+    __slots__ = tuple(get_attribute_name(key) for key in SCHEMA) + ('configured_keys', 'replacement_items')
+
+    def __init__(self, config: dict, config_file: str = 'package_manager.yml'):
+        validate_config(config, config_file)
+        for key, (check, expected, default) in SCHEMA.items():
+            value = config[key] if key in config else default
+            object.__setattr__(self, get_attribute_name(key), freeze(value if value is not None or default is None else default))
+        object.__setattr__(self, 'configured_keys', tuple(config))
+        # the find-and-replace rules as {find: replace} items, the form the change set and the process pool workers take
+        # (package_updates.compile_replacements() compiles them into one pattern, once per process)
+        pattern, replacements = package_updates.compile_find_and_replace(self.find_and_replace)
+        object.__setattr__(self, 'replacement_items', tuple(replacements.items()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RolloutPlan is read-only, edit package_manager.yml instead")
+
+    def __getstate__(self) -> tuple:
+        # read-only mappings can't be pickled, they are frozen again by __setstate__()
+        return tuple(thaw(getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state: tuple) -> None:
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, freeze(value))
+
+    def __getitem__(self, key: str):
+        if key not in SCHEMA:
+            raise KeyError(key)
+        return getattr(self, get_attribute_name(key))
+
+    def __iter__(self):
+        return iter(self.configured_keys)
+
+    def __len__(self) -> int:
+        return len(self.configured_keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self.configured_keys
+
+def load_rollout_plan(config_file: str = 'package_manager.yml') -> RolloutPlan:
+    '''
+    Loads the rollout plan of package_manager.yml. The compiled plan is cached in .package_updater_cache/rollout_plans/ by the
+    hash of the file, so an unchanged file isn't parsed again. An invalid file fails here, before anything is cloned or requested.
+
+    Raises:
+    - ConfigError listing every problem with the file
+    '''
+    with open(config_file, 'rb') as file:
+        content = file.read()
+    content_hash = hashlib.sha256(b'%d\0' %(PLAN_FORMAT_VERSION) + content).hexdigest()[:16]
+    cache_file = os.path.join(local_load_lib.get_cache_directory('rollout_plans'), content_hash + '.pickle')
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as file:
+                return pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, TypeError):
+            pass # written by an incompatible version, recompile it
+
+    try:
+        config = yaml.load(content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    except yaml.YAMLError as error:
+        raise ConfigError("Invalid package_manager.yml: %s" %(error))
+    plan = RolloutPlan(config)
+    temporary_file = cache_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        pickle.dump(plan, file)
+    os.replace(temporary_file, cache_file)
+    return plan
+
+def load_campaign_plan(campaign_file: str, config: RolloutPlan) -> RolloutPlan:
+    '''
+    Loads the rollout plan of a campaign file listed in `campaigns`. The campaign takes the rollout settings of package_manager.yml,
+    and its INHERITED_KEYS (ie branch-name) unless it sets them, but only makes the changes it configures itself.
+
+    Raises:
+    - ConfigError listing every problem with the file, including rollout settings it isn't allowed to set
+    '''
+    try:
+        with open(campaign_file, 'rb') as file:
+            campaign = yaml.load(file.read(), Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    except OSError as error:
+        raise ConfigError("Can't read campaign %s: %s" %(campaign_file, error))
+    except yaml.YAMLError as error:
+        raise ConfigError("Invalid %s: %s" %(campaign_file, error))
+    if not isinstance(campaign, dict):
+        raise ConfigError("%s should be a mapping of configurations" %(campaign_file))
+    rollout_keys = [key for key in campaign if key in ROLLOUT_KEYS]
+    if rollout_keys:
+        raise ConfigError("Invalid %s:\n- " %(campaign_file) + "\n- ".join("%s can only be set in package_manager.yml" %(key) for key in rollout_keys))
+    campaign_config = {key: config[key] for key in config if key in ROLLOUT_KEYS + INHERITED_KEYS and key != 'campaigns'}
+    campaign_config.update(campaign)
+    return RolloutPlan(thaw(campaign_config), campaign_file)
+
+def load_campaigns(config: RolloutPlan) -> list:
+    '''
+    Returns the campaigns of a rollout, in the order they are committed: the changes of package_manager.yml first,
+    then those of each file listed in `campaigns`.
+
+    Raises:
+    - ConfigError listing the problems with the first invalid campaign file
+    '''
+    campaigns = [objects.Update('package_manager.yml', config)]
+    for campaign_file in config['campaigns']:
+        campaigns.append(objects.Update(os.path.splitext(os.path.basename(campaign_file))[0], load_campaign_plan(campaign_file, config)))
+    return campaigns
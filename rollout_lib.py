@@ -0,0 +1,199 @@
+# provides a high-level interface for running callables on a pool of worker threads. Our per-repo work is almost entirely network I/O (cloning, pushing, GitHub API calls), so threads are enough to overlap it.
+import concurrent.futures
+
+# lets us keep state (here: which repo a worker thread is currently logging for) that is private to each thread
+import threading
+
+# gives us access to sys.stdout so we can route each worker's print() calls to its own log
+import sys
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# used to time each repo's pipeline
+import time
+
+# used to write the full stack trace of a failed repo into its log
+import traceback
+
+
+class RolloutResult:
+    '''
+    The outcome of running the rollout pipeline for a single repository.
+    '''
+    repo_name: str
+    status: str
+    duration: float
+    error: str
+    log_path: str
+    stats: dict
+
+    def __init__(self, repo_name, status, duration, error, log_path, stats):
+        self.repo_name = repo_name
+        self.status = status
+        self.duration = duration
+        self.error = error
+        self.log_path = log_path
+        self.stats = stats
+
+
+class RepoLogStream:
+    '''
+    Stand-in for sys.stdout while a rollout is running.
+
+    Anything a worker thread prints is written to that repo's own log file and echoed to the console
+    with a `[repo_name]` prefix, one whole line at a time so output from different repos doesn't interleave mid-line.
+    Threads that aren't working on a repo (ie the main thread) write straight through to the console.
+    '''
+
+    def __init__(self, console):
+        self.console = console
+        self.console_lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_repo(self, repo_name: str, log_path: str) -> None:
+        self.local.repo_name = repo_name
+        self.local.log_file = open(log_path, 'w')
+        self.local.pending = ''
+
+    def end_repo(self) -> None:
+        if self.local.pending:
+            self.write('\n')
+        self.local.log_file.close()
+        self.local.repo_name = None
+
+    def write(self, text: str) -> int:
+        repo_name = getattr(self.local, 'repo_name', None)
+        if repo_name is None:
+            with self.console_lock:
+                return self.console.write(text)
+
+        self.local.log_file.write(text)
+        self.local.pending += text
+        *lines, self.local.pending = self.local.pending.split('\n')
+        if lines:
+            with self.console_lock:
+                for line in lines:
+                    self.console.write("[%s] %s\n" %(repo_name, line))
+        return len(text)
+
+    def flush(self) -> None:
+        if getattr(self.local, 'repo_name', None) is not None:
+            self.local.log_file.flush()
+        with self.console_lock:
+            self.console.flush()
+
+
+def run_repository(pipeline, repo_name: str, log_stream: RepoLogStream, log_directory: str) -> RolloutResult:
+    '''
+    Runs the pipeline for one repo with its output routed to `log_directory/repo_name.log`.
+    Any exception is caught and recorded in the result so that one broken repo doesn't stop the others.
+
+    Args:
+    - pipeline: callable taking the repo name, and optionally returning a dictionary of stats to show in the summary
+    - repo_name
+    - log_stream: the RepoLogStream installed as sys.stdout
+    - log_directory: folder the per-repo logs are written to
+    '''
+    log_path = os.path.join(log_directory, repo_name + '.log')
+    log_stream.start_repo(repo_name, log_path)
+    start = time.time()
+    stats = {}
+    try:
+        stats = pipeline(repo_name) or {}
+        status, error = 'success', ''
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        status, error = 'failed', "%s: %s" %(type(e).__name__, e)
+        print (u'\u2717', "Rollout FAILED for %s. Error: %s" %(repo_name, error))
+    finally:
+        duration = time.time() - start
+        log_stream.end_repo()
+    return RolloutResult(repo_name, status, duration, error, log_path, stats)
+
+
+def run_rollout(repo_names: list, pipeline, max_parallel_repos: int, log_directory: str) -> list:
+    '''
+    Runs `pipeline(repo_name)` for every repo, at most `max_parallel_repos` at a time.
+
+    Args:
+    - repo_names: repositories to update (from package_manager.yml)
+    - pipeline: callable doing the clone -> update -> commit -> push -> PR work for one repo
+    - max_parallel_repos: size of the worker pool (`max-parallel-repos` in package_manager.yml)
+    - log_directory: folder each repo's log file is written to
+
+    Returns:
+    - list of RolloutResult objects, in the same order as repo_names
+    '''
+    os.makedirs(log_directory, exist_ok=True)
+    console = sys.stdout
+    log_stream = RepoLogStream(console)
+    sys.stdout = log_stream
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_parallel_repos)) as executor:
+            futures = [executor.submit(run_repository, pipeline, repo_name, log_stream, log_directory) for repo_name in repo_names]
+            results = [future.result() for future in futures]
+    finally:
+        sys.stdout = console
+    return results
+
+
+def run_waves(waves: list, upstream_repos: dict, pipeline, max_parallel_repos: int, log_directory: str) -> list:
+    '''
+    Runs the rollout one wave at a time (see dependency_graph_lib.get_waves()), each wave fully parallel.
+    A repo is skipped if any repo it depends on failed, since its update would build on a change that didn't happen.
+
+    Args:
+    - waves: list of lists of repo names
+    - upstream_repos: {repo name: repos it depends on}
+    - pipeline, max_parallel_repos, log_directory: as for run_rollout()
+
+    Returns:
+    - list of RolloutResult objects, wave by wave
+    '''
+    results = []
+    failed = set()
+    for wave_number, wave in enumerate(waves, 1):
+        if len(waves) > 1:
+            print ("\nWave %s of %s: %s" %(wave_number, len(waves), ", ".join(wave)))
+        runnable = []
+        for repo_name in wave:
+            failed_upstream = [upstream for upstream in upstream_repos.get(repo_name, []) if upstream in failed]
+            if failed_upstream:
+                results.append(RolloutResult(repo_name, 'skipped', 0.0, "upstream %s did not succeed" %(", ".join(failed_upstream)), None, {}))
+                failed.add(repo_name)
+            else:
+                runnable.append(repo_name)
+        wave_results = run_rollout(runnable, pipeline, max_parallel_repos, log_directory)
+        failed.update(result.repo_name for result in wave_results if result.status != 'success')
+        results += wave_results
+    return results
+
+
+def print_summary(results: list) -> None:
+    '''
+    Prints a table with the status, duration and log file (or error) of every repo in the rollout.
+
+    Args:
+    - results: list of RolloutResult objects from run_rollout()
+    '''
+    name_width = max([len('Repository')] + [len(result.repo_name) for result in results])
+    print ("\n%s | %-7s | %9s | %s" %('Repository'.ljust(name_width), 'Status', 'Duration', 'Details'))
+    print ("%s-+-%s-+-%s-+-%s" %('-' * name_width, '-' * 7, '-' * 9, '-' * 20))
+    for result in results:
+        details = result.error.splitlines()[0] if result.error else result.log_path
+        if result.stats:
+            details = ", ".join("%s: %s" %(key, format_stat(value)) for key, value in result.stats.items()) + " | " + details
+        print ("%s | %-7s | %8.1fs | %s" %(result.repo_name.ljust(name_width), result.status, result.duration, details))
+
+    num_failed = len([result for result in results if result.status != 'success'])
+    print ("\n%s / %s repositories updated successfully." %(len(results) - num_failed, len(results)))
+
+
+def format_stat(value) -> str:
+    '''
+    Formats a stat for the summary table, ie {'connector': 3, 'starter': 1} -> connector x3 starter x1
+    '''
+    if isinstance(value, dict):
+        return " ".join("%s x%s" %(key, count) for key, count in value.items()) or '-'
+    return str(value)
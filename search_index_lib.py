@@ -0,0 +1,219 @@
+# the index is stored in a single SQLite database
+import sqlite3
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# the index is read and updated by all rollout worker threads
+import threading
+
+#  The git module in Python provides a way to interact with git repositories. It is a wrapper around the git command line tools, and it provides a high-level API for performing common git operations,
+import git
+
+# gitdb is the object database underneath GitPython, used to read blobs by sha
+import gitdb
+
+# local stuff
+import local_load_lib
+import repo_lib
+
+## Bump this when the stored format changes, older indexes are then rebuilt from scratch
+INDEX_FORMAT_VERSION = 1
+
+## Blobs bigger than this aren't broken into trigrams, they are a candidate for every search instead
+MAX_INDEXED_BLOB_BYTES = 1024 * 1024
+
+## A search only looks up this many of a string's trigrams, which is plenty to narrow it down (and stays under SQLite's limit on query parameters)
+MAX_QUERY_TRIGRAMS = 64
+
+def get_trigrams(content: bytes) -> set:
+    '''
+    Returns every 3 byte sequence of the content, as integers.
+    '''
+    return set(int.from_bytes(content[start:start + 3], 'big') for start in range(len(content) - 2))
+
+class SearchIndex:
+    '''
+    Trigram index of the default branch of every cached package, stored in .package_updater_cache/search_index.sqlite.
+
+    Each repo is indexed at a commit SHA, and only re-indexed when its default branch moves. Blobs are indexed once whatever
+    the number of repos and commits they appear in, so re-indexing a repo only reads the files that changed.
+    A string can only be in a file if every trigram of the string is in the file: search() uses that to find the candidate files
+    of a string without reading any of them, and checks the candidates against their content in the mirror.
+    '''
+
+    def __init__(self, index_file: str = None):
+        self.index_file = index_file or os.path.join(local_load_lib.get_cache_directory(), 'search_index.sqlite')
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.index_file, check_same_thread=False)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_FORMAT_VERSION:
+            self.connection.executescript('''
+                DROP TABLE IF EXISTS repos; DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS blobs; DROP TABLE IF EXISTS trigrams;
+                CREATE TABLE repos (repo_name TEXT PRIMARY KEY, commit_sha TEXT NOT NULL);
+                CREATE TABLE files (repo_name TEXT NOT NULL, path TEXT NOT NULL, blob_id INTEGER NOT NULL, PRIMARY KEY (repo_name, path)) WITHOUT ROWID;
+                CREATE TABLE blobs (blob_id INTEGER PRIMARY KEY, blob_sha TEXT NOT NULL UNIQUE, indexed INTEGER NOT NULL);
+                CREATE TABLE trigrams (trigram INTEGER NOT NULL, blob_id INTEGER NOT NULL, PRIMARY KEY (trigram, blob_id)) WITHOUT ROWID;
+                PRAGMA user_version = %s;
+            ''' %(INDEX_FORMAT_VERSION))
+
+    def get_commit_sha(self, repo_name: str) -> str:
+        '''
+        Returns the commit a repo is indexed at, or None if it isn't indexed.
+        '''
+        with self.lock:
+            row = self.connection.execute("SELECT commit_sha FROM repos WHERE repo_name = ?", (repo_name,)).fetchone()
+        return row[0] if row else None
+
+    def get_indexed_repos(self) -> list:
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT repo_name FROM repos ORDER BY repo_name")]
+
+    def index_commit(self, repo_name: str, repository: git.Repo, commit_sha: str) -> bool:
+        '''
+        Indexes the tree of a commit as the content of a repo, reading only the blobs that aren't indexed yet.
+        The repo must have the blobs of the commit (a full, shallow or mirror clone, not a partial one).
+
+        Returns:
+        - whether the repo had to be (re-)indexed
+        '''
+        if self.get_commit_sha(repo_name) == commit_sha:
+            return False
+        entries = []
+        for line in repository.git.ls_tree('-r', '-z', commit_sha).split('\0'):
+            if line:
+                info, path = line.split('\t', 1)
+                mode, object_type, blob_sha = info.split(' ')
+                if object_type == 'blob':
+                    entries.append((path, blob_sha))
+        with self.lock:
+            known_blobs = set(row[0] for row in self.connection.execute("SELECT blob_sha FROM blobs"))
+        new_blobs = {}
+        for path, blob_sha in entries:
+            if blob_sha in known_blobs or blob_sha in new_blobs:
+                continue
+            blob = repository.odb.stream(gitdb.util.hex_to_bin(blob_sha))
+            new_blobs[blob_sha] = get_trigrams(blob.read()) if blob.size <= MAX_INDEXED_BLOB_BYTES else None
+
+        with self.lock, self.connection:
+            for blob_sha, trigrams in new_blobs.items():
+                cursor = self.connection.execute("INSERT OR IGNORE INTO blobs (blob_sha, indexed) VALUES (?, ?)", (blob_sha, trigrams is not None))
+                if not cursor.rowcount:
+                    continue # indexed in the meantime, for another repo
+                blob_id = cursor.lastrowid
+                self.connection.executemany("INSERT INTO trigrams (trigram, blob_id) VALUES (?, ?)", [(trigram, blob_id) for trigram in trigrams or []])
+            self.connection.execute("DELETE FROM files WHERE repo_name = ?", (repo_name,))
+            self.connection.executemany("INSERT INTO files (repo_name, path, blob_id) SELECT ?, ?, blob_id FROM blobs WHERE blob_sha = ?",
+                                        [(repo_name, path, blob_sha) for path, blob_sha in entries])
+            self.connection.execute("INSERT OR REPLACE INTO repos (repo_name, commit_sha) VALUES (?, ?)", (repo_name, commit_sha))
+        print (u'\u2713', "Indexed %s for search at %s (%s new blobs)..." %(repo_name, commit_sha[:7], len(new_blobs)))
+        return True
+
+    def index_mirrors(self, repo_names: list) -> None:
+        '''
+        Brings the index up to date with the default branch of every cached mirror, without any network access.
+        Repos without a mirror are left as they are, and blobs no repo uses anymore are dropped.
+        '''
+        reindexed = False
+        for repo_name in repo_names:
+            path_to_mirror = repo_lib.get_mirror_path(repo_name)
+            if not os.path.exists(path_to_mirror):
+                continue
+            mirror = git.Repo(path_to_mirror)
+            try:
+                reindexed = self.index_commit(repo_name, mirror, mirror.head.commit.hexsha) or reindexed
+            except (ValueError, git.GitCommandError) as error: # ie an empty mirror
+                print (u'\u2717', "Indexing %s for search FAILED. Error: %s..." %(repo_name, error))
+        if not reindexed:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM trigrams WHERE blob_id NOT IN (SELECT blob_id FROM files)")
+            self.connection.execute("DELETE FROM blobs WHERE blob_id NOT IN (SELECT blob_id FROM files)")
+
+    def get_candidates(self, text: str, repo_names: list = None) -> dict:
+        '''
+        Returns the files that may contain `text`, from the index alone: files with every trigram of the text, and files too big to be indexed.
+        Texts shorter than 3 bytes have no trigrams, so every file is a candidate.
+
+        Returns:
+        - dictionary of {repo name: list of file paths}
+        '''
+        trigrams = sorted(get_trigrams(text.encode()))[:MAX_QUERY_TRIGRAMS]
+        query = "SELECT files.repo_name, files.path FROM files JOIN blobs ON blobs.blob_id = files.blob_id WHERE blobs.indexed = 0"
+        parameters = []
+        if trigrams:
+            query += (" OR files.blob_id IN (SELECT blob_id FROM trigrams WHERE trigram IN (%s) GROUP BY blob_id HAVING COUNT(*) = %s)"
+                      %(", ".join("?" * len(trigrams)), len(trigrams)))
+            parameters += trigrams
+        else:
+            query += " OR blobs.indexed = 1"
+        candidates = {}
+        with self.lock:
+            for repo_name, path in self.connection.execute(query + " ORDER BY files.repo_name, files.path", parameters):
+                if repo_names is None or repo_name in repo_names:
+                    candidates.setdefault(repo_name, []).append(path)
+        return candidates
+
+    def get_candidate_paths(self, repo_name: str, commit_sha: str, texts: list) -> set:
+        '''
+        Returns the paths of a repo's commit that may contain any of `texts`, or None if the repo isn't indexed at that commit (every file is then a candidate).
+        '''
+        if not texts or self.get_commit_sha(repo_name) != commit_sha:
+            return None
+        candidate_paths = set()
+        for text in texts:
+            candidate_paths.update(self.get_candidates(text, [repo_name]).get(repo_name, []))
+        return candidate_paths
+
+    def search(self, text: str, repo_names: list = None) -> dict:
+        '''
+        Finds the files that contain `text` in the indexed repos. The candidates from the index are checked against their content
+        in the repo's mirror, if it is cached.
+
+        Args:
+        - text: the string to look for (case-sensitive, like find-and-replace)
+        - repo_names: only search these repos (all indexed repos if None)
+
+        Returns:
+        - dictionary of {repo name: list of file paths}
+        '''
+        matches = {}
+        with self.lock:
+            blob_shas = dict(((repo_name, path), blob_sha) for repo_name, path, blob_sha in self.connection.execute(
+                "SELECT files.repo_name, files.path, blobs.blob_sha FROM files JOIN blobs ON blobs.blob_id = files.blob_id"))
+        for repo_name, paths in self.get_candidates(text, repo_names).items():
+            path_to_mirror = repo_lib.get_mirror_path(repo_name)
+            if not os.path.exists(path_to_mirror):
+                matches[repo_name] = paths
+                continue
+            mirror = git.Repo(path_to_mirror)
+            found = [path for path in paths if text.encode() in mirror.odb.stream(gitdb.util.hex_to_bin(blob_shas[(repo_name, path)])).read()]
+            if found:
+                matches[repo_name] = found
+        return matches
+
+def select_repositories(search_index: SearchIndex, repo_names: list, texts: list) -> list:
+    '''
+    Keeps the repos that contain at least one of `texts` (`repositories-containing` in package_manager.yml).
+    Repos that aren't indexed yet can't be ruled out, so they are kept too.
+
+    Args:
+    - search_index: the search index, brought up to date with the mirrors
+    - repo_names: repos to choose from, in rollout order
+    - texts: strings to look for
+
+    Returns:
+    - list of repo names, in the order of `repo_names`
+    '''
+    indexed_repos = set(search_index.get_indexed_repos())
+    matching_repos = set()
+    for text in texts:
+        matching_repos.update(search_index.search(text, [repo_name for repo_name in repo_names if repo_name in indexed_repos]))
+    selected = []
+    for repo_name in repo_names:
+        if repo_name not in indexed_repos:
+            print ("%s isn't indexed for search yet, keeping it in the rollout..." %(repo_name))
+            selected.append(repo_name)
+        elif repo_name in matching_repos:
+            selected.append(repo_name)
+    print (u'\u2713', "%s of %s repositories contain %s..." %(len(selected), len(repo_names), " or ".join("'%s'" %(text) for text in texts)))
+    return selected
@@ -0,0 +1,193 @@
+# used to turn span() into a context manager
+import contextlib
+
+# used to profile the transformation stages when running with --profile
+import cProfile
+import pstats
+
+# spans are written as JSON lines (and optionally a Chrome trace)
+import json
+
+# The os module in Python provides a portable way of using operating system dependent functionality. It provides a number of functions for interacting with the file system, processes, and other operating system resources.
+import os
+
+# spans are recorded from all rollout worker threads
+import threading
+
+# used to time spans
+import time
+
+class Tracer:
+    '''
+    Records timed spans for the stages of a rollout (clone, get_file_paths, transform, commit, push, pull_request, ...).
+
+    Each span carries the repo name, its duration, the GitHub API calls made while it was open, and whatever the stage reports
+    (ie bytes transferred or files touched). Spans are appended to `trace.jsonl` as they finish. They can also be exported
+    as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) to see where the minutes of a rollout go.
+    '''
+
+    def __init__(self, trace_directory: str, api_call_counter=None, chrome_trace: bool = False, profile: bool = False):
+        self.trace_directory = trace_directory
+        self.api_call_counter = api_call_counter # callable returning the number of API calls made so far by the calling thread
+        self.chrome_trace = chrome_trace
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.spans = []
+        self.thread_ids = {}
+        self.profile_counts = {}
+        os.makedirs(trace_directory, exist_ok=True)
+        self.trace_file = open(os.path.join(trace_directory, 'trace.jsonl'), 'w')
+
+    def record(self, span: dict) -> None:
+        with self.lock:
+            self.spans.append(span)
+            self.trace_file.write(json.dumps(span, default=str) + '\n')
+            self.trace_file.flush()
+
+    def get_thread_id(self) -> int:
+        '''
+        Small, stable id of the calling thread for the Chrome trace.
+        '''
+        with self.lock:
+            return self.thread_ids.setdefault(threading.get_ident(), len(self.thread_ids) + 1)
+
+    def get_profile_path(self, repo_name: str, name: str) -> str:
+        '''
+        Path of the cProfile output of a stage: `profiles/<repo>.<stage>.prof`, numbered from the second time the stage
+        is profiled for the repo (ie `<repo>.transform.2.prof` for its second campaign) so no profile overwrites another.
+        '''
+        with self.lock:
+            count = self.profile_counts[(repo_name, name)] = self.profile_counts.get((repo_name, name), 0) + 1
+        profile_directory = os.path.join(self.trace_directory, 'profiles')
+        os.makedirs(profile_directory, exist_ok=True)
+        file_name = '%s.%s.prof' %(repo_name or 'run', name) if count == 1 else '%s.%s.%s.prof' %(repo_name or 'run', name, count)
+        return os.path.join(profile_directory, file_name)
+
+    def close(self) -> None:
+        '''
+        Closes trace.jsonl, writes the Chrome trace if asked to, and prints a summary of the time spent in each stage.
+        '''
+        self.trace_file.close()
+        if self.chrome_trace:
+            write_chrome_trace(self.spans, os.path.join(self.trace_directory, 'trace.chrome.json'))
+        print_stage_summary(self.spans)
+        if self.profile:
+            print_profile_summary(os.path.join(self.trace_directory, 'profiles'))
+
+## The tracer of the current run (None when tracing is off, then span() only times the stage for its caller)
+tracer = None
+local = threading.local()
+
+def start(trace_directory: str, api_call_counter=None, chrome_trace: bool = False, profile: bool = False) -> Tracer:
+    '''
+    Turns on tracing for the run.
+
+    Args:
+    - trace_directory: folder trace.jsonl (and trace.chrome.json / profiles/) are written to
+    - api_call_counter: callable returning the number of GitHub API calls made so far by the calling thread
+    - chrome_trace: also write the spans as a Chrome trace when the run finishes
+    - profile: capture cProfile output for the transformation stages
+    '''
+    global tracer
+    tracer = Tracer(trace_directory, api_call_counter, chrome_trace, profile)
+    return tracer
+
+def stop() -> None:
+    '''
+    Turns off tracing and writes out the results of the run.
+    '''
+    global tracer
+    if tracer is not None:
+        tracer.close()
+        tracer = None
+
+def set_repo(repo_name: str) -> None:
+    '''
+    Sets the repo the calling thread is working on, so every span it opens is tagged with it.
+    '''
+    local.repo_name = repo_name
+
+@contextlib.contextmanager
+def span(name: str, profile: bool = False, **attributes):
+    '''
+    Times a stage of the rollout. Yields a dictionary the stage can add its own attributes to (ie files_touched).
+
+        with trace_lib.span('clone', clone_mode='mirror') as attributes:
+            ...
+            attributes['bytes_transferred'] = size
+
+    Args:
+    - name: name of the stage
+    - profile: run the stage under cProfile if the run was started with --profile
+    - attributes: anything else to record with the span
+    '''
+    current_tracer = tracer
+    repo_name = getattr(local, 'repo_name', None)
+    api_calls_before = current_tracer.api_call_counter() if current_tracer and current_tracer.api_call_counter else None
+    profiler = cProfile.Profile() if current_tracer and current_tracer.profile and profile else None
+    start_time = time.time()
+    if profiler:
+        try:
+            profiler.enable()
+        except ValueError: # from python 3.12 only one profiler can run at a time, the stages of the other repos are timed but not profiled
+            profiler = None
+    try:
+        yield attributes
+    except BaseException as error:
+        attributes['error'] = "%s: %s" %(type(error).__name__, error)
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        duration = time.time() - start_time
+        if current_tracer is not None:
+            span_record = dict(name=name, repo=repo_name, start=start_time, duration=duration, thread=current_tracer.get_thread_id(), **attributes)
+            if api_calls_before is not None:
+                span_record['api_calls'] = current_tracer.api_call_counter() - api_calls_before
+            current_tracer.record(span_record)
+            if profiler:
+                profiler.dump_stats(current_tracer.get_profile_path(repo_name, name))
+
+def write_chrome_trace(spans: list, path: str) -> None:
+    '''
+    Writes spans in the Chrome trace event format, one row per worker thread.
+    '''
+    events = []
+    for span_record in spans:
+        arguments = {key: value for key, value in span_record.items() if key not in ('name', 'start', 'duration', 'thread')}
+        events.append({'name': span_record['name'], 'cat': 'rollout', 'ph': 'X', 'pid': 1, 'tid': span_record['thread'],
+                       'ts': int(span_record['start'] * 1e6), 'dur': int(span_record['duration'] * 1e6), 'args': arguments})
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, default=str)
+    print ("Chrome trace written to %s" %(path))
+
+def print_stage_summary(spans: list) -> None:
+    '''
+    Prints the total and average time spent in each stage across all repos.
+    '''
+    totals = {}
+    for span_record in spans:
+        total = totals.setdefault(span_record['name'], {'seconds': 0.0, 'count': 0, 'api_calls': 0})
+        total['seconds'] += span_record['duration']
+        total['count'] += 1
+        total['api_calls'] += span_record.get('api_calls') or 0
+    if not totals:
+        return
+    print ("\n%-16s %10s %8s %10s %10s" %('Stage', 'Total (s)', 'Calls', 'Avg (s)', 'API calls'))
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        print ("%-16s %10.2f %8s %10.3f %10s" %(name, total['seconds'], total['count'], total['seconds'] / total['count'], total['api_calls']))
+
+def print_profile_summary(profile_directory: str, limit: int = 20) -> None:
+    '''
+    Combines the cProfile output of every profiled stage into `profile_directory/combined.prof` and prints the hottest functions.
+    '''
+    if not os.path.isdir(profile_directory):
+        return
+    profile_files = sorted(os.path.join(profile_directory, file) for file in os.listdir(profile_directory) if file.endswith('.prof') and file != 'combined.prof')
+    if not profile_files:
+        return
+    stats = pstats.Stats(*profile_files)
+    stats.dump_stats(os.path.join(profile_directory, 'combined.prof'))
+    print ("\nProfile of the transformation stages (%s/combined.prof):" %(profile_directory))
+    stats.sort_stats('cumulative').print_stats(limit)
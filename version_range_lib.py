@@ -0,0 +1,58 @@
+# regex
+import re
+
+## The comparison operators a dbt version range can use, an exact version has none
+OPERATORS = ['>=', '<=', '>', '<', '==', '=']
+
+## X.Y.Z with an optional leading v (as release tags are often named), pre-releases like 0.7.0-b1 are left out
+VERSION_PATTERN = re.compile(r'^v?(\d+)\.(\d+)\.(\d+)$')
+
+def parse_version(text: str) -> tuple:
+    '''
+    Returns a version as a comparable tuple, ie 'v0.7.1' -> (0, 7, 1), or None if it isn't a release version.
+    '''
+    match = VERSION_PATTERN.match(str(text).strip())
+    return tuple(int(part) for part in match.groups()) if match else None
+
+def format_version(version: tuple) -> str:
+    return '.'.join(str(part) for part in version)
+
+def parse_version_range(version_range) -> list:
+    '''
+    Parses a dbt version range, as written in packages.yml or package_manager.yml, into constraints.
+
+    Args:
+    - version_range: list or string of version constraints, ie [">=0.4.0", "<0.5.0"], ">=1.4.0" or "0.4.1"
+
+    Returns:
+    - list of (operator, version tuple), ie [('>=', (0, 4, 0)), ('<', (0, 5, 0))]. An exact version has the operator '='
+
+    Raises:
+    - ValueError if a constraint isn't a comparison with a release version
+    '''
+    constraints = []
+    for constraint in [version_range] if isinstance(version_range, str) else list(version_range):
+        text = str(constraint).strip()
+        operator = next((operator for operator in OPERATORS if text.startswith(operator)), '=')
+        version = parse_version(text[len(operator):] if text.startswith(operator) else text)
+        if version is None:
+            raise ValueError("Can't parse version constraint %r" %(constraint))
+        constraints.append(('=' if operator == '==' else operator, version))
+    return constraints
+
+def is_satisfied(version: tuple, constraints: list) -> bool:
+    '''
+    Checks whether a version meets every constraint of a range (from parse_version_range()).
+    '''
+    checks = {'>=': lambda bound: version >= bound, '<=': lambda bound: version <= bound, '>': lambda bound: version > bound,
+              '<': lambda bound: version < bound, '=': lambda bound: version == bound}
+    return all(checks[operator](bound) for operator, bound in constraints)
+
+def get_latest_version(versions: list, constraints: list = None) -> tuple:
+    '''
+    Returns the highest release version (as a tuple) among version strings or release tags, optionally only among those meeting `constraints`.
+    Returns None if there is none.
+    '''
+    parsed = [version for version in (parse_version(text) for text in versions) if version is not None]
+    candidates = [version for version in parsed if constraints is None or is_satisfied(version, constraints)]
+    return max(candidates) if candidates else None